@@ -0,0 +1,94 @@
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import numpy as np
+from scipy import ndimage
+
+from utils.morphology import cross_dilation, cube_closing
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the morphology benchmark.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Time the morphology helpers of OpenMAP-T1 against the scipy.ndimage calls they replace.")
+    parser.add_argument(
+        "--masks",
+        type=int,
+        default=5,
+        help="Number of random masks per operation (default: 5).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the random masks (default: 0).",
+    )
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+def random_mask(shape, rng):
+    """
+    Build a noisy ellipsoid mask with holes, touching the border of the volume on one side.
+
+    Args:
+        shape (tuple[int, int, int]): Shape of the volume.
+        rng (numpy.random.Generator): Random generator.
+
+    Returns:
+        numpy.ndarray: Boolean mask.
+    """
+    grid = np.indices(shape, dtype=np.float32)
+    center = np.array(shape, dtype=np.float32)[:, None, None, None] * rng.uniform(0.35, 0.65, size=(3, 1, 1, 1))
+    radius = np.array(shape, dtype=np.float32)[:, None, None, None] * rng.uniform(0.2, 0.4, size=(3, 1, 1, 1))
+    mask = (((grid - center) / radius) ** 2).sum(axis=0) < 1
+    mask &= rng.random(shape) > 0.05
+    mask[: rng.integers(1, 4)] |= rng.random((1,) + shape[1:]) > 0.7
+    return mask
+
+
+def compare(name, reference, fast, masks):
+    """
+    Time a scipy operation and its replacement on every mask.
+
+    Equivalence of the results is covered by tests/test_morphology.py.
+    """
+    times = {"scipy": 0.0, "fast": 0.0}
+    for mask in masks:
+        start = time.perf_counter()
+        reference(mask)
+        times["scipy"] += time.perf_counter() - start
+        start = time.perf_counter()
+        fast(mask)
+        times["fast"] += time.perf_counter() - start
+    print(f"{name}: scipy {times['scipy']:.2f} s, fast {times['fast']:.2f} s ({times['scipy'] / max(times['fast'], 1e-9):.1f}x)")
+
+
+def main():
+    """
+    Time the closing of the face-cropping mask and the dilations of the hemisphere
+    labels against the scipy calls they replace, on full-size random masks.
+    """
+    opt = create_parser()
+    rng = np.random.default_rng(opt.seed)
+
+    masks = [random_mask((256, 256, 256), rng) for _ in range(opt.masks)] + [np.zeros((256, 256, 256), dtype=bool)]
+    selem = np.ones((3, 3, 3), dtype=bool)
+    compare("closing", lambda m: ndimage.binary_closing(m, structure=selem, iterations=3), lambda m: cube_closing(m, iterations=3), masks)
+
+    masks = [random_mask((224, 224, 224), rng) for _ in range(opt.masks)] + [np.zeros((224, 224, 224), dtype=bool)]
+    compare("dilation", lambda m: ndimage.binary_dilation(m, iterations=5), lambda m: cross_dilation(m, iterations=5), masks)
+
+
+if __name__ == "__main__":
+    main()
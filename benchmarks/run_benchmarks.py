@@ -0,0 +1,210 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
+
+import nibabel as nib
+import numpy as np
+import scipy
+import SimpleITK as sitk
+import torch
+
+from parcellation import add_pipeline_arguments, infer_subject, load_subject, write_subject
+from synthetic import random_models, synthetic_t1
+from utils.profiling import peak_rss
+
+# Benchmark cases: name → (shape, voxel size in mm)
+CASES = {
+    "anisotropic": ((160, 256, 256), (1.2, 0.94, 0.94)),
+    "sagittal": ((176, 240, 256), (1.0, 1.0, 1.0)),
+    "conformed": ((256, 256, 256), (1.0, 1.0, 1.0)),
+    "highres": ((320, 320, 320), (0.7, 0.7, 0.7)),
+}
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the benchmark suite.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Benchmark the OpenMAP-T1 pipeline on synthetic volumes with randomly initialized networks.")
+    parser.add_argument(
+        "--results",
+        default="benchmark.json",
+        help="JSON file where the results are written (default: benchmark.json).",
+    )
+    parser.add_argument(
+        "--cases",
+        nargs="+",
+        default=["anisotropic", "sagittal", "conformed"],
+        choices=list(CASES),
+        help="Synthetic volumes to benchmark (default: anisotropic sagittal conformed).",
+    )
+    parser.add_argument(
+        "--repeats",
+        type=int,
+        default=3,
+        help="Number of timed runs per case (default: 3).",
+    )
+    parser.add_argument(
+        "--warmup",
+        type=int,
+        default=1,
+        help="Number of untimed runs before the first case (default: 1).",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="Number of intra-op threads used by torch (default: torch default).",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=0,
+        help="Seed of the synthetic volumes and network weights (default: 0).",
+    )
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+def environment():
+    """
+    Describe the software and hardware the benchmark runs on.
+
+    Returns:
+        dict: Versions of the main dependencies, the platform and the thread settings.
+    """
+    return {
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "torch_threads": torch.get_num_threads(),
+        "torch": torch.__version__,
+        "numpy": np.__version__,
+        "scipy": scipy.__version__,
+        "nibabel": nib.__version__,
+        "SimpleITK": sitk.Version_VersionString(),
+    }
+
+
+def run_case(path, models, device, opt):
+    """
+    Run the whole pipeline on one input and collect its measurements.
+
+    Args:
+        path (str): Input NIfTI file.
+        models (tuple): The (cnet, ssnet, pnet, hnet) networks.
+        device (torch.device): Device used for inference.
+        opt (argparse.Namespace): Pipeline options.
+
+    Returns:
+        dict: End-to-end wall time, peak RSS and the per-stage records of ``utils.profiling``.
+    """
+    start = time.perf_counter()
+    case = load_subject(path, opt)
+    profile = case["profile"]
+    case = infer_subject(case, models, device, opt)
+    if case is not None:
+        write_subject(case, opt)
+    seconds = time.perf_counter() - start
+    return {"end_to_end_seconds": seconds, "peak_rss_bytes": peak_rss(), "stages": profile.to_dict()["stages"]}
+
+
+def summarize(runs):
+    """
+    Reduce the timed runs of one case to medians.
+
+    Args:
+        runs (list[dict]): Results of :func:`run_case`.
+
+    Returns:
+        dict: Median end-to-end time, throughput, peak RSS and median wall time and slices/sec of each stage.
+    """
+    seconds = statistics.median(run["end_to_end_seconds"] for run in runs)
+    stages = {}
+    for run in runs:
+        for stage in run["stages"]:
+            entry = stages.setdefault(stage["name"], {"wall_seconds": [], "slices_per_second": []})
+            entry["wall_seconds"].append(stage["wall_seconds"])
+            slices = sum(view["slices"] for view in stage["views"])
+            view_seconds = sum(view["wall_seconds"] for view in stage["views"])
+            if view_seconds:
+                entry["slices_per_second"].append(slices / view_seconds)
+    return {
+        "end_to_end_seconds": seconds,
+        "subjects_per_hour": 3600.0 / seconds,
+        "peak_rss_bytes": max(run["peak_rss_bytes"] or 0 for run in runs),
+        "stages": {
+            name: {
+                "wall_seconds": statistics.median(entry["wall_seconds"]),
+                "slices_per_second": statistics.median(entry["slices_per_second"]) if entry["slices_per_second"] else None,
+            }
+            for name, entry in stages.items()
+        },
+    }
+
+
+def main():
+    """
+    Benchmark every pipeline stage on synthetic inputs, without pretrained weights.
+
+    For each case a synthetic T1-like volume is written to a temporary folder and
+    processed ``--repeats`` times by the same load → infer → write functions as
+    ``src/parcellation.py``, with randomly initialized networks of the real channel
+    configurations. The per-run measurements and per-case medians are written as JSON.
+
+    Peak RSS is a process-wide high-water mark, so cases are best listed from the
+    smallest to the largest volume.
+    """
+    opt = create_parser()
+    if opt.threads is not None:
+        torch.set_num_threads(opt.threads)
+    device = torch.device("cpu")
+
+    models = random_models(device, opt.seed, opt.fold_bn, opt.precision, opt.channels_last)
+    results = {"environment": environment(), "options": dict(vars(opt)), "cases": {}}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        input_dir = os.path.join(tmp, "input")
+        opt.o = os.path.join(tmp, "output")
+        os.makedirs(input_dir)
+
+        paths = {}
+        for name in opt.cases:
+            shape, voxel_size = CASES[name]
+            paths[name] = os.path.join(input_dir, f"{name}.nii.gz")
+            nib.save(synthetic_t1(shape, voxel_size, opt.seed), paths[name])
+
+        for _ in range(opt.warmup):
+            run_case(paths[opt.cases[0]], models, device, opt)
+
+        for name in opt.cases:
+            runs = []
+            for repeat in range(opt.repeats):
+                run = run_case(paths[name], models, device, opt)
+                runs.append(run)
+                print(f"{name} #{repeat + 1}: {run['end_to_end_seconds']:.1f} s")
+            shape, voxel_size = CASES[name]
+            results["cases"][name] = {"shape": shape, "voxel_size": voxel_size, "summary": summarize(runs), "runs": runs}
+
+    os.makedirs(os.path.dirname(os.path.abspath(opt.results)), exist_ok=True)
+    with open(opt.results, "w") as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {opt.results}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,83 @@
+import nibabel as nib
+import numpy as np
+import torch
+
+from utils.backend import MODEL_SPECS
+from utils.load_model import optimize_model
+from utils.network import UNet
+
+# Bias of the output layer of the randomly initialized mask networks (CNet, SSNet). It pushes
+# their sigmoid above 0.5 everywhere, so that the cropping and brain masks are never empty and
+# every downstream stage processes a full-size volume.
+MASK_LOGIT_BIAS = 4.0
+
+
+def synthetic_t1(shape, voxel_size, seed=0):
+    """
+    Generate a T1-weighted-like head volume.
+
+    The volume holds an ellipsoidal head made of scalp, a dark skull shell, grey matter,
+    white matter and two CSF-filled ventricles, multiplied by a smooth bias field and
+    corrupted by Rician-like noise. It is meant to exercise the pipeline with realistic
+    intensity statistics, not to be anatomically correct.
+
+    Args:
+        shape (tuple[int, int, int]): Volume shape in voxels.
+        voxel_size (tuple[float, float, float]): Voxel size in millimetres.
+        seed (int, optional): Seed of the noise.
+
+    Returns:
+        nibabel.Nifti1Image: Image in RAS orientation, centred on the origin.
+    """
+    rng = np.random.default_rng(seed)
+    voxel_size = np.asarray(voxel_size, dtype=float)
+
+    # Physical coordinates (mm) of the voxel centres, relative to the centre of the volume
+    axes = [(np.arange(n) - (n - 1) / 2) * size for n, size in zip(shape, voxel_size)]
+    x, y, z = np.meshgrid(*axes, indexing="ij", sparse=True)
+
+    def ellipsoid(rx, ry, rz, cx=0.0, cy=0.0, cz=0.0):
+        return ((x - cx) / rx) ** 2 + ((y - cy) / ry) ** 2 + ((z - cz) / rz) ** 2 <= 1.0
+
+    volume = np.zeros(shape, dtype=np.float32)
+    volume[ellipsoid(75, 95, 85)] = 60.0  # scalp
+    volume[ellipsoid(70, 90, 80)] = 10.0  # skull
+    volume[ellipsoid(65, 85, 75)] = 80.0  # grey matter
+    volume[ellipsoid(55, 72, 62)] = 110.0  # white matter
+    volume[ellipsoid(6, 25, 10, cx=-9) | ellipsoid(6, 25, 10, cx=9)] = 30.0  # ventricles
+
+    # Smooth multiplicative bias field, as corrected by N4
+    extent = np.asarray(shape) * voxel_size / 2
+    bias = 1.0 + 0.15 * (x / extent[0]) - 0.1 * (y / extent[1]) ** 2 + 0.1 * (z / extent[2])
+    volume *= bias.astype(np.float32)
+
+    # Magnitude of complex Gaussian noise, as in magnitude MR images
+    noise = rng.normal(0.0, 3.0, (2,) + tuple(shape)).astype(np.float32)
+    volume = np.sqrt((volume + noise[0]) ** 2 + noise[1] ** 2)
+
+    affine = np.diag(np.append(voxel_size, 1.0))
+    affine[:3, 3] = -(np.asarray(shape) - 1) / 2 * voxel_size
+    return nib.Nifti1Image(volume, affine)
+
+
+def random_models(device, seed=0, fold_bn=False, precision="float32", channels_last=False):
+    """
+    Build the four networks with their real channel configurations and random weights.
+
+    Args:
+        device (torch.device): Device the networks are moved to.
+        seed (int, optional): Seed of the weight initialization.
+        fold_bn, precision, channels_last: Inference options, see ``utils.load_model.optimize_model``.
+
+    Returns:
+        tuple: (cnet, ssnet, pnet, hnet), as returned by ``utils.load_model.load_model``.
+    """
+    torch.manual_seed(seed)
+    models = []
+    for name, (in_channels, out_channels) in MODEL_SPECS.items():
+        model = UNet(in_channels, out_channels)
+        if name in ("CNet", "SSNet"):
+            torch.nn.init.constant_(model.dconv0.bias, MASK_LOGIT_BIAS)
+        model.to(device).eval()
+        models.append(optimize_model(model, fold_bn=fold_bn, precision=precision, channels_last=channels_last))
+    return tuple(models)
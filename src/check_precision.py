@@ -0,0 +1,147 @@
+import argparse
+import os
+import sys
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+from parcellation import INFERENCE_OPTIONS, add_pipeline_arguments, infer_subject, load_subject, select_device
+from utils.load_model import load_model
+from utils.make_csv import LEVEL5_NAMES, N_REGIONS
+
+
+# Options reset to their defaults in the reference run. --resolution is kept: the preprocessed
+# volume is shared by both runs.
+REFERENCE_OPTIONS = tuple(name for name in INFERENCE_OPTIONS if name != "resolution") + ("fusion_dtype",)
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the accuracy check.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description=("Compare OpenMAP-T1 inference options (--precision, --fold-bn, --channels-last, ...) " "against the default float32 path on a reference volume."))
+    parser.add_argument(
+        "-i",
+        required=True,
+        help="Reference T1-weighted NIfTI file (.nii or .nii.gz).",
+    )
+    parser.add_argument(
+        "-m",
+        required=True,
+        help="Folder containing pretrained model weights required by OpenMAP-T1.",
+    )
+    parser.add_argument(
+        "--report",
+        default=None,
+        help="Optional CSV file where the per-region Dice scores are written.",
+    )
+    parser.add_argument(
+        "--min-dice",
+        type=float,
+        default=0.95,
+        help="Exit with status 1 if any region present in the reference has a lower Dice (default: 0.95).",
+    )
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+def dice_per_region(reference, test, n_regions=N_REGIONS):
+    """
+    Compute the Dice coefficient of every label between two label maps.
+
+    Args:
+        reference (numpy.ndarray): Reference integer label map.
+        test (numpy.ndarray): Label map to evaluate, with the same shape.
+        n_regions (int, optional): Labels 1..n_regions are evaluated. Defaults to 280.
+
+    Returns:
+        pandas.DataFrame: One row per label with the reference and test voxel counts and
+        the Dice coefficient (NaN when the label is absent from both maps).
+    """
+    reference = reference.ravel().astype(np.intp)
+    test = test.ravel().astype(np.intp)
+    length = n_regions + 1
+    ref_counts = np.bincount(reference, minlength=length)[1:length]
+    test_counts = np.bincount(test, minlength=length)[1:length]
+    overlap = np.bincount(reference[reference == test], minlength=length)[1:length]
+
+    with np.errstate(invalid="ignore", divide="ignore"):
+        dice = 2.0 * overlap / (ref_counts + test_counts)
+    return pd.DataFrame(
+        {
+            "label": np.arange(1, length),
+            "region": LEVEL5_NAMES[:n_regions],
+            "reference_voxels": ref_counts,
+            "test_voxels": test_counts,
+            "dice": dice,
+        }
+    )
+
+
+def reference_options(opt):
+    """
+    Build the options of the reference run: those of ``opt`` with every REFERENCE_OPTIONS
+    entry (backend, precision, fusion accumulator, ...) set back to its command-line default.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments of the test run.
+
+    Returns:
+        argparse.Namespace: Options of the reference run.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_pipeline_arguments(parser)
+    reference_opt = argparse.Namespace(**vars(opt))
+    for name in REFERENCE_OPTIONS:
+        setattr(reference_opt, name, parser.get_default(name))
+    return reference_opt
+
+
+def main():
+    """
+    Run the network stages twice on one reference volume and report the per-region Dice.
+
+    The reference run uses the default float32 eager networks on every slice with a float32
+    fusion accumulator (see reference_options); the test run uses the inference options given
+    on the command line (e.g. ``--backend``, ``--fusion-dtype`` or ``--sparse-inference``).
+    """
+    opt = create_parser()
+    device = select_device()
+    print(f"Using device: {device}")
+
+    reference_opt = reference_options(opt)
+    reference_models = load_model(reference_opt, device)
+    test_models = load_model(opt, device)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        opt.o = reference_opt.o = tmp
+        case = load_subject(opt.i, opt)
+        reference = infer_subject(dict(case), reference_models, device, reference_opt)["output"]
+        test = infer_subject(dict(case), test_models, device, opt)["output"]
+
+    df = dice_per_region(reference, test)
+    present = df[df["reference_voxels"] > 0]
+    print(f"Voxel agreement: {np.mean(reference == test):.6f}")
+    print(f"Dice over {len(present)} regions: mean {present['dice'].mean():.4f}, min {present['dice'].min():.4f}")
+    worst = present.nsmallest(5, "dice")
+    print("Lowest Dice regions:")
+    print(worst.to_string(index=False))
+
+    if opt.report is not None:
+        os.makedirs(os.path.dirname(os.path.abspath(opt.report)), exist_ok=True)
+        df.to_csv(opt.report, index=False)
+
+    if (present["dice"] < opt.min_dice).any():
+        print(f"Some regions are below the Dice threshold {opt.min_dice}.")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,44 @@
+import argparse
+import os
+
+from utils.cohort import COHORT_DIR, compact_subject_tables
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the compaction command.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Gather the per-subject volume CSV files of an OpenMAP-T1 output folder into one table per level.")
+    parser.add_argument(
+        "-i",
+        required=True,
+        help="Output folder of src/parcellation.py containing one folder per subject.",
+    )
+    parser.add_argument(
+        "-o",
+        default=None,
+        help=f"Folder where the cohort tables are written (default: INPUT/{COHORT_DIR}).",
+    )
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+def main():
+    """
+    Write ``{level}.csv`` cohort tables, one row per subject, from existing per-subject CSV folders.
+    """
+    opt = create_parser()
+    counts = compact_subject_tables(opt.i, opt.o)
+    root = opt.o or os.path.join(opt.i, COHORT_DIR)
+    for level, count in counts.items():
+        print(f"{level}: {count} subjects")
+    print(f"Cohort tables written to {root}")
+
+
+if __name__ == "__main__":
+    main()
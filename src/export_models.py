@@ -0,0 +1,66 @@
+import argparse
+import os
+
+import torch
+
+from utils.backend import MODEL_SPECS, exported_path, export_onnx, export_torchscript
+from utils.load_model import load_model
+from utils.network import fold_batchnorm
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the export command.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Export the OpenMAP-T1 networks to TorchScript and/or ONNX.")
+    parser.add_argument(
+        "-m",
+        required=True,
+        help="Folder containing pretrained model weights required by OpenMAP-T1.",
+    )
+    parser.add_argument(
+        "-o",
+        default=None,
+        help=("Folder where the exported networks are written, using the same layout as the model folder " "(default: the model folder itself)."),
+    )
+    parser.add_argument(
+        "--format",
+        nargs="+",
+        default=["torchscript", "onnxruntime"],
+        choices=["torchscript", "onnxruntime"],
+        help="Export formats, named after the --backend that uses them (default: both).",
+    )
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+def main():
+    """
+    Export CNet, SSNet, PNet and HNet for the TorchScript and ONNX Runtime backends.
+
+    The networks are loaded on the CPU with BatchNorm folded into the convolutions and
+    written as ``{NAME}/{NAME}.pt`` (TorchScript) and ``{NAME}/{NAME}.onnx`` (ONNX).
+    """
+    opt = create_parser()
+    output_dir = opt.o or opt.m
+
+    models = load_model(argparse.Namespace(m=opt.m), torch.device("cpu"))
+    for (name, (in_channels, _)), model in zip(MODEL_SPECS.items(), models):
+        model = fold_batchnorm(model)
+        os.makedirs(os.path.join(output_dir, name), exist_ok=True)
+        for backend in opt.format:
+            path = exported_path(output_dir, name, backend)
+            if backend == "torchscript":
+                export_torchscript(model, path)
+            else:
+                export_onnx(model, path, in_channels)
+            print(f"Exported {name} to {path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -4,7 +4,6 @@ import os
 from functools import partial
 
 import torch
-from nibabel import processing
 from tqdm import tqdm as std_tqdm
 
 # tqdm wrapper with dynamic terminal width
@@ -14,45 +13,299 @@ import nibabel as nib
 import numpy as np
 
 # Project-local utilities
-from utils.cropping import cropping
+from utils.cache import CACHE_FORMATS, StageCache, file_digest, model_digests
+from utils.cohort import COHORT_DIR, CohortTables
+from utils.cropping import crop_layout, cropping, predict_crop_mask
+from utils.devices import DevicePool, parse_devices
+from utils.geometry import Geometry
 from utils.hemisphere import hemisphere
-from utils.load_model import load_model
-from utils.make_csv import make_csv
+from utils.load_model import check_backend_options, load_model
+from utils.make_csv import compute_volumes, make_csv
 from utils.make_level import create_parcellated_images
+from utils.manifest import MANIFEST_NAME, Manifest
 from utils.parcellation import parcellation
 from utils.postprocessing import postprocessing
-from utils.preprocessing import preprocessing
-from utils.stripping import stripping
+from utils.profiling import Profile, Profiler
+from utils.preprocessing import conform_corrected, correct_bias, n4_options
+from utils.scheduler import run_pipeline
+from utils.stripping import predict_brain_mask, stripping
+from utils.volume import InputVolume, float32_data
+from utils.workers import available_cores, configure_threads, pin_cores, run_workers, share_models, worker_cores
+from utils.writer import GZIP_ENGINES, OutputWriter, write_image
+
+# Options that change the network outputs, and therefore the keys of the cached stages.
+# --batch-size is left out: it only changes how slices are grouped.
+INFERENCE_OPTIONS = ("backend", "precision", "fold_bn", "channels_last", "resolution", "sparse_inference")
+
+# Other options that change the files written for a subject; a subject recorded as done in the
+# manifest is only skipped by --resume when all of them (and the requested outputs) match.
+RESULT_OPTIONS = INFERENCE_OPTIONS + (
+    "fusion_dtype",
+    "n4_preset",
+    "n4_shrink_factor",
+    "n4_iterations",
+    "n4_convergence_threshold",
+    "output_ext",
+    "only_face_cropping",
+    "only_skull_stripping",
+)
+
+# Artifacts a run can produce, and the --outputs profiles selecting them
+OUTPUT_ARTIFACTS = ("original", "n4", "cropped", "stripped", "level5", "levels", "csv")
+OUTPUT_PROFILES = {
+    "minimal": ("level5", "csv"),
+    "qc": ("n4", "cropped", "stripped", "level5", "csv"),
+    "full": OUTPUT_ARTIFACTS,
+}
+
+
+def resolution_mm(value):
+    """
+    Parse the ``--resolution`` voxel size.
 
+    Grids coarser than 1 mm are smaller than the 224² / 256² inputs of the networks, whose
+    encoders also need sizes that are multiples of 16, so only sizes in (0, 1] are accepted.
 
-def create_parser():
-    """
-    Build and return the CLI argument parser.
+    Args:
+        value (str): Command-line value.
 
     Returns:
-        argparse.Namespace: Parsed command-line arguments.
+        float: Voxel size in millimetres.
+
+    Raises:
+        argparse.ArgumentTypeError: If the value is not a number in (0, 1].
+    """
+    try:
+        resolution = float(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"invalid voxel size: {value!r}")
+    if not 0 < resolution <= 1.0:
+        raise argparse.ArgumentTypeError(f"voxel size must be greater than 0 and at most 1.0 mm, got {value}")
+    return resolution
+
+
+def add_pipeline_arguments(parser):
+    """
+    Add the options controlling how subjects are processed to an argument parser.
+
+    These options are shared by the batch CLI and the persistent model server.
+
+    Args:
+        parser (argparse.ArgumentParser): Parser to extend.
     """
-    parser = argparse.ArgumentParser(description="Run inference with OpenMAP-T1 on T1-weighted brain MRI.")
     parser.add_argument(
-        "-i",
-        required=True,
-        help="Input folder containing one or more NIfTI files (.nii or .nii.gz).",
+        "--output-ext",
+        default=".nii.gz",
+        choices=[".nii.gz", ".nii"],
+        help="Output NIfTI extension for saved images (default: .nii.gz).",
     )
     parser.add_argument(
-        "-o",
-        required=True,
-        help=("Output folder where results will be written. " "The folder is created automatically if it does not exist."),
+        "--outputs",
+        nargs="+",
+        default=["full"],
+        choices=list(OUTPUT_PROFILES) + list(OUTPUT_ARTIFACTS),
+        help=(
+            "Outputs to produce: a profile (minimal: Level-5 labels and CSV tables; qc: minimal plus the N4 image and the "
+            "cropping and brain masks; full: everything) and/or artifacts among " + ", ".join(OUTPUT_ARTIFACTS) + " (default: full). "
+            "Artifacts that are not requested are not computed."
+        ),
     )
     parser.add_argument(
-        "-m",
-        required=True,
-        help="Folder containing pretrained model weights required by OpenMAP-T1.",
+        "--cohort-tables",
+        action="store_true",
+        help=(f"Also append the volumes of every subject to one CSV table per level in OUTPUT/{COHORT_DIR}/, " "with one row per subject. Combine with an --outputs list without csv to skip the per-subject CSV files."),
     )
     parser.add_argument(
-        "--output-ext",
-        default=".nii.gz",
-        choices=[".nii.gz", ".nii"],
-        help="Output NIfTI extension for saved images (default: .nii.gz).",
+        "--compression-level",
+        type=int,
+        default=1,
+        choices=range(10),
+        metavar="{0..9}",
+        help="gzip compression level of the .nii.gz outputs (default: 1, as nibabel).",
+    )
+    parser.add_argument(
+        "--gzip-engine",
+        default="zlib",
+        choices=GZIP_ENGINES,
+        help="gzip implementation used for .nii.gz outputs (default: zlib). isal (pip install isal) is several times faster and supports levels 0-3.",
+    )
+    parser.add_argument(
+        "--writer-threads",
+        type=int,
+        default=4,
+        help="Number of background threads compressing and saving NIfTI outputs (default: 4); 0 saves on the stage that produces them.",
+    )
+    parser.add_argument(
+        "--batch-size",
+        type=int,
+        default=None,
+        help=("Number of slices per network forward pass. " "By default it is chosen automatically from the available memory."),
+    )
+    parser.add_argument(
+        "--fusion-dtype",
+        default="float32",
+        choices=["float32", "float16", "uint8"],
+        help=("Precision of the accumulator used to fuse the three parcellation views (default: float32). " "float16 and uint8 reduce peak memory at the cost of rare ties between near-equal classes."),
+    )
+    parser.add_argument(
+        "--backend",
+        default="eager",
+        choices=["eager", "torchscript", "onnxruntime"],
+        help=("Inference backend (default: eager). " "torchscript and onnxruntime use networks exported with src/export_models.py."),
+    )
+    parser.add_argument(
+        "--precision",
+        default="float32",
+        choices=["float32", "bfloat16", "float16"],
+        help=("Precision used to run the networks (default: float32). " "bfloat16/float16 run under autocast; check accuracy with src/check_precision.py first."),
+    )
+    parser.add_argument(
+        "--fold-bn",
+        action="store_true",
+        help="Fold BatchNorm layers into the preceding convolutions when the models are loaded.",
+    )
+    parser.add_argument(
+        "--channels-last",
+        action="store_true",
+        help="Run the networks with the channels-last (NHWC) memory format.",
+    )
+    parser.add_argument(
+        "--sparse-inference",
+        action="store_true",
+        help="Only run the parcellation and hemisphere networks on the slices that intersect the bounding box of the brain mask; the other slices are filled with background.",
+    )
+    parser.add_argument(
+        "--resolution",
+        type=resolution_mm,
+        default=1.0,
+        help=(
+            "Voxel size in mm of the grid the networks run on, at most 1.0 (default: 1.0, the 256³ grid). "
+            "Smaller values keep the detail of sub-millimetre inputs; slices larger than the networks' input are processed as overlapping tiles."
+        ),
+    )
+    parser.add_argument(
+        "--n4-preset",
+        default="default",
+        choices=["default", "fast"],
+        help=("N4 bias field correction settings (default: default). " "fast fits the bias field on a coarser grid with fewer iterations."),
+    )
+    parser.add_argument(
+        "--n4-shrink-factor",
+        type=int,
+        default=None,
+        help="Override the downsampling factor of the image used to fit the N4 bias field (default preset: 4).",
+    )
+    parser.add_argument(
+        "--n4-iterations",
+        type=int,
+        nargs="+",
+        default=None,
+        help="Override the N4 iteration schedule, one value per fitting level (default preset: 50 50 50 50).",
+    )
+    parser.add_argument(
+        "--n4-convergence-threshold",
+        type=float,
+        default=None,
+        help="Override the N4 convergence threshold (default preset: 0.001).",
+    )
+    parser.add_argument(
+        "--n4-threads",
+        type=int,
+        default=None,
+        help=("Number of threads used by N4. " "By default the available cores are divided between the --workers loader threads."),
+    )
+    parser.add_argument(
+        "--cache-dir",
+        default=None,
+        help=("Folder of the intermediate stage cache (N4 image, masks, label maps). " "Reruns on unchanged inputs, weights and options reuse the cached stages. Disabled by default."),
+    )
+    parser.add_argument(
+        "--cache-size",
+        type=float,
+        default=None,
+        help="Size limit of the stage cache in GB; least recently used entries are evicted beyond it (default: unlimited).",
+    )
+    parser.add_argument(
+        "--cache-format",
+        choices=CACHE_FORMATS,
+        default="npz",
+        help=("Storage format of the stage cache: compressed .npz archives (default), " "or uncompressed .npy arrays that are memory-mapped when reused (larger, but no decompression)."),
+    )
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="Write the wall time, CPU time, peak memory and network throughput of every stage to profile/{basename}_profile.json.",
+    )
+    parser.add_argument(
+        "--metrics-file",
+        default=None,
+        help="Write per-stage totals of the run to this file in the Prometheus text format.",
+    )
+    parser.add_argument(
+        "--trace-file",
+        default=None,
+        help="Write the stages of every subject to this file as a Chrome trace (chrome://tracing, Perfetto).",
+    )
+    parser.add_argument(
+        "--resume",
+        action="store_true",
+        help=(f"Skip the subjects recorded as done in the {MANIFEST_NAME} of the output folder whose input is unchanged; " "failed and new subjects are processed."),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help=("Number of subjects loaded and preprocessed (N4) concurrently while the networks run (default: 1)."),
+    )
+    parser.add_argument(
+        "--devices",
+        nargs="+",
+        default=None,
+        help=(
+            "Inference devices, e.g. 'cuda:0 cuda:1' or 'all' (every CUDA device). "
+            "The same device may be listed several times. Default: the first of CUDA, MPS and CPU."
+        ),
+    )
+    parser.add_argument(
+        "--shard",
+        choices=["subjects", "views"],
+        default="subjects",
+        help=(
+            "How work is spread over several --devices: 'subjects' runs one subject per device at a time (default), "
+            "'views' runs the parcellation and hemisphere views of each subject on different devices."
+        ),
+    )
+    parser.add_argument(
+        "--torch-threads",
+        type=int,
+        default=None,
+        help=("Number of threads of one forward pass on the CPU (torch intra-op threads). " "Default: torch default, or the cores divided between the --cpu-workers processes."),
+    )
+    parser.add_argument(
+        "--interop-threads",
+        type=int,
+        default=None,
+        help="Number of torch inter-op threads (default: torch default).",
+    )
+    parser.add_argument(
+        "--cpu-workers",
+        type=int,
+        default=1,
+        help=(
+            "Number of forked processes sharing the CPU networks through shared memory, each processing its share of the subjects "
+            "with --torch-threads threads (default: 1). See src/tune_cpu.py to pick a value for the host."
+        ),
+    )
+    parser.add_argument(
+        "--pin-cores",
+        action="store_true",
+        help="Pin every --cpu-workers process to its own set of --torch-threads cores (Linux only).",
+    )
+    parser.add_argument(
+        "--io-workers",
+        type=int,
+        default=1,
+        help=("Number of subjects whose volume tables and label images are written concurrently (default: 1). " "Use 0 to write on the main thread."),
     )
 
     # Mutually exclusive short-circuit modes: run only a subset of the full pipeline.
@@ -68,11 +321,593 @@ def create_parser():
         help=("Run up to and including skull stripping and exit early. " "Parcellation and later steps are skipped."),
     )
 
+
+def create_parser():
+    """
+    Build and return the CLI argument parser.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Run inference with OpenMAP-T1 on T1-weighted brain MRI.")
+    parser.add_argument(
+        "-i",
+        required=True,
+        help="Input folder containing one or more NIfTI files (.nii or .nii.gz).",
+    )
+    parser.add_argument(
+        "-o",
+        required=True,
+        help=("Output folder where results will be written. " "The folder is created automatically if it does not exist."),
+    )
+    parser.add_argument(
+        "-m",
+        required=True,
+        help="Folder containing pretrained model weights required by OpenMAP-T1.",
+    )
+    add_pipeline_arguments(parser)
+
     args = parser.parse_args()
     print("Parsed arguments:", args)
     return args
 
 
+def select_device():
+    """
+    Select the inference device.
+
+    Returns:
+        torch.device: CUDA if available, then Apple MPS, then CPU.
+    """
+    # Note: MPS is available on Apple Silicon with recent PyTorch builds.
+    if torch.cuda.is_available():
+        return torch.device("cuda")
+    elif torch.backends.mps.is_available():
+        return torch.device("mps")
+    return torch.device("cpu")
+
+
+def open_devices(opt):
+    """
+    Create the pool of inference devices requested on the command line.
+
+    The networks are not loaded yet (see :meth:`utils.devices.DevicePool.load`).
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        utils.devices.DevicePool: The pool; a single automatically selected device when ``--devices`` is not set.
+    """
+    return DevicePool(parse_devices(getattr(opt, "devices", None), select_device()))
+
+
+def infer_stages(pool, opt, cache=None, profiler=None):
+    """
+    Build the inference stage(s) of the pipeline for a device pool.
+
+    Args:
+        pool (utils.devices.DevicePool): Devices with their loaded networks.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        cache (utils.cache.StageCache, optional): Stage cache.
+        profiler (utils.profiling.Profiler, optional): Receives the profile of subjects that stop early.
+
+    Returns:
+        list[callable]: One :func:`infer_subject` per device with ``--shard subjects``, so that
+        ``run_pipeline`` processes one subject per device; a single one spreading the views over
+        the pool with ``--shard views``.
+    """
+    if getattr(opt, "shard", "subjects") == "views" and len(pool) > 1:
+        models, device = pool.members[0]
+        return [partial(infer_subject, models=models, device=device, opt=opt, cache=cache, profiler=profiler, pool=pool)]
+    return [partial(infer_subject, models=models, device=device, opt=opt, cache=cache, profiler=profiler) for models, device in pool.members]
+
+
+def find_inputs(input_path):
+    """
+    Enumerate the NIfTI inputs to process.
+
+    Args:
+        input_path (str): A folder searched recursively, or a single NIfTI file.
+
+    Returns:
+        list[str]: Sorted paths of the .nii and .nii.gz files found.
+    """
+    if os.path.isfile(input_path):
+        return [input_path]
+    # Note: Double 'sorted' is redundant but harmless; ensures deterministic order.
+    return sorted(sorted(glob.glob(os.path.join(input_path, "**/*.nii"), recursive=True)) + sorted(glob.glob(os.path.join(input_path, "**/*.nii.gz"), recursive=True)))
+
+
+def requested_outputs(opt):
+    """
+    Expand the ``--outputs`` profiles and artifacts into a set of artifacts.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        set[str]: Requested artifacts (see OUTPUT_ARTIFACTS); all of them when ``--outputs`` is not set.
+
+    Raises:
+        ValueError: If a name is neither a profile nor an artifact.
+    """
+    names = getattr(opt, "outputs", None) or ["full"]
+    if isinstance(names, str):
+        names = [names]
+    artifacts = set()
+    for name in names:
+        if name in OUTPUT_PROFILES:
+            artifacts.update(OUTPUT_PROFILES[name])
+        elif name in OUTPUT_ARTIFACTS:
+            artifacts.add(name)
+        else:
+            raise ValueError(f"unknown output {name!r}: choose profiles among {', '.join(OUTPUT_PROFILES)} or artifacts among {', '.join(OUTPUT_ARTIFACTS)}")
+    return artifacts
+
+
+def open_cohort(opt):
+    """
+    Open the cohort volume tables requested on the command line.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        utils.cohort.CohortTables or None: The tables, or None when ``--cohort-tables`` is not set.
+    """
+    if not getattr(opt, "cohort_tables", False):
+        return None
+    return CohortTables(os.path.join(opt.o, COHORT_DIR))
+
+
+def open_cache(opt):
+    """
+    Open the stage cache requested on the command line.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        utils.cache.StageCache or None: The cache, or None when ``--cache-dir`` is not set.
+    """
+    if getattr(opt, "cache_dir", None) is None:
+        return None
+    max_bytes = None if opt.cache_size is None else int(opt.cache_size * 1024**3)
+    return StageCache(opt.cache_dir, max_bytes, model_digests(opt), getattr(opt, "cache_format", "npz"))
+
+
+def run_stage(cache, stage, parent, network, opt, compute, **params):
+    """
+    Run a network stage, or read its output from the stage cache.
+
+    The cache key chains the key of the previous stage with the digest of the network,
+    the INFERENCE_OPTIONS and any stage-specific parameters.
+
+    Args:
+        cache (utils.cache.StageCache or None): Stage cache; the stage always runs when None.
+        stage (str): Stage name.
+        parent (str or None): Key of the previous stage.
+        network (str): Name of the network used by the stage.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        compute (callable): Called without arguments to produce the stage output.
+        **params: Stage parameters that change the output.
+
+    Returns:
+        tuple: (output, key), where key is None when the cache is not used.
+    """
+    if cache is None or parent is None:
+        return compute(), None
+    options = {name: getattr(opt, name, None) for name in INFERENCE_OPTIONS}
+    key = cache.key(stage, parent, cache.digests[network], options, params)
+    return cache.fetch(stage, key, compute), key
+
+
+def open_writer(opt):
+    """
+    Create the background writer of the NIfTI outputs.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        utils.writer.OutputWriter: The writer; close it once every subject is written.
+    """
+    return OutputWriter(opt.writer_threads, opt.compression_level, opt.gzip_engine)
+
+
+def open_profiler(opt):
+    """
+    Create the stage profiler requested on the command line.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Returns:
+        utils.profiling.Profiler: Profiler collecting the subjects of the run.
+    """
+    return Profiler(getattr(opt, "profile", False), getattr(opt, "metrics_file", None), getattr(opt, "trace_file", None))
+
+
+def finish_subject(case, profiler):
+    # Wait for the queued outputs, then hand the profile of the subject to the run profiler
+    if case["outputs"] is not None:
+        case["outputs"].wait()
+    if profiler is not None:
+        profiler.finish(case["profile"], case["output_dir"])
+
+
+def open_manifest(opt, pathes):
+    """
+    Open the batch manifest of the output folder and drop the subjects it lists as done
+    with the same RESULT_OPTIONS and requested outputs.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+        pathes (list[str]): Input files found in the input folder.
+
+    Returns:
+        tuple: (utils.manifest.Manifest, list[str]) the manifest and the inputs left to
+        process; every input is kept unless ``--resume`` is set.
+    """
+    options = {name: getattr(opt, name, None) for name in RESULT_OPTIONS}
+    options["outputs"] = sorted(requested_outputs(opt))
+    manifest = Manifest(os.path.join(opt.o, MANIFEST_NAME), options)
+    if getattr(opt, "resume", False):
+        pathes = [path for path in pathes if not manifest.completed(path)]
+    return manifest, pathes
+
+
+def load_subject(path, opt, cache=None, writer=None, digest=None):
+    """
+    Load one input image, persist its canonical copy and run preprocessing.
+
+    This is the first stage of the per-subject pipeline and runs on a loader thread.
+
+    Args:
+        path (str): Path to the input NIfTI file.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        cache (utils.cache.StageCache, optional): Stage cache holding the N4-corrected images.
+        writer (utils.writer.OutputWriter, optional): Writer saving the outputs of the subject in
+            the background. Outputs are saved synchronously when None.
+        digest (str, optional): SHA-256 of the input when already known (e.g. by the manifest);
+            computed for the cache key otherwise.
+
+    Returns:
+        dict: Per-subject state with the keys ``path``, ``basename``, ``output_dir``,
+        ``odata`` (N4-corrected image), ``data`` (conformed image, 256³ at 1 mm), ``geometry``
+        (mapping from the conformed to the native grid), ``cache_key`` (key of the
+        N4 stage, None without a cache), ``profile`` (per-stage measurements) and ``outputs``
+        (write session of the subject, None without a writer) and ``artifacts`` (requested outputs).
+    """
+    # Derive a clean base name without any extension.
+    basename = os.path.splitext(os.path.basename(path))[0]
+    if basename.endswith(".nii"):
+        # Handles the .nii.gz case where os.path.splitext removes only .gz.
+        basename = os.path.splitext(basename)[0]
+
+    # Create a per-case output subdirectory.
+    output_dir = os.path.join(opt.o, basename)
+    os.makedirs(output_dir, exist_ok=True)
+    profile = Profile(basename)
+    outputs = None if writer is None else writer.session()
+    artifacts = requested_outputs(opt)
+    if artifacts & {"original", "n4"}:
+        os.makedirs(os.path.join(output_dir, "original"), exist_ok=True)
+
+    with profile.stage("load"):
+        # Decode the image once as float32; the canonical (RAS+) copy and N4 share this array.
+        volume = InputVolume(path)
+
+        # Persist a canonicalized float32 copy for provenance.
+        if "original" in artifacts:
+            nii = nib.Nifti1Image(float32_data(volume.canonical), affine=volume.canonical.affine)
+            write_image(nii, os.path.join(output_dir, f"original/{basename}{opt.output_ext}"), outputs)
+
+    # N4 settings; unless set explicitly, the cores are shared between the loader threads
+    # of every --cpu-workers process.
+    n4_threads = opt.n4_threads
+    loaders = opt.workers * getattr(opt, "cpu_workers", 1)
+    if n4_threads is None and loaders > 1:
+        n4_threads = max(1, (os.cpu_count() or 1) // loaders)
+    n4 = n4_options(opt.n4_preset, opt.n4_shrink_factor, opt.n4_iterations, opt.n4_convergence_threshold, n4_threads)
+
+    with profile.stage("preprocessing"):
+        # The N4 stage is keyed by the content of the input and the settings that change its output.
+        cache_key, cached = None, None
+        if cache is not None:
+            settings = {name: value for name, value in n4.items() if name != "threads"}
+            # Entries hold the corrected image in the orientation of the input file
+            cache_key = cache.key("n4", digest or file_digest(path), settings, "input-orientation")
+            cached = cache.load("n4", cache_key)
+
+        if cached is None:
+            # N4 bias field correction; the corrected image is saved as original/{basename}_N4.
+            corrected = correct_bias(path, output_dir, basename, opt.output_ext, n4, outputs, save="n4" in artifacts, volume=volume)
+            if cache is not None:
+                cache.save("n4", cache_key, data=float32_data(corrected), affine=corrected.affine)
+        else:
+            # Cache hit: rebuild the corrected image and write the same reference copy as a miss.
+            corrected = nib.Nifti1Image(cached["data"], cached["affine"])
+            if "n4" in artifacts:
+                write_image(corrected, os.path.join(output_dir, f"original/{basename}_N4{opt.output_ext}"), outputs)
+
+        # Canonical (original-like) 'odata' and the standardized 'data' used by the networks.
+        odata, data = conform_corrected(corrected, opt.resolution)
+
+        # Nearest-neighbour mapping back to the native grid, shared by every saved mask and label map.
+        geometry = Geometry(odata, data) if artifacts & {"cropped", "stripped", "level5", "levels"} else None
+
+    return {
+        "path": path,
+        "basename": basename,
+        "output_dir": output_dir,
+        "odata": odata,
+        "data": data,
+        "geometry": geometry,
+        "cache_key": cache_key,
+        "profile": profile,
+        "outputs": outputs,
+        "artifacts": artifacts,
+    }
+
+
+def infer_subject(case, models, device, opt, cache=None, profiler=None, pool=None):
+    """
+    Run the network stages of the pipeline on one preprocessed subject.
+
+    This is the second stage of the per-subject pipeline and runs on the main thread,
+    which owns the inference device.
+
+    Args:
+        case (dict): Per-subject state returned by :func:`load_subject`.
+        models (tuple): The (cnet, ssnet, pnet, hnet) networks returned by ``load_model``.
+        device (torch.device): Device used for inference.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        cache (utils.cache.StageCache, optional): Stage cache; stages whose output is cached
+            skip their network.
+        profiler (utils.profiling.Profiler, optional): Receives the profile of subjects that
+            stop early, once their outputs are written.
+        pool (utils.devices.DevicePool, optional): Devices over which the views of the parcellation
+            and hemisphere networks are spread. Every view runs on ``device`` when None.
+
+    Returns:
+        dict or None: The per-subject state extended with the final ``output`` label map,
+        or None when the run stops early (``--only-face-cropping`` / ``--only-skull-stripping``).
+    """
+    cnet, ssnet, pnet, hnet = models
+    output_dir, basename = case["output_dir"], case["basename"]
+    odata, data, geometry, profile = case["odata"], case["data"], case["geometry"], case["profile"]
+
+    # Face cropping using the cropping network (returns cropped volume + spatial shift).
+    with profile.stage("cropping", device):
+        mask, key = run_stage(cache, "cropping", case.get("cache_key"), "CNet", opt, lambda: predict_crop_mask(data, cnet, device, opt.batch_size))
+        cropped, shift = cropping(output_dir, basename, odata, data, cnet, device, opt.output_ext, opt.batch_size, geometry, mask, case["outputs"], save="cropped" in case["artifacts"])
+
+    # Early exit if the user requested cropping only.
+    if opt.only_face_cropping:
+        finish_subject(case, profiler)
+        return None
+
+    # Skull stripping (brain extraction).
+    with profile.stage("stripping", device):
+        mask, key = run_stage(cache, "stripping", key, "SSNet", opt, lambda: predict_brain_mask(cropped, ssnet, device, opt.batch_size))
+        stripped = stripping(output_dir, basename, cropped, odata, data, ssnet, shift, device, opt.output_ext, opt.batch_size, geometry, mask, case["outputs"], save="stripped" in case["artifacts"])
+
+    # Early exit if the user requested up to skull stripping only.
+    if opt.only_skull_stripping:
+        finish_subject(case, profiler)
+        return None
+
+    # Networks of every device when the views are sharded over a pool.
+    pnet_shards = None if pool is None else pool.shards(2)
+    hnet_shards = None if pool is None else pool.shards(3)
+
+    # Parcellation into anatomical labels.
+    # Labels fit in uint8 (142 classes), which keeps the cached label maps small.
+    with profile.stage("parcellation", device):
+        parcellated, _ = run_stage(
+            cache, "parcellation", key, "PNet", opt, lambda: parcellation(stripped, pnet, device, opt.batch_size, opt.fusion_dtype, sparse=opt.sparse_inference, shards=pnet_shards).astype(np.uint8), fusion_dtype=opt.fusion_dtype
+        )
+
+    # Hemisphere mask/labels to distinguish left/right brain.
+    with profile.stage("hemisphere", device):
+        separated, _ = run_stage(cache, "hemisphere", key, "HNet", opt, lambda: hemisphere(stripped, hnet, device, opt.batch_size, sparse=opt.sparse_inference, shards=hnet_shards).astype(np.uint8))
+
+    # Post-processing to fuse parcellation with hemisphere info and to restore shifts.
+    with profile.stage("postprocessing", device):
+        _, margin = crop_layout(data.shape)
+        case["output"] = postprocessing(parcellated, separated, shift, device, margin)
+    return case
+
+
+def write_subject(case, opt, profiler=None, cohort=None):
+    """
+    Quantify and save the final parcellation of one subject.
+
+    This is the last stage of the per-subject pipeline and runs on a writer thread.
+
+    Args:
+        case (dict): Per-subject state returned by :func:`infer_subject`.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        profiler (utils.profiling.Profiler, optional): Receives the profile of the subject.
+        cohort (utils.cohort.CohortTables, optional): Cohort tables the volumes are appended to.
+    """
+    output_dir, basename = case["output_dir"], case["basename"]
+    odata, data, output, profile = case["odata"], case["data"], case["output"], case["profile"]
+    artifacts = case["artifacts"]
+
+    # Quantify regional volumes and export to CSV.
+    if "csv" in artifacts or cohort is not None:
+        with profile.stage("make_csv"):
+            if "csv" in artifacts:
+                volumes = make_csv(output, output_dir, basename, voxel_volume=opt.resolution**3)
+            else:
+                volumes = compute_volumes(output, basename, voxel_volume=opt.resolution**3)
+            if cohort is not None:
+                cohort.append(volumes)
+
+    if artifacts & {"level5", "levels"}:
+        with profile.stage("level5"):
+            # Map output label image back to the original image geometry.
+            # Nearest-neighbor gather through the precomputed mapping preserves integer labels.
+            nii = case["geometry"].to_native_image(output, np.uint16)
+
+            # Save standardized Level-5 parcellation.
+            if "level5" in artifacts:
+                os.makedirs(os.path.join(output_dir, "parcellated"), exist_ok=True)
+                write_image(nii, os.path.join(output_dir, f"parcellated/{basename}_Type1_Level5{opt.output_ext}"), case["outputs"])
+
+    # Generate per-level parcellated volumes from the already resampled Level-5 labels.
+    if "levels" in artifacts:
+        with profile.stage("create_parcellated_images"):
+            create_parcellated_images(output, output_dir, basename, odata, data, opt.output_ext, level5=nii, writer=case["outputs"])
+
+    finish_subject(case, profiler)
+
+
+def process_inputs(pathes, pool, opt, manifest, cache=None, cohort=None, progress=None):
+    """
+    Run the load → infer → write pipeline over a list of inputs.
+
+    The output writer and the profiler are opened here, so that every ``--cpu-workers``
+    process has its own writer threads.
+
+    Args:
+        pathes (list[str]): Input NIfTI files.
+        pool (utils.devices.DevicePool): Devices with their loaded networks.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        manifest (utils.manifest.Manifest): Manifest recording every subject.
+        cache (utils.cache.StageCache, optional): Stage cache.
+        cohort (utils.cohort.CohortTables, optional): Cohort volume tables.
+        progress (tqdm.tqdm, optional): Progress bar advanced once per finished subject.
+    """
+    profiler = open_profiler(opt)
+    writer = open_writer(opt)
+    load, infer, write = manifest.track(
+        partial(load_subject, opt=opt, cache=cache, writer=writer),
+        infer_stages(pool, opt, cache, profiler),
+        partial(write_subject, opt=opt, profiler=profiler, cohort=cohort),
+    )
+
+    def on_error(path, e):
+        # Robust per-file error isolation: proceed to the next case on failure.
+        print(f"Error processing {path}: {e}")
+        manifest.fail(path, e)
+
+    # Pipelined processing: loading/preprocessing of subject k+1, inference of subject k
+    # and writing of subject k-1 overlap, with bounded queues between the stages.
+    run_pipeline(
+        pathes,
+        load=load,
+        infer=infer,
+        write=write,
+        workers=opt.workers,
+        io_workers=opt.io_workers,
+        on_error=on_error,
+        progress=progress,
+    )
+    writer.close()
+    profiler.close()
+
+
+def worker_file(path, index):
+    # Per-worker variant of a metrics or trace file: metrics.prom -> metrics.worker0.prom
+    if path is None:
+        return None
+    stem, ext = os.path.splitext(path)
+    return f"{stem}.worker{index}{ext}"
+
+
+def cpu_worker(index, send, pathes, pool, opt, manifest, cache=None, cohort=None):
+    """
+    Process the share of the inputs of one ``--cpu-workers`` process.
+
+    Worker ``index`` takes every ``--cpu-workers``-th input starting at ``index``, runs the
+    networks with its thread budget (optionally pinned to its own cores) and reports to the
+    parent through ``send``: ``("progress", n)`` for finished subjects and ``("recorded", path)``
+    for every subject written to the manifest, so that the parent knows which subjects of a
+    worker that dies were left unrecorded.
+
+    Args:
+        index (int): Index of the worker.
+        send (callable): Sends a message to the parent process (see utils.workers.run_workers).
+        pathes (list[str]): Every input of the run.
+        pool (utils.devices.DevicePool): CPU devices with their networks in shared memory.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        manifest (utils.manifest.Manifest): Manifest recording every subject.
+        cache (utils.cache.StageCache, optional): Stage cache.
+        cohort (utils.cohort.CohortTables, optional): Cohort volume tables.
+    """
+    threads = opt.torch_threads or max(1, len(available_cores()) // opt.cpu_workers)
+    configure_threads(threads)
+    if opt.pin_cores:
+        pin_cores(worker_cores(index, threads))
+
+    opt = argparse.Namespace(**vars(opt))
+    opt.metrics_file = worker_file(opt.metrics_file, index)
+    opt.trace_file = worker_file(opt.trace_file, index)
+    manifest.on_record = lambda path: send(("recorded", path))
+    process_inputs(pathes[index :: opt.cpu_workers], pool, opt, manifest, cache, cohort, Progress(lambda n: send(("progress", n))))
+
+
+def run_cpu_workers(pathes, pool, opt, manifest, cache=None, cohort=None, progress=None):
+    """
+    Process the inputs in ``--cpu-workers`` forked processes sharing the networks.
+
+    The subjects of a worker that exits abnormally (e.g. killed by the OOM killer) and that
+    it did not record are recorded as failed in the manifest, so that ``--resume`` retries them.
+
+    Args:
+        pathes (list[str]): Input NIfTI files.
+        pool (utils.devices.DevicePool): CPU devices with their loaded networks.
+        opt (argparse.Namespace): Parsed command-line arguments.
+        manifest (utils.manifest.Manifest): Manifest recording every subject.
+        cache (utils.cache.StageCache, optional): Stage cache.
+        cohort (utils.cohort.CohortTables, optional): Cohort volume tables.
+        progress (tqdm.tqdm, optional): Progress bar advanced once per finished subject.
+
+    Returns:
+        list[int]: Exit code of every worker.
+    """
+    # Weights are moved to shared memory once and mapped by every forked worker.
+    for models in pool.models:
+        share_models(models or ())
+
+    recorded = set()
+
+    def on_message(message):
+        kind, value = message
+        if kind == "recorded":
+            recorded.add(value)
+        elif progress is not None:
+            progress.update(value)
+
+    worker = partial(cpu_worker, pathes=pathes, pool=pool, opt=opt, manifest=manifest, cache=cache, cohort=cohort)
+    codes = run_workers(opt.cpu_workers, worker, on_message)
+
+    for index, code in enumerate(codes):
+        if not code:
+            continue
+        lost = [path for path in pathes[index :: opt.cpu_workers] if os.path.abspath(path) not in recorded]
+        print(f"Error: CPU worker {index} exited with code {code}, {len(lost)} of its subjects were not processed")
+        for path in lost:
+            manifest.fail(path, RuntimeError(f"CPU worker {index} exited with code {code}"))
+        if progress is not None:
+            progress.update(len(lost))
+    return codes
+
+
+class Progress:
+    """Adapter forwarding the ``update`` calls of :func:`run_pipeline` to a callback."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, n):
+        self.callback(n)
+
+
 def main():
     """
     Execute the OpenMAP-T1 parcellation pipeline.
@@ -88,6 +923,11 @@ def main():
       8) Volume quantification and CSV export.
       9) Conform output back to original geometry and save Level 5 labels.
      10) Generate auxiliary parcellated images for visualization.
+
+    Steps 1-2 run on ``--workers`` loader threads, steps 3-7 on the main thread (one thread
+    per device with several ``--devices``) and steps 8-10 on ``--io-workers`` writer threads,
+    so consecutive subjects overlap. With ``--cpu-workers N``, N forked processes sharing
+    the networks each run this pipeline on a share of the inputs.
     """
     # Citation block printed at runtime for proper attribution.
     print(
@@ -102,20 +942,27 @@ def main():
 
     # Parse command-line arguments.
     opt = create_parser()
+    cache = open_cache(opt)
+    cohort = open_cohort(opt)
 
-    # Device selection order: CUDA → Apple MPS → CPU.
-    # Note: MPS is available on Apple Silicon with recent PyTorch builds.
-    if torch.cuda.is_available():
-        device = torch.device("cuda")
-    elif torch.backends.mps.is_available():
-        device = torch.device("mps")
+    pool = open_devices(opt)
+    print(f"Using device: {pool}")
+
+    # Eager-only options are rejected with an exported backend rather than silently ignored.
+    check_backend_options(opt)
+
+    # Thread budget of torch. Before forking --cpu-workers processes the parent stays on one
+    # thread, so that no OpenMP thread team exists when the workers start.
+    if opt.cpu_workers > 1:
+        if any(device.type != "cpu" for device in pool.devices) or opt.backend == "onnxruntime":
+            raise ValueError("--cpu-workers requires CPU devices and the eager or torchscript backend")
+        configure_threads(1, opt.interop_threads)
     else:
-        device = torch.device("cpu")
-    print(f"Using device: {device}")
+        configure_threads(opt.torch_threads, opt.interop_threads)
 
-    # Load pretrained models required by the pipeline components.
+    # Load pretrained models required by the pipeline components, once per device.
     try:
-        cnet, ssnet, pnet, hnet = load_model(opt, device)
+        pool.load(partial(load_model, opt))
         print("Load complete !!")
     except Exception as e:
         # Continue to allow the script to report the error and exit gracefully later.
@@ -128,86 +975,22 @@ def main():
         print(f"Input directory {opt.i} exists.")
 
     # Enumerate NIfTI inputs recursively, supporting both .nii and .nii.gz.
-    # Note: Double 'sorted' is redundant but harmless; ensures deterministic order.
-    pathes = sorted(sorted(glob.glob(os.path.join(opt.i, "**/*.nii"), recursive=True)) + sorted(glob.glob(os.path.join(opt.i, "**/*.nii.gz"), recursive=True)))
+    pathes = find_inputs(opt.i)
     print(f"Found {len(pathes)} NIfTI files in {opt.i}")
 
-    # Process each input image independently.
-    for path in tqdm(pathes):
-        try:
-            # Derive a clean base name without any extension.
-            basename = os.path.splitext(os.path.basename(path))[0]
-            if basename.endswith(".nii"):
-                # Handles the .nii.gz case where os.path.splitext removes only .gz.
-                basename = os.path.splitext(basename)[0]
-
-            # Create a per-case output subdirectory.
-            output_dir = os.path.join(opt.o, basename)
-            os.makedirs(output_dir, exist_ok=True)
-
-            # Load image, reorient to RAS+ canonical, and drop degenerate dimensions.
-            odata = nib.squeeze_image(nib.as_closest_canonical(nib.load(path)))
-
-            # Persist a canonicalized float32 copy for provenance.
-            nii = nib.Nifti1Image(odata.get_fdata().astype(np.float32), affine=odata.affine)
-            os.makedirs(os.path.join(output_dir, "original"), exist_ok=True)
-            nib.save(nii, os.path.join(output_dir, f"original/{basename}{opt.output_ext}"))
-
-            # Preprocessing: intensity normalization, spacing/orientation harmonization, etc.
-            # Returns (original-like) 'odata' and a standardized 'data' used by the networks.
-            odata, data = preprocessing(path, output_dir, basename, opt.output_ext)
-
-            # Face cropping using the cropping network (returns cropped volume + spatial shift).
-            cropped, shift = cropping(output_dir, basename, odata, data, cnet, device, opt.output_ext)
-
-            # Early exit if the user requested cropping only.
-            if opt.only_face_cropping:
-                continue
-
-            # Skull stripping (brain extraction).
-            stripped = stripping(output_dir, basename, cropped, odata, data, ssnet, shift, device, opt.output_ext)
-
-            # Early exit if the user requested up to skull stripping only.
-            if opt.only_skull_stripping:
-                continue
-
-            # Parcellation into anatomical labels.
-            parcellated = parcellation(stripped, pnet, device)
-
-            # Hemisphere mask/labels to distinguish left/right brain.
-            separated = hemisphere(stripped, hnet, device)
-
-            # Post-processing to fuse parcellation with hemisphere info and to restore shifts.
-            output = postprocessing(parcellated, separated, shift, device)
-
-            # Quantify regional volumes and export to CSV.
-            df = make_csv(output, output_dir, basename)
-
-            # Conform output label image back to the original image geometry.
-            # Use nearest-neighbor resampling (order=0) to preserve integer labels.
-            nii = nib.Nifti1Image(output.astype(np.uint16), affine=data.affine)
-            header = odata.header
-            nii = processing.conform(
-                nii,
-                out_shape=(header["dim"][1], header["dim"][2], header["dim"][3]),
-                voxel_size=(header["pixdim"][1], header["pixdim"][2], header["pixdim"][3]),
-                order=0,
-            )
-
-            # Save standardized Level-5 parcellation.
-            os.makedirs(os.path.join(output_dir, "parcellated"), exist_ok=True)
-            nib.save(nii, os.path.join(output_dir, f"parcellated/{basename}_Type1_Level5{opt.output_ext}"))
-
-            # Generate auxiliary visualizations / per-level parcellated volumes.
-            create_parcellated_images(output, output_dir, basename, odata, data, opt.output_ext)
-
-            # Explicit cleanup of large arrays to ease memory pressure in long batches.
-            del odata, data
-
-        except Exception as e:
-            # Robust per-file error isolation: proceed to the next case on failure.
-            print(f"Error processing {path}: {e}")
-            continue
+    # Every finished subject is recorded in the manifest; --resume skips those already done.
+    manifest, pathes = open_manifest(opt, pathes)
+    if opt.resume:
+        print(f"Resuming: {len(pathes)} NIfTI files left to process")
+
+    if opt.cpu_workers > 1:
+        # No tqdm monitor thread: the workers are forked while the progress bar is open
+        std_tqdm.monitor_interval = 0
+    with tqdm(total=len(pathes)) as progress:
+        if opt.cpu_workers > 1:
+            run_cpu_workers(pathes, pool, opt, manifest, cache, cohort, progress)
+        else:
+            process_inputs(pathes, pool, opt, manifest, cache, cohort, progress)
     return
 
 
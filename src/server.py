@@ -0,0 +1,374 @@
+import argparse
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from functools import partial
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from parcellation import add_pipeline_arguments, find_inputs, infer_stages, load_subject, open_cache, open_cohort, open_devices, open_manifest, open_profiler, open_writer, requested_outputs, write_subject
+from utils.load_model import load_model
+from utils.scheduler import run_pipeline
+from utils.workers import configure_threads
+
+# Per-job options that a client may override; everything else is fixed at server start
+JOB_OPTIONS = ("output_ext", "batch_size", "fusion_dtype", "only_face_cropping", "only_skull_stripping", "resume", "outputs", "cohort_tables", "shard")
+
+
+def job_option_actions():
+    """
+    Return the argparse definitions of the per-job options.
+
+    Returns:
+        dict: Mapping from option name (see JOB_OPTIONS) to its ``argparse.Action``.
+    """
+    parser = argparse.ArgumentParser(add_help=False)
+    add_pipeline_arguments(parser)
+    return {action.dest: action for action in parser._actions if action.dest in JOB_OPTIONS}
+
+
+def check_option(action, value):
+    """
+    Validate the value of a job option against its command-line definition.
+
+    Args:
+        action (argparse.Action): Definition of the option (see job_option_actions).
+        value: Value received in the job request.
+
+    Returns:
+        The value in the form produced by the CLI (a list for options taking several values).
+
+    Raises:
+        ValueError: If the value does not have the type or is not among the choices of the option.
+    """
+    name = action.option_strings[0]
+    if action.nargs == 0:
+        # Flags (store_true)
+        if not isinstance(value, bool):
+            raise ValueError(f"{name} must be true or false")
+        return value
+
+    values = [value] if action.nargs != "+" or isinstance(value, str) else value
+    if not isinstance(values, list) or not values:
+        raise ValueError(f"{name} must be a value or a non-empty list of values")
+    for item in values:
+        if action.type is not None:
+            valid = isinstance(item, action.type) and not isinstance(item, bool)
+            if item is None and action.default is None:
+                valid = True
+        else:
+            valid = isinstance(item, str)
+        if not valid:
+            raise ValueError(f"invalid value for {name}: {item!r}")
+        if action.choices is not None and item not in action.choices:
+            raise ValueError(f"invalid value for {name}: {item!r} (choose from {', '.join(map(str, action.choices))})")
+    return values if action.nargs == "+" else value
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the model server.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Serve OpenMAP-T1 with the networks kept resident in memory.")
+    parser.add_argument(
+        "-m",
+        required=True,
+        help="Folder containing pretrained model weights required by OpenMAP-T1.",
+    )
+    parser.add_argument(
+        "--host",
+        default="127.0.0.1",
+        help="Address the HTTP server binds to (default: 127.0.0.1).",
+    )
+    parser.add_argument(
+        "--port",
+        type=int,
+        default=8000,
+        help="Port the HTTP server listens on (default: 8000).",
+    )
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+class ModelServer:
+    """
+    Job queue processed by a single worker thread that owns the loaded networks.
+
+    Jobs are executed one after another with the same load → infer → write pipeline as
+    the batch CLI, so the networks are loaded exactly once for the lifetime of the server.
+    """
+
+    def __init__(self, opt, pool):
+        self.opt = opt
+        self.pool = pool
+        self.actions = job_option_actions()
+        self.cache = open_cache(opt)
+        self.writer = open_writer(opt)
+        self.jobs = {}
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        self.ids = itertools.count(1)
+        self.started = time.time()
+        self.busy_seconds = 0.0
+        self.subjects_finished = 0
+        self.subjects_failed = 0
+        self.worker = threading.Thread(target=self.run, daemon=True)
+        self.worker.start()
+
+    def submit(self, request):
+        """
+        Validate and enqueue a job.
+
+        Args:
+            request (dict): ``{"input": str, "output": str, "options": dict}`` where ``input``
+                is a NIfTI file or a folder and ``options`` overrides any of :data:`JOB_OPTIONS`.
+
+        Returns:
+            dict: The public status of the created job.
+
+        Raises:
+            ValueError: If the request is malformed or an option is invalid.
+        """
+        if not isinstance(request, dict) or "input" not in request or "output" not in request:
+            raise ValueError("job requires 'input' and 'output'")
+        if not isinstance(request["input"], str) or not isinstance(request["output"], str):
+            raise ValueError("'input' and 'output' must be paths")
+        options = request.get("options", {})
+        if not isinstance(options, dict):
+            raise ValueError("'options' must be an object")
+        unknown = set(options) - set(JOB_OPTIONS)
+        if unknown:
+            raise ValueError(f"unsupported options: {sorted(unknown)}")
+        options = {name: check_option(self.actions[name], value) for name, value in options.items()}
+        # Mutually exclusive on the command line; checked on the values the job will run with
+        effective = {name: options.get(name, getattr(self.opt, name, False)) for name in ("only_face_cropping", "only_skull_stripping")}
+        if all(effective.values()):
+            raise ValueError("only_face_cropping and only_skull_stripping are mutually exclusive")
+        if "outputs" in options:
+            requested_outputs(argparse.Namespace(outputs=options["outputs"]))
+        if not os.path.exists(request["input"]):
+            raise ValueError(f"input {request['input']} does not exist")
+
+        with self.lock:
+            job_id = str(next(self.ids))
+            self.jobs[job_id] = {
+                "id": job_id,
+                "input": request["input"],
+                "output": request["output"],
+                "options": options,
+                "status": "queued",
+                "total": 0,
+                "processed": 0,
+                "failed": 0,
+                "errors": [],
+                "error": None,
+                "submitted": time.time(),
+                "started": None,
+                "finished": None,
+            }
+            self.pending.put(job_id)
+            return dict(self.jobs[job_id])
+
+    def job(self, job_id):
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return None if job is None else dict(job)
+
+    def status(self):
+        """
+        Summarize the server state.
+
+        Returns:
+            dict: Queue depth, per-status job counts and subject throughput.
+        """
+        with self.lock:
+            counts = {}
+            for job in self.jobs.values():
+                counts[job["status"]] = counts.get(job["status"], 0) + 1
+            return {
+                "device": str(self.pool),
+                "uptime_seconds": time.time() - self.started,
+                "queued_jobs": self.pending.qsize(),
+                "jobs": counts,
+                "subjects_processed": self.subjects_finished - self.subjects_failed,
+                "subjects_failed": self.subjects_failed,
+                "busy_seconds": self.busy_seconds,
+                "subjects_per_minute": 60.0 * (self.subjects_finished - self.subjects_failed) / self.busy_seconds if self.busy_seconds else 0.0,
+            }
+
+    def run(self):
+        while True:
+            job_id = self.pending.get()
+            with self.lock:
+                job = self.jobs[job_id]
+                job["status"] = "running"
+                job["started"] = time.time()
+
+            # A failing job must not stop the worker thread, or every later job stays queued
+            try:
+                self.run_job(job)
+                status, error = None, None
+            except Exception as e:
+                print(f"Error running job {job_id}: {e}")
+                status, error = "failed", str(e)
+
+            with self.lock:
+                job["finished"] = time.time()
+                if status is None:
+                    status = "failed" if job["total"] and job["failed"] == job["total"] else "done"
+                job["status"] = status
+                if error is not None:
+                    job["error"] = error
+                self.busy_seconds += job["finished"] - job["started"]
+
+    def run_job(self, job):
+        """
+        Process every input of a job through the pipeline.
+
+        Args:
+            job (dict): Job record created by :meth:`submit`.
+        """
+        opt = argparse.Namespace(**vars(self.opt))
+        opt.i, opt.o = job["input"], job["output"]
+        for key, value in job["options"].items():
+            setattr(opt, key, value)
+
+        manifest, pathes = open_manifest(opt, find_inputs(opt.i))
+        with self.lock:
+            job["total"] = len(pathes)
+
+        profiler = open_profiler(opt)
+        load, infer, write = manifest.track(
+            partial(load_subject, opt=opt, cache=self.cache, writer=self.writer),
+            infer_stages(self.pool, opt, self.cache, profiler),
+            partial(write_subject, opt=opt, profiler=profiler, cohort=open_cohort(opt)),
+        )
+        run_pipeline(
+            pathes,
+            load=load,
+            infer=infer,
+            write=write,
+            workers=opt.workers,
+            io_workers=opt.io_workers,
+            on_error=partial(self.on_error, job, manifest),
+            progress=Progress(partial(self.on_progress, job)),
+        )
+        profiler.close()
+
+    def on_error(self, job, manifest, path, e):
+        print(f"Error processing {path}: {e}")
+        manifest.fail(path, e)
+        with self.lock:
+            job["errors"].append({"path": path, "error": str(e)})
+            job["failed"] += 1
+            self.subjects_failed += 1
+
+    def on_progress(self, job):
+        # Called once per finished subject, after on_error for failed ones; successes are
+        # reported as the finished subjects minus the failed ones
+        with self.lock:
+            job["processed"] += 1
+            self.subjects_finished += 1
+
+
+class Progress:
+    """Adapter exposing the ``update`` method expected by :func:`run_pipeline`."""
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def update(self, n):
+        for _ in range(n):
+            self.callback()
+
+
+def make_handler(server):
+    """
+    Build the HTTP request handler bound to a :class:`ModelServer`.
+
+    Endpoints:
+        POST /jobs        Submit a job (JSON body, see :meth:`ModelServer.submit`).
+        GET  /jobs/<id>   Status of one job.
+        GET  /jobs        Status of all jobs.
+        GET  /status      Server status and throughput.
+    """
+
+    class Handler(BaseHTTPRequestHandler):
+        def reply(self, code, body):
+            payload = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(payload)))
+            self.end_headers()
+            self.wfile.write(payload)
+
+        def do_GET(self):
+            parts = self.path.strip("/").split("/")
+            if parts == ["status"]:
+                self.reply(200, server.status())
+            elif parts == ["jobs"]:
+                # Copy under the lock, reply without it: a slow client must not block the worker
+                with server.lock:
+                    jobs = [dict(job) for job in server.jobs.values()]
+                self.reply(200, jobs)
+            elif len(parts) == 2 and parts[0] == "jobs":
+                job = server.job(parts[1])
+                if job is None:
+                    self.reply(404, {"error": f"unknown job {parts[1]}"})
+                else:
+                    self.reply(200, job)
+            else:
+                self.reply(404, {"error": f"unknown endpoint {self.path}"})
+
+        def do_POST(self):
+            if self.path.strip("/") != "jobs":
+                self.reply(404, {"error": f"unknown endpoint {self.path}"})
+                return
+            try:
+                length = int(self.headers.get("Content-Length", 0))
+                request = json.loads(self.rfile.read(length) or b"{}")
+                self.reply(202, server.submit(request))
+            except Exception as e:
+                # Malformed JSON, wrong types or invalid options
+                self.reply(400, {"error": str(e)})
+
+    return Handler
+
+
+def main():
+    """
+    Start the OpenMAP-T1 model server.
+
+    The four networks are loaded once at startup; jobs submitted over HTTP are then
+    processed in order without paying for interpreter startup or weight loading.
+    """
+    opt = create_parser()
+
+    configure_threads(opt.torch_threads, opt.interop_threads)
+    pool = open_devices(opt)
+    print(f"Using device: {pool}")
+
+    pool.load(partial(load_model, opt))
+    print("Load complete !!")
+
+    model_server = ModelServer(opt, pool)
+    httpd = ThreadingHTTPServer((opt.host, opt.port), make_handler(model_server))
+    print(f"Serving OpenMAP-T1 on http://{opt.host}:{opt.port}")
+    try:
+        httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
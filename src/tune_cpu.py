@@ -0,0 +1,98 @@
+import argparse
+import time
+from functools import partial
+
+import torch
+
+from parcellation import add_pipeline_arguments
+from utils.load_model import load_model
+from utils.workers import available_cores, configure_threads, pin_cores, run_workers, share_models, worker_cores
+
+
+def create_parser():
+    """
+    Build and return the CLI argument parser of the CPU autotuner.
+
+    Returns:
+        argparse.Namespace: Parsed command-line arguments.
+    """
+    parser = argparse.ArgumentParser(description="Pick the number of --cpu-workers processes and --torch-threads per process that maximize CPU throughput on this host.")
+    parser.add_argument(
+        "-m",
+        required=True,
+        help="Folder containing pretrained model weights required by OpenMAP-T1.",
+    )
+    parser.add_argument(
+        "--seconds",
+        type=float,
+        default=10.0,
+        help="Duration of the measurement of every configuration in seconds (default: 10).",
+    )
+    add_pipeline_arguments(parser)
+
+    args = parser.parse_args()
+    print("Parsed arguments:", args)
+    return args
+
+
+def candidates(cores):
+    """
+    List the (workers, threads) configurations that use every core once.
+
+    Args:
+        cores (int): Number of available cores.
+
+    Returns:
+        list[tuple[int, int]]: Configurations, from one process with every core to one process per core.
+    """
+    return [(workers, cores // workers) for workers in range(1, cores + 1) if cores % workers == 0]
+
+
+def measure(index, send, pnet, threads, seconds, batch_size, pin):
+    # Forward passes of the parcellation network (the heaviest stage) on random slices
+    configure_threads(threads)
+    if pin:
+        pin_cores(worker_cores(index, threads))
+    batch = torch.randn(batch_size, 4, 224, 224)
+    with torch.inference_mode():
+        pnet(batch)
+        slices, start = 0, time.perf_counter()
+        while time.perf_counter() - start < seconds:
+            pnet(batch)
+            slices += batch_size
+    send(slices / (time.perf_counter() - start))
+
+
+def main():
+    """
+    Measure the parcellation network throughput of every workers × threads split of the cores.
+
+    Forward passes use ``--batch-size`` slices (8 when not set).
+
+    Every configuration forks its workers from the same loaded, shared-memory networks as
+    ``src/parcellation.py --cpu-workers``, and the summed slices/sec of the workers are
+    compared. The best configuration is printed as command-line options.
+    """
+    opt = create_parser()
+    configure_threads(1, opt.interop_threads)
+    device = torch.device("cpu")
+    models = load_model(opt, device)
+    share_models(models)
+    pnet = models[2]
+
+    cores = len(available_cores())
+    results = []
+    for workers, threads in candidates(cores):
+        rates = []
+        run_workers(workers, partial(measure, pnet=pnet, threads=threads, seconds=opt.seconds, batch_size=opt.batch_size or 8, pin=opt.pin_cores), rates.append)
+        rate = sum(rates)
+        results.append((rate, workers, threads))
+        print(f"--cpu-workers {workers} --torch-threads {threads}: {rate:.1f} slices/s")
+
+    rate, workers, threads = max(results)
+    pin = " --pin-cores" if opt.pin_cores else ""
+    print(f"Best on {cores} cores: --cpu-workers {workers} --torch-threads {threads}{pin} ({rate:.1f} slices/s)")
+
+
+if __name__ == "__main__":
+    main()
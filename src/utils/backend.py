@@ -0,0 +1,121 @@
+import os
+
+import torch
+
+# Networks of the pipeline: folder/file name → (input channels, output channels)
+MODEL_SPECS = {
+    "CNet": (3, 1),
+    "SSNet": (3, 1),
+    "PNet": (4, 142),
+    "HNet": (3, 3),
+}
+
+# Inference backends and the file extension of their exported networks
+BACKEND_EXTENSIONS = {"torchscript": ".pt", "onnxruntime": ".onnx"}
+
+
+def exported_path(model_dir, name, backend):
+    """
+    Return the path of an exported network.
+
+    Args:
+        model_dir (str): Folder containing the pretrained model weights.
+        name (str): Network name (one of MODEL_SPECS).
+        backend (str): One of {'torchscript', 'onnxruntime'}.
+
+    Returns:
+        str: ``{model_dir}/{name}/{name}.pt`` or ``{model_dir}/{name}/{name}.onnx``.
+    """
+    return os.path.join(model_dir, name, f"{name}{BACKEND_EXTENSIONS[backend]}")
+
+
+def export_torchscript(model, path):
+    """
+    Export a network to a frozen TorchScript module.
+
+    Freezing inlines the weights and folds BatchNorm into the convolutions.
+
+    Args:
+        model (torch.nn.Module): Network in evaluation mode, on the CPU.
+        path (str): Destination ``.pt`` file.
+    """
+    scripted = torch.jit.freeze(torch.jit.script(model.eval()))
+    torch.jit.save(scripted, path)
+
+
+def export_onnx(model, path, in_channels):
+    """
+    Export a network to ONNX with dynamic batch and slice dimensions.
+
+    Args:
+        model (torch.nn.Module): Network in evaluation mode, on the CPU.
+        path (str): Destination ``.onnx`` file.
+        in_channels (int): Number of input channels of the network.
+    """
+    dummy = torch.zeros(1, in_channels, 224, 224)
+    torch.onnx.export(
+        model.eval(),
+        (dummy,),
+        path,
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch", 2: "height", 3: "width"}, "logits": {0: "batch", 2: "height", 3: "width"}},
+        opset_version=17,
+        dynamo=False,
+    )
+
+
+class OnnxRuntimeModel:
+    """
+    Callable running an exported network with ONNX Runtime on the CPU execution provider.
+
+    It mimics the part of the ``torch.nn.Module`` interface used by the inference engine:
+    ``eval()`` and calling it on a (B, C, H, W) float32 tensor returns the logits as a tensor.
+    """
+
+    def __init__(self, path, threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnxruntime backend requires the 'onnxruntime' package (pip install onnxruntime).") from e
+
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.session = ort.InferenceSession(path, sess_options=options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def eval(self):
+        return self
+
+    def __call__(self, x):
+        (logits,) = self.session.run(None, {self.input_name: x.detach().cpu().numpy()})
+        return torch.from_numpy(logits)
+
+
+def load_exported_models(model_dir, backend, device):
+    """
+    Load the four exported networks for a non-eager backend.
+
+    Args:
+        model_dir (str): Folder containing the exported networks (see ``src/export_models.py``).
+        backend (str): One of {'torchscript', 'onnxruntime'}.
+        device (torch.device): Target device for TorchScript modules; ONNX Runtime always runs on the CPU.
+
+    Returns:
+        tuple: (cnet, ssnet, pnet, hnet) callables accepted by the inference engine.
+    """
+    if backend not in BACKEND_EXTENSIONS:
+        raise ValueError(f"backend must be one of {{'eager', {', '.join(repr(b) for b in BACKEND_EXTENSIONS)}}}")
+
+    models = []
+    for name in MODEL_SPECS:
+        path = exported_path(model_dir, name, backend)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"{path} not found; export the models first with: python src/export_models.py -m {model_dir}")
+        if backend == "torchscript":
+            models.append(torch.jit.load(path, map_location=device).eval())
+        else:
+            models.append(OnnxRuntimeModel(path))
+    return tuple(models)
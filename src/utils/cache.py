@@ -0,0 +1,239 @@
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+import threading
+
+import numpy as np
+
+from utils.backend import MODEL_SPECS, exported_path
+
+# Storage formats of the cache entries: compressed archives, or uncompressed arrays read with mmap
+CACHE_FORMATS = ("npz", "npy")
+
+
+def file_digest(path, chunk_size=1 << 20):
+    """
+    Compute the SHA-256 digest of a file.
+
+    Args:
+        path (str): File to hash.
+        chunk_size (int, optional): Read size in bytes.
+
+    Returns:
+        str: Hexadecimal digest.
+    """
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(chunk_size), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def model_digests(opt):
+    """
+    Hash the network files used by a run, so that cached stage outputs are invalidated when weights change.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments (``opt.m`` and ``opt.backend``).
+
+    Returns:
+        dict: Mapping from network name (CNet, SSNet, PNet, HNet) to the digest of its file.
+    """
+    backend = getattr(opt, "backend", "eager")
+    digests = {}
+    for name in MODEL_SPECS:
+        if backend == "eager":
+            path = os.path.join(opt.m, name, f"{name}.pth")
+        else:
+            path = exported_path(opt.m, name, backend)
+        digests[name] = file_digest(path)
+    return digests
+
+
+class StageCache:
+    """
+    Content-addressed on-disk cache of intermediate stage outputs.
+
+    Entries are stored under ``{root}/{stage}/{key[:2]}/``, where the key is a hash of everything
+    the stage output depends on (input file digest, network digests, stage parameters, and the
+    key of the previous stage). In the ``npz`` format an entry is a compressed ``{key}.npz``
+    archive; in the ``npy`` format it is a ``{key}/`` folder of uncompressed ``.npy`` files that
+    are memory-mapped when read, so reusing an entry costs no decompression and only touches
+    the pages that are used. Reading an entry refreshes its modification time, and the least
+    recently used entries are evicted once the cache grows beyond ``max_bytes``.
+    """
+
+    def __init__(self, root, max_bytes=None, digests=None, format="npz"):
+        """
+        Args:
+            root (str): Cache directory (created if needed).
+            max_bytes (int, optional): Size limit of the cache in bytes. Unlimited when None.
+            digests (dict, optional): Network digests returned by model_digests, mixed into the
+                keys of the network stages.
+            format (str, optional): Storage format of new entries (see CACHE_FORMATS). Defaults to 'npz'.
+        """
+        if format not in CACHE_FORMATS:
+            raise ValueError(f"format must be one of {set(CACHE_FORMATS)}")
+        self.root = root
+        self.max_bytes = max_bytes
+        self.digests = digests or {}
+        self.format = format
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+        self.size = sum(size for _, size in self.entries())
+
+    @staticmethod
+    def key(*parts):
+        """
+        Hash JSON-serializable parts into a cache key.
+
+        Returns:
+            str: Hexadecimal SHA-256 digest.
+        """
+        payload = json.dumps(parts, sort_keys=True, default=str).encode("utf-8")
+        return hashlib.sha256(payload).hexdigest()
+
+    def path(self, stage, key):
+        name = f"{key}.npz" if self.format == "npz" else key
+        return os.path.join(self.root, stage, key[:2], name)
+
+    def entries(self):
+        """
+        List the entries of the cache, in both formats.
+
+        Temporary files and folders of entries being written are skipped, and so are entries
+        removed or replaced by another worker while they are listed.
+
+        Yields:
+            tuple: (path, size in bytes) of every entry.
+        """
+        for directory, folders, files in os.walk(self.root):
+            entries = [name for name in files if name.endswith(".npz")]
+            if os.path.relpath(directory, self.root).count(os.sep) == 1:
+                # Entry folders of the npy format, found at {root}/{stage}/{key[:2]}/{key}/
+                entries += folders
+                folders[:] = []
+            for name in entries:
+                if name.startswith("tmp"):
+                    continue
+                path = os.path.join(directory, name)
+                try:
+                    if os.path.isdir(path):
+                        size = sum(os.path.getsize(os.path.join(path, f)) for f in os.listdir(path))
+                    else:
+                        size = os.path.getsize(path)
+                except OSError:
+                    continue
+                yield path, size
+
+    def load(self, stage, key):
+        """
+        Read a cached stage output.
+
+        Args:
+            stage (str): Stage name.
+            key (str): Cache key.
+
+        Returns:
+            dict or None: The stored arrays, or None on a cache miss. Arrays of the ``npy``
+            format are copy-on-write memory maps: they can be modified without changing the entry.
+        """
+        path = self.path(stage, key)
+        try:
+            if self.format == "npz":
+                with np.load(path) as archive:
+                    arrays = {name: archive[name] for name in archive.files}
+            else:
+                arrays = {os.path.splitext(name)[0]: np.load(os.path.join(path, name), mmap_mode="c") for name in os.listdir(path) if name.endswith(".npy")}
+                if not arrays:
+                    return None
+            os.utime(path)
+        except (OSError, ValueError):
+            return None
+        return arrays
+
+    def save(self, stage, key, **arrays):
+        """
+        Store a stage output, then evict old entries if the cache is over its size limit.
+
+        Args:
+            stage (str): Stage name.
+            key (str): Cache key.
+            **arrays (numpy.ndarray): Arrays to store.
+        """
+        path = self.path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+
+        # Write to a temporary file (or folder) first so that readers never see a partial entry
+        if self.format == "npz":
+            fd, tmp = tempfile.mkstemp(suffix=".npz", dir=os.path.dirname(path))
+            with os.fdopen(fd, "wb") as f:
+                np.savez_compressed(f, **arrays)
+            # An entry stored meanwhile by another worker is replaced, not added to the size
+            try:
+                previous = os.path.getsize(path)
+            except OSError:
+                previous = 0
+            os.replace(tmp, path)
+            size = os.path.getsize(path) - previous
+        else:
+            tmp = tempfile.mkdtemp(dir=os.path.dirname(path))
+            for name, array in arrays.items():
+                np.save(os.path.join(tmp, f"{name}.npy"), np.ascontiguousarray(array))
+            size = sum(os.path.getsize(os.path.join(tmp, f)) for f in os.listdir(tmp))
+            try:
+                os.replace(tmp, path)
+            except OSError:
+                # Another worker stored the same entry first
+                shutil.rmtree(tmp, ignore_errors=True)
+                return
+
+        with self.lock:
+            self.size += size
+            if self.max_bytes is not None and self.size > self.max_bytes:
+                self.evict()
+
+    def fetch(self, stage, key, compute):
+        """
+        Return the cached output of a stage, computing and storing it on a miss.
+
+        Args:
+            stage (str): Stage name.
+            key (str): Cache key.
+            compute (callable): Called without arguments to produce the output array.
+
+        Returns:
+            numpy.ndarray: The stage output.
+        """
+        entry = self.load(stage, key)
+        if entry is not None:
+            return entry["output"]
+        output = compute()
+        self.save(stage, key, output=output)
+        return output
+
+    def evict(self):
+        # Remove least recently used entries until the cache is back under 90% of its limit
+        entries = []
+        for path, size in self.entries():
+            try:
+                mtime = os.stat(path).st_mtime
+            except OSError:
+                continue
+            entries.append((mtime, size, path))
+        entries.sort()
+
+        self.size = sum(size for _, size, _ in entries)
+        for _, size, path in entries:
+            if self.size <= 0.9 * self.max_bytes:
+                break
+            try:
+                if os.path.isdir(path):
+                    shutil.rmtree(path)
+                else:
+                    os.remove(path)
+            except OSError:
+                continue
+            self.size -= size
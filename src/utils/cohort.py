@@ -0,0 +1,96 @@
+import glob
+import os
+import threading
+
+import pandas as pd
+
+from utils.make_csv import LEVELS
+from utils.workers import locked_append
+
+# Folder, inside the output folder, holding the cohort tables
+COHORT_DIR = "cohort"
+
+
+class CohortTables:
+    """
+    One CSV table per level with one row per subject, appended as subjects finish.
+
+    Tables are written to ``{root}/{level}.csv`` with a leading ``subject`` column. Every
+    append is flushed to disk, so the tables are usable while a batch is still running and
+    survive an interrupted run. A subject processed again (e.g. with ``--resume`` after a
+    failure) gets a new row; :func:`read_cohort_table` keeps the last one.
+    """
+
+    def __init__(self, root):
+        """
+        Args:
+            root (str): Folder of the tables (created if needed).
+        """
+        self.root = root
+        self.lock = threading.Lock()
+        os.makedirs(root, exist_ok=True)
+
+    def path(self, level):
+        return os.path.join(self.root, f"{level}.csv")
+
+    def append(self, volumes):
+        """
+        Append the volumes of one subject to every level table.
+
+        Args:
+            volumes (dict): Mapping from level name to a one-row DataFrame indexed by subject,
+                as returned by ``utils.make_csv.compute_volumes``.
+        """
+        with self.lock:
+            for level, df in volumes.items():
+                # The header check happens under the file lock, as --cpu-workers processes append too
+                with locked_append(self.path(level)) as f:
+                    df.to_csv(f, header=f.tell() == 0, index_label="subject")
+
+
+def read_cohort_table(path):
+    """
+    Read a cohort table, keeping the last row of subjects that were appended more than once.
+
+    Args:
+        path (str): Cohort table written by :class:`CohortTables`.
+
+    Returns:
+        pandas.DataFrame: One row per subject, indexed by subject.
+    """
+    df = pd.read_csv(path, index_col="subject")
+    return df[~df.index.duplicated(keep="last")]
+
+
+def compact_subject_tables(output_dir, root=None):
+    """
+    Build the cohort tables from the per-subject CSV files of an output folder.
+
+    Each subject folder ``{output_dir}/{basename}/csv/{basename}_{level}.csv`` contributes
+    one row to ``{root}/{level}.csv``. Existing cohort tables are replaced.
+
+    Args:
+        output_dir (str): Output folder of a previous run.
+        root (str, optional): Folder of the cohort tables. Defaults to ``{output_dir}/cohort``.
+
+    Returns:
+        dict: Mapping from level name to the number of subjects written.
+    """
+    root = root or os.path.join(output_dir, COHORT_DIR)
+    os.makedirs(root, exist_ok=True)
+
+    counts = {}
+    for level in LEVELS:
+        frames = []
+        for path in sorted(glob.glob(os.path.join(output_dir, "*", "csv", f"*_{level}.csv"))):
+            basename = os.path.basename(os.path.dirname(os.path.dirname(path)))
+            if os.path.basename(path) != f"{basename}_{level}.csv":
+                continue
+            df = pd.read_csv(path)
+            df.index = pd.Index([basename] * len(df), name="subject")
+            frames.append(df)
+        if not frames:
+            continue
+        pd.concat(frames).to_csv(os.path.join(root, f"{level}.csv"), index_label="subject")
+        counts[level] = len(frames)
+    return counts
@@ -1,44 +1,61 @@
 import numpy as np
-import torch
 from scipy import ndimage
-from scipy.ndimage import binary_closing
 
 from utils.functions import normalize, reimburse_conform
+from utils.inference import infer_slices
+from utils.morphology import cube_closing
+from utils.volume import float32_data
 
+# The cropping network sees whole slices of the conformed 256³ grid; finer grids are tiled
+CROP_TILE_SIZE = 256
 
-def crop(voxel, model, device):
+# Position the centre of mass of the head mask is moved to, and margin removed on each side
+# of the 256³ grid to obtain the 224³ volume seen by the other networks
+CROP_CENTER = (128, 120, 128)
+CROP_MARGIN = 16
+
+
+def crop_layout(shape):
+    """
+    Scale the cropping layout of the 256³ grid to a conformed grid of any size.
+
+    Grids finer than 1 mm (see ``--resolution``) cover the same 256 mm field of view
+    with more voxels, so the centre and margin are scaled accordingly.
+
+    Args:
+        shape (tuple[int, int, int]): Shape of the conformed grid.
+
+    Returns:
+        tuple: (center, margin), the target centre (tuple of 3 ints) and the margin in voxels.
+    """
+    scale = shape[0] / 256
+    return tuple(int(round(c * scale)) for c in CROP_CENTER), int(round(CROP_MARGIN * scale))
+
+
+def crop(voxel, model, device, batch_size=None):
     """
     Apply a neural network-based cropping operation on 3D voxel data.
 
     This function slides a 3-slice window across the input volume along the first axis
-    and predicts a binary mask for each slice using the given model. The outputs are then
-    aggregated into a full 3D prediction volume.
+    and predicts a binary mask for each slice using the given model. Slices are pushed
+    through the model in mini-batches and the outputs are aggregated into a full 3D
+    prediction volume.
 
     Args:
-        voxel (numpy.ndarray): Input 3D array of shape (N, 256, 256). The first dimension
-            corresponds to the slice index (typically coronal or sagittal).
+        voxel (numpy.ndarray): Input 3D array of shape (N, 256, 256), or larger on grids
+            finer than 1 mm. The first dimension corresponds to the slice index
+            (typically coronal or sagittal).
         model (torch.nn.Module): The trained PyTorch model that predicts binary masks
             for each input slice triplet.
         device (torch.device): The device (CPU, CUDA, or MPS) on which inference will run.
+        batch_size (int, optional): Number of slices per forward pass. Chosen from the
+            available memory when None.
 
     Returns:
-        torch.Tensor: The predicted 3D binary mask of shape (256, 256, 256).
+        torch.Tensor: The predicted 3D binary mask, with the shape of ``voxel``.
     """
-    # Pad the input volume by one slice at each end to allow 3-slice context
-    voxel = np.pad(voxel, [(1, 1), (0, 0), (0, 0)], "constant", constant_values=voxel.min())
-    model.eval()
-
-    with torch.inference_mode():
-        box = torch.zeros(256, 256, 256)
-
-        # Iterate through each target slice and predict using a 3-slice input context
-        for i in range(1, 257):
-            image = np.stack([voxel[i - 1], voxel[i], voxel[i + 1]])
-            image = torch.tensor(image.reshape(1, 3, 256, 256)).to(device)
-            x_out = torch.sigmoid(model(image)).detach().cpu()
-            box[i - 1] = x_out
-
-        return box.reshape(256, 256, 256)
+    box = infer_slices(voxel, model, device, "sigmoid", 1, batch_size, tile_size=CROP_TILE_SIZE)
+    return box.reshape(voxel.shape)
 
 
 def closing(voxel):
@@ -52,71 +69,96 @@ def closing(voxel):
         voxel (numpy.ndarray): 3D binary array representing the voxel mask.
 
     Returns:
-        numpy.ndarray: Smoothed 3D mask after applying binary closing.
+        numpy.ndarray: Smoothed 3D mask after applying binary closing
+        (3 iterations with a 3×3×3 cube, see utils.morphology.cube_closing).
     """
-    selem = np.ones((3, 3, 3), dtype=bool)
-    voxel = binary_closing(voxel, structure=selem, iterations=3)
-    return voxel
+    return cube_closing(voxel, iterations=3)
 
 
-def cropping(output_dir, basename, odata, data, cnet, device, output_ext=".nii.gz"):
+def predict_crop_mask(data, cnet, device, batch_size=None):
     """
-    Perform 3D brain region cropping using a deep learning model.
-
-    The function normalizes the image, runs dual-view (coronal and sagittal) inference
-    to estimate the brain mask, refines it using morphological operations, and finally
-    centers and crops the resulting image around the brain.
+    Predict the head mask used for face cropping.
 
     Args:
-        output_dir (str): Directory where intermediate and final outputs are saved.
-        basename (str): Base filename (without extension) for saving outputs.
-        odata (nibabel.Nifti1Image): Original input image (pre-conformation).
         data (nibabel.Nifti1Image): Preprocessed and conformed input image.
         cnet (torch.nn.Module): Cropping network model.
         device (torch.device): Device used for inference.
+        batch_size (int, optional): Number of slices per forward pass.
 
     Returns:
-        tuple:
-            - numpy.ndarray: Cropped brain volume of shape approximately (224, 224, 224).
-            - tuple[int, int, int]: (xd, yd, zd) shift applied to center the brain.
+        numpy.ndarray: Boolean mask with the shape of the conformed grid.
     """
     # Convert to float32 and normalize intensity
-    voxel = data.get_fdata().astype("float32")
-    voxel = normalize(voxel, "cropping")
+    voxel = normalize(float32_data(data), "cropping")
 
     # Generate two orthogonal views for model inference
     coronal = voxel.transpose(1, 2, 0)
     sagittal = voxel
 
     # Run model inference for both views
-    out_c = crop(coronal, cnet, device).permute(2, 0, 1)
-    out_s = crop(sagittal, cnet, device)
+    out_c = crop(coronal, cnet, device, batch_size).permute(2, 0, 1)
+    out_s = crop(sagittal, cnet, device, batch_size)
 
     # Average predictions from both views and threshold
     out_e = ((out_c + out_s) / 2) > 0.5
     out_e = out_e.cpu().numpy()
 
     # Refine mask via binary closing
-    out_e = closing(out_e)
+    return closing(out_e)
+
+
+def cropping(output_dir, basename, odata, data, cnet, device, output_ext=".nii.gz", batch_size=None, geometry=None, mask=None, writer=None, save=True):
+    """
+    Perform 3D brain region cropping using a deep learning model.
+
+    The function normalizes the image, runs dual-view (coronal and sagittal) inference
+    to estimate the brain mask, refines it using morphological operations, and finally
+    centers and crops the resulting image around the brain.
+
+    Args:
+        output_dir (str): Directory where intermediate and final outputs are saved.
+        basename (str): Base filename (without extension) for saving outputs.
+        odata (nibabel.Nifti1Image): Original input image (pre-conformation).
+        data (nibabel.Nifti1Image): Preprocessed and conformed input image.
+        cnet (torch.nn.Module): Cropping network model.
+        device (torch.device): Device used for inference.
+        output_ext (str): Extension of the saved NIfTI files.
+        batch_size (int, optional): Number of slices per forward pass.
+        geometry (utils.geometry.Geometry, optional): Precomputed mapping to the native grid.
+        mask (numpy.ndarray, optional): Previously predicted mask (see predict_crop_mask),
+            e.g. read from the stage cache. The network is not run when given.
+        writer (utils.writer.WriteSession, optional): Session queuing the saves on the writer threads.
+        save (bool, optional): Save the mask and the masked image. Defaults to True.
+
+    Returns:
+        tuple:
+            - numpy.ndarray: Cropped brain volume of shape (224, 224, 224) on the 256³ grid
+              (the conformed grid minus the scaled margin on finer grids).
+            - tuple[int, int, int]: (xd, yd, zd) shift applied to center the brain.
+    """
+    # Predict the head mask unless it is already known
+    out_e = predict_crop_mask(data, cnet, device, batch_size) if mask is None else mask
 
     # Apply the mask to the original image
-    cropped = data.get_fdata().astype("float32") * out_e
+    cropped = float32_data(data) * out_e
 
     # Save the binary mask in the output directory
-    reimburse_conform(output_dir, basename, "cropped", odata, data, out_e, output_ext)
+    if save:
+        reimburse_conform(output_dir, basename, "cropped", odata, data, out_e, output_ext, geometry, writer)
 
     # Compute center of mass for the masked brain
     x, y, z = map(int, ndimage.center_of_mass(out_e))
 
     # Compute shifts required to center the brain
-    xd = 128 - x
-    yd = 120 - y
-    zd = 128 - z
+    center, margin = crop_layout(out_e.shape)
+    xd = center[0] - x
+    yd = center[1] - y
+    zd = center[2] - z
 
     # Translate (roll) the image to center the brain region
     cropped = np.roll(cropped, (xd, yd, zd), axis=(0, 1, 2))
 
     # Crop out boundary padding to reduce size and focus on the centered brain
-    cropped = cropped[16:-16, 16:-16, 16:-16]
+    cropped = cropped[margin:-margin, margin:-margin, margin:-margin]
 
     return cropped, (xd, yd, zd)
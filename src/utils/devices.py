@@ -0,0 +1,89 @@
+import torch
+
+
+def parse_devices(specs, default):
+    """
+    Resolve the ``--devices`` arguments into a list of devices.
+
+    Args:
+        specs (list[str] or None): Device names such as ``cuda:0``, ``cuda:1``, ``mps`` or ``cpu``
+            (repeated names add pool members on the same device), or ``all`` for every CUDA device.
+        default (torch.device): Device used when ``specs`` is empty, or for ``all`` without CUDA.
+
+    Returns:
+        list[torch.device]: Devices of the pool, in order.
+    """
+    devices = []
+    for spec in specs or []:
+        if spec == "all":
+            count = torch.cuda.device_count()
+            if count:
+                devices.extend(torch.device(f"cuda:{index}") for index in range(count))
+            else:
+                devices.append(default)
+        else:
+            devices.append(torch.device(spec))
+    return devices or [default]
+
+
+class DevicePool:
+    """
+    Inference devices of a run, each with the networks loaded on it.
+
+    Every member is a ``(models, device)`` pair; members on the same device share one copy of
+    the networks, whose forward passes are safe to run from several threads. The pool is used
+    either to process whole subjects in parallel (one inference thread per member, see
+    ``utils.scheduler.run_pipeline``) or to spread the views of one subject over the members
+    (see ``utils.inference.fuse_views``). Members are threads of the same process, so several
+    CPU members would share the intra-op thread pool of torch without running any faster than
+    one: a pool holds at most one CPU member, and the CPU is split between processes with
+    ``--cpu-workers`` instead.
+    """
+
+    def __init__(self, devices):
+        """
+        Args:
+            devices (list[torch.device]): Devices of the pool (see :func:`parse_devices`).
+
+        Raises:
+            ValueError: If the CPU is listed more than once.
+        """
+        self.devices = list(devices)
+        if sum(device.type == "cpu" for device in self.devices) > 1:
+            raise ValueError("the CPU can only be listed once in --devices; use --cpu-workers to run several CPU processes")
+        self.models = [None] * len(self.devices)
+
+    def load(self, load_model):
+        """
+        Load the networks on every device of the pool.
+
+        Args:
+            load_model (callable): ``load_model(device) -> models``, called once per distinct device.
+        """
+        loaded = {}
+        for index, device in enumerate(self.devices):
+            if str(device) not in loaded:
+                loaded[str(device)] = load_model(device)
+            self.models[index] = loaded[str(device)]
+
+    @property
+    def members(self):
+        return list(zip(self.models, self.devices))
+
+    def shards(self, network):
+        """
+        Return the ``(model, device)`` pairs of one network, one per member.
+
+        Args:
+            network (int): Index of the network in the models tuple (0 CNet, 1 SSNet, 2 PNet, 3 HNet).
+
+        Returns:
+            list[tuple]: Shards passed to ``parcellation`` and ``hemisphere``.
+        """
+        return [(models[network], device) for models, device in self.members]
+
+    def __len__(self):
+        return len(self.devices)
+
+    def __str__(self):
+        return ", ".join(str(device) for device in self.devices)
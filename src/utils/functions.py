@@ -2,7 +2,9 @@ import os
 
 import nibabel as nib
 import numpy as np
-from nibabel import processing
+
+from utils.geometry import Geometry
+from utils.writer import write_image
 
 
 def normalize(voxel, mode):
@@ -17,19 +19,35 @@ def normalize(voxel, mode):
     return voxel.astype("float32")
 
 
-def reimburse_conform(output_dir, basename, suffix, odata, data, output, output_ext=".nii.gz"):
-    nii = nib.Nifti1Image(output.astype(np.uint16), affine=data.affine)
-    header = odata.header
-    nii = processing.conform(
-        nii,
-        out_shape=(header["dim"][1], header["dim"][2], header["dim"][3]),
-        voxel_size=(header["pixdim"][1], header["pixdim"][2], header["pixdim"][3]),
-        order=0,
-    )
+def reimburse_conform(output_dir, basename, suffix, odata, data, output, output_ext=".nii.gz", geometry=None, writer=None):
+    """
+    Map a binary mask from the conformed grid back to the native grid and save it.
+
+    Both the mask and the native image multiplied by the mask are written under
+    ``{output_dir}/{suffix}/``.
+
+    Args:
+        output_dir (str): Directory where the outputs are saved.
+        basename (str): Base filename (without extension) for saving outputs.
+        suffix (str): Name of the stage (e.g., "cropped", "stripped").
+        odata (nibabel.Nifti1Image): Image defining the native output geometry.
+        data (nibabel.Nifti1Image): Conformed image whose affine applies to ``output``.
+        output (numpy.ndarray): Binary mask on the conformed grid.
+        output_ext (str): Extension of the saved NIfTI files.
+        geometry (utils.geometry.Geometry, optional): Precomputed mapping to the native grid.
+            Built from ``odata`` and ``data`` when None.
+        writer (utils.writer.WriteSession, optional): Session queuing the saves on the writer
+            threads. The images are saved synchronously when None.
+    """
+    if geometry is None:
+        geometry = Geometry(odata, data)
+
+    # Binary mask stored as uint8
+    nii = geometry.to_native_image(output, np.uint8)
     os.makedirs(os.path.join(output_dir, f"{suffix}"), exist_ok=True)
-    nib.save(nii, os.path.join(output_dir, f"{suffix}/{basename}_{suffix}_mask{output_ext}"))
+    write_image(nii, os.path.join(output_dir, f"{suffix}/{basename}_{suffix}_mask{output_ext}"), writer)
 
-    result = odata.get_fdata().astype("float32") * nii.get_fdata().astype("int16")
-    nii = nib.Nifti1Image(result.astype(np.float32), affine=odata.affine)
-    nib.save(nii, os.path.join(output_dir, f"{suffix}/{basename}_{suffix}{output_ext}"))
+    result = geometry.native * np.asanyarray(nii.dataobj)
+    nii = nib.Nifti1Image(result.astype(np.float32, copy=False), affine=odata.affine)
+    write_image(nii, os.path.join(output_dir, f"{suffix}/{basename}_{suffix}{output_ext}"), writer)
     return
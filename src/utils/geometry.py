@@ -0,0 +1,88 @@
+from functools import cached_property
+
+import nibabel as nib
+import numpy as np
+from nibabel import processing
+
+from utils.volume import float32_data
+
+
+class Geometry:
+    """
+    Nearest-neighbour mapping from the conformed 256³ grid back to the native image grid.
+
+    Every mask and label volume of a subject is resampled to the same native geometry
+    (the shape and voxel size of the N4-corrected image). Instead of calling
+    ``nibabel.processing.conform`` for each of them, the mapping is computed once by
+    resampling an image of voxel indices, and then applied to any volume as a gather.
+    The result is identical to ``conform(..., order=0)`` on that volume.
+
+    Attributes:
+        affine (numpy.ndarray): Affine of the native output grid.
+        header (nibabel.Nifti1Header): Header of the native output grid.
+        shape (tuple[int, int, int]): Shape of the native output grid.
+        native (numpy.ndarray): float32 intensities of the native (N4-corrected) image.
+    """
+
+    def __init__(self, odata, data):
+        """
+        Args:
+            odata (nibabel.Nifti1Image): Image defining the native output geometry.
+            data (nibabel.Nifti1Image): Conformed image whose affine applies to the volumes to map.
+        """
+        self.source_shape = data.shape[:3]
+
+        # Resample the (1-based) flat voxel index of every conformed voxel; 0 marks voxels
+        # that fall outside of the conformed grid.
+        index = np.arange(1, np.prod(self.source_shape) + 1, dtype=np.int32).reshape(self.source_shape)
+        header = odata.header
+        mapped = processing.conform(
+            nib.Nifti1Image(index, affine=data.affine),
+            out_shape=(header["dim"][1], header["dim"][2], header["dim"][3]),
+            voxel_size=(header["pixdim"][1], header["pixdim"][2], header["pixdim"][3]),
+            order=0,
+        )
+        index = np.asanyarray(mapped.dataobj)
+
+        self.affine = mapped.affine
+        self.header = mapped.header
+        self.shape = index.shape
+        self.outside = index == 0
+        self.index = np.maximum(index - 1, 0)
+        self.odata = odata
+
+    @cached_property
+    def native(self):
+        # Native intensities, decoded once as float32
+        return float32_data(self.odata)
+
+    def to_native(self, volume, dtype=np.uint16):
+        """
+        Map a volume defined on the conformed grid to the native grid.
+
+        Args:
+            volume (numpy.ndarray): Volume with the shape of the conformed grid.
+            dtype (numpy.dtype, optional): Data type of the returned array. Defaults to uint16.
+
+        Returns:
+            numpy.ndarray: Volume of shape ``self.shape`` resampled with nearest neighbour.
+        """
+        volume = np.asarray(volume, dtype=dtype).reshape(-1)
+        out = volume.take(self.index)
+        out[self.outside] = 0
+        return out
+
+    def to_native_image(self, volume, dtype=np.uint16):
+        """
+        Map a volume defined on the conformed grid to a NIfTI image on the native grid.
+
+        Args:
+            volume (numpy.ndarray): Volume with the shape of the conformed grid.
+            dtype (numpy.dtype, optional): Data type of the stored image. Defaults to uint16.
+
+        Returns:
+            nibabel.Nifti1Image: The resampled image, as returned by ``conform(..., order=0)``.
+        """
+        nii = nib.Nifti1Image(self.to_native(volume, dtype), affine=self.affine, header=self.header)
+        nii.set_data_dtype(dtype)
+        return nii
@@ -1,52 +1,35 @@
-import numpy as np
 import torch
-from scipy.ndimage import binary_dilation
 
 from utils.functions import normalize
+from utils.inference import brain_bounds, fuse_views, infer_slices
+from utils.morphology import cross_dilation
 
 
-def separate(voxel, model, device):
+def separate(voxel, model, device, batch_size=None):
     """
     Perform slice-wise inference using a hemisphere separation model.
 
     This function runs a 2.5D neural network across slices of a 3D input volume.
     Each slice is processed in the context of its immediate neighbors (previous
-    and next slices) to improve spatial coherence. The model outputs a
-    three-class probability map distinguishing background, left hemisphere,
-    and right hemisphere regions.
+    and next slices) to improve spatial coherence, and slices are pushed through
+    the model in mini-batches. The model outputs a three-class probability map
+    distinguishing background, left hemisphere, and right hemisphere regions.
 
     Args:
-        voxel (numpy.ndarray): Input voxel data of shape (N, 224, 224).
+        voxel (numpy.ndarray): Input voxel data of shape (N, 224, 224), or larger on grids finer than 1 mm.
         model (torch.nn.Module): Trained hemisphere segmentation model (U-Net architecture).
         device (torch.device): Computational device (CPU, CUDA, or MPS).
+        batch_size (int, optional): Number of slices per forward pass. Chosen from the
+            available memory when None.
 
     Returns:
-        torch.Tensor: A tensor of shape (224, 3, 224, 224) containing softmax
+        torch.Tensor: A tensor of shape (N, 3, 224, 224) containing softmax
         probabilities for each class at every voxel.
     """
-    model.eval()
+    return infer_slices(voxel, model, device, "softmax", 3, batch_size)
 
-    # Pad the volume by one slice on both ends to provide full 3-slice context
-    voxel = np.pad(voxel, [(1, 1), (0, 0), (0, 0)], "constant", constant_values=voxel.min())
 
-    with torch.inference_mode():
-        # Output tensor for storing model predictions (class probabilities)
-        box = torch.zeros(224, 3, 224, 224)
-
-        # Iterate slice-by-slice along the first axis
-        for i in range(1, 225):
-            image = np.stack([voxel[i - 1], voxel[i], voxel[i + 1]])
-            image = torch.tensor(image.reshape(1, 3, 224, 224)).to(device)
-
-            # Model inference with softmax normalization across classes
-            x_out = torch.softmax(model(image), dim=1).detach().cpu()
-            box[i - 1] = x_out
-
-        # Return complete 3D probability map
-        return box.reshape(224, 3, 224, 224)
-
-
-def hemisphere(voxel, hnet, device):
+def hemisphere(voxel, hnet, device, batch_size=None, sparse=False, shards=None):
     """
     Perform hemisphere separation on a brain MRI volume using a deep learning model.
 
@@ -60,6 +43,11 @@ def hemisphere(voxel, hnet, device):
         voxel (numpy.ndarray): Input 3D brain volume to be separated into hemispheres.
         hnet (torch.nn.Module): Trained hemisphere segmentation model.
         device (torch.device): Target device for computation (e.g., 'cuda', 'cpu').
+        batch_size (int, optional): Number of slices per forward pass.
+        sparse (bool, optional): Only run the network on the slices that intersect the
+            bounding box of the brain; the other slices are background. Defaults to False.
+        shards (list[tuple], optional): ``(hnet, device)`` pair of every device the two views are
+            spread over (see ``utils.inference.fuse_views``). Only ``(hnet, device)`` when None.
 
     Returns:
         numpy.ndarray: A 3D integer array representing the hemisphere mask:
@@ -67,6 +55,9 @@ def hemisphere(voxel, hnet, device):
             - 1: Left hemisphere
             - 2: Right hemisphere
     """
+    # Slice ranges of the brain along every axis (every slice when not sparse)
+    bounds = brain_bounds(voxel) if sparse else [None] * 3
+
     # Normalize voxel intensities for inference
     voxel = normalize(voxel, "hemisphere")
 
@@ -74,12 +65,11 @@ def hemisphere(voxel, hnet, device):
     coronal = voxel.transpose(1, 2, 0)
     transverse = voxel.transpose(2, 1, 0)
 
-    # Perform inference for both coronal and transverse orientations
-    out_c = separate(coronal, hnet, device).permute(1, 3, 0, 2)
-    out_a = separate(transverse, hnet, device).permute(1, 3, 2, 0)
-
-    # Fuse both outputs by summing class probabilities
-    out_e = out_c + out_a
+    # Perform inference for both coronal and transverse orientations and fuse both
+    # outputs by summing class probabilities into a single accumulator
+    out_e = torch.zeros((3,) + voxel.shape, dtype=torch.float32)
+    views = [((1, 3, 0, 2), coronal, None, bounds[1]), ((1, 3, 2, 0), transverse, None, bounds[2])]
+    fuse_views(out_e, views, shards or [(hnet, device)], "softmax", batch_size)
 
     # Determine final class labels (0, 1, or 2) by selecting the most probable class
     out_e = torch.argmax(out_e, dim=0).cpu().numpy()
@@ -92,12 +82,12 @@ def hemisphere(voxel, hnet, device):
     # --------------------------
 
     # First, dilate the left hemisphere (class 1)
-    dilated_mask_1 = binary_dilation(out_e == 1, iterations=5).astype("int16")
+    dilated_mask_1 = cross_dilation(out_e == 1, iterations=5).astype("int16")
     # Preserve right hemisphere voxels from the original prediction
     dilated_mask_1[out_e == 2] = 2
 
     # Then, dilate the right hemisphere (class 2) symmetrically
-    dilated_mask_2 = binary_dilation(dilated_mask_1 == 2, iterations=5).astype("int16") * 2
+    dilated_mask_2 = cross_dilation(dilated_mask_1 == 2, iterations=5).astype("int16") * 2
     # Restore left hemisphere voxels to prevent overwriting
     dilated_mask_2[dilated_mask_1 == 1] = 1
 
@@ -0,0 +1,377 @@
+import contextlib
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import torch
+
+from utils.profiling import attach_stage, current_stage, record_view
+
+# Upper bound on the number of slices pushed through a network in a single call.
+# Larger batches stop paying off once the per-call overhead is amortized.
+MAX_BATCH_SIZE = {"cuda": 64, "mps": 16, "cpu": 16}
+
+# Approximate number of full-resolution float32 feature maps alive at the peak of
+# a UNet forward pass (first encoder/decoder level, 64 channels, skip + concat).
+UNET_PEAK_FEATURES = 64 * 6
+
+# In-plane size of the slices the networks were trained on (224² after face cropping).
+# Larger slices, from grids finer than 1 mm, are processed as overlapping tiles of this size.
+TILE_SIZE = 224
+
+# Fraction of a tile shared with its neighbours when a slice is tiled
+TILE_OVERLAP = 0.25
+
+# Slices kept on each side of the brain bounding box when slices outside of it are skipped
+BOUNDS_MARGIN = 2
+
+
+def available_memory(device):
+    """
+    Return the amount of memory (in bytes) currently available on a device.
+
+    Args:
+        device (torch.device): Device whose free memory is queried.
+
+    Returns:
+        int or None: Free memory in bytes, or None if it cannot be determined.
+    """
+    if device.type == "cuda":
+        free, _ = torch.cuda.mem_get_info(device)
+        return free
+    if device.type == "cpu":
+        try:
+            return os.sysconf("SC_AVPHYS_PAGES") * os.sysconf("SC_PAGE_SIZE")
+        except (ValueError, OSError, AttributeError):
+            return None
+    return None
+
+
+def auto_batch_size(device, in_channels, out_channels, height, width):
+    """
+    Pick a slice batch size that fits in the memory currently available on a device.
+
+    The estimate assumes the activation footprint of the UNet used by every stage
+    of the pipeline and keeps a safety margin for the probability accumulators that
+    live alongside the network.
+
+    Args:
+        device (torch.device): Device on which inference will run.
+        in_channels (int): Number of input channels per slice.
+        out_channels (int): Number of output channels per slice.
+        height (int): Slice height in voxels.
+        width (int): Slice width in voxels.
+
+    Returns:
+        int: Number of slices to process per forward pass (at least 1).
+    """
+    limit = MAX_BATCH_SIZE.get(device.type, 1)
+    free = available_memory(device)
+    if free is None:
+        return min(8, limit)
+
+    # Keep half of the free memory on accelerators and a quarter on the host,
+    # where the fused probability volumes are also stored.
+    budget = free * (0.5 if device.type == "cuda" else 0.25)
+    per_slice = 4 * height * width * (UNET_PEAK_FEATURES + 2 * out_channels + in_channels)
+    return int(max(1, min(limit, budget // per_slice)))
+
+
+def slice_windows(voxel):
+    """
+    Build the 3-slice context stacks of a volume as a strided view.
+
+    The volume is padded by one slice at each end of the first axis (with its minimum
+    value), so that slice ``i`` of the result holds ``(voxel[i - 1], voxel[i], voxel[i + 1])``
+    without copying the data.
+
+    Args:
+        voxel (numpy.ndarray): Input volume of shape (N, H, W).
+
+    Returns:
+        numpy.ndarray: Read-only view of shape (N, 3, H, W).
+    """
+    voxel = np.pad(voxel, [(1, 1), (0, 0), (0, 0)], "constant", constant_values=voxel.min())
+    windows = np.lib.stride_tricks.sliding_window_view(voxel, 3, axis=0)
+    return np.moveaxis(windows, -1, 1)
+
+
+def brain_bounds(voxel, margin=BOUNDS_MARGIN):
+    """
+    Compute the bounding box of the non-zero voxels of a skull-stripped volume.
+
+    Args:
+        voxel (numpy.ndarray): Skull-stripped volume (zero outside of the brain).
+        margin (int, optional): Number of slices added on each side of the box.
+
+    Returns:
+        list[tuple[int, int]]: (first, stop) slice range along every axis; (0, 0) for an empty volume.
+    """
+    brain = voxel != 0
+    bounds = []
+    for axis in range(brain.ndim):
+        other = tuple(a for a in range(brain.ndim) if a != axis)
+        present = np.flatnonzero(brain.any(axis=other))
+        if present.size == 0:
+            bounds.append((0, 0))
+        else:
+            bounds.append((max(0, int(present[0]) - margin), min(brain.shape[axis], int(present[-1]) + 1 + margin)))
+    return bounds
+
+
+def tile_origins(length, tile_size, overlap=TILE_OVERLAP):
+    """
+    Place overlapping tiles along one axis of a slice.
+
+    The first tile starts at 0 and the last one ends at ``length``, so that the tiles
+    cover the slice without any padding; the others are spread evenly in between.
+
+    Args:
+        length (int): Size of the slice along the axis.
+        tile_size (int): Size of a tile along the axis (at most ``length``).
+        overlap (float, optional): Minimum fraction of a tile shared with its neighbour.
+
+    Returns:
+        list[int]: Start index of every tile.
+    """
+    if length <= tile_size:
+        return [0]
+    stride = max(1, int(tile_size * (1 - overlap)))
+    count = -(-(length - tile_size) // stride) + 1
+    return np.linspace(0, length - tile_size, count).round().astype(int).tolist()
+
+
+def blend_window(tile_size, length):
+    """
+    Build the 1D blending weights of the tiles along one axis.
+
+    The weights decrease linearly from the centre of a tile to its borders, so that
+    overlapping tiles fade into each other instead of leaving seams. Axes covered by a
+    single tile use uniform weights.
+
+    Args:
+        tile_size (int): Size of a tile along the axis.
+        length (int): Size of the slice along the axis.
+
+    Returns:
+        torch.Tensor: float32 weights of shape (tile_size,), strictly positive.
+    """
+    if length <= tile_size:
+        return torch.ones(tile_size)
+    return (1 - torch.linspace(-1, 1, tile_size).abs()).clamp_min(1e-3)
+
+
+def iter_slices(voxel, model, device, activation, out_channels, batch_size=None, extra_channel=None, tile_size=TILE_SIZE, bounds=None):
+    """
+    Run 2.5D slice-wise inference over a volume in mini-batches.
+
+    Each slice is fed to the network together with its two neighbours along the
+    first axis. An optional constant-valued extra channel can be appended (used by
+    the parcellation network to encode the anatomical plane).
+
+    Slices larger than ``tile_size`` are split into overlapping tiles of at most
+    ``tile_size``² voxels, and the activated outputs of the tiles are blended with
+    :func:`blend_window` weights into full slices. Slices that fit in a single tile
+    are processed whole, exactly as before.
+
+    Args:
+        voxel (numpy.ndarray): Normalized input volume of shape (N, H, W).
+        model (torch.nn.Module): Network applied to each (B, C, H, W) batch.
+        device (torch.device): Device used for inference (CPU, CUDA, or MPS).
+        activation (str): Output activation, either ``"sigmoid"`` or ``"softmax"``.
+        out_channels (int): Number of channels produced by the network.
+        batch_size (int, optional): Slices per forward pass. Chosen from the available
+            memory when None.
+        extra_channel (float, optional): Value of an additional constant input channel.
+        tile_size (int, optional): Largest in-plane size processed in one piece. Defaults to TILE_SIZE.
+        bounds (tuple[int, int], optional): (first, stop) range of the slices to process;
+            the other slices are skipped. All slices when None.
+
+    Yields:
+        tuple[int, torch.Tensor]: Index of the first slice in the batch and the
+        activated network output of shape (B, out_channels, H, W) on the CPU.
+    """
+    if activation not in ("sigmoid", "softmax"):
+        raise ValueError("activation must be one of {'sigmoid','softmax'}")
+
+    voxel = voxel.astype(np.float32, copy=False)
+    windows = slice_windows(voxel)
+    n, _, height, width = windows.shape
+    in_channels = 3 if extra_channel is None else 4
+    first, last = (0, n) if bounds is None else bounds
+
+    # Tiles covering a slice (a single one when the slice is not larger than a tile)
+    tile_h, tile_w = min(tile_size, height), min(tile_size, width)
+    tiles = [(y, x) for y in tile_origins(height, tile_h) for x in tile_origins(width, tile_w)]
+    if len(tiles) > 1:
+        window = blend_window(tile_h, height)[:, None] * blend_window(tile_w, width)[None, :]
+        norm = torch.zeros((height, width))
+        for y, x in tiles:
+            norm[y : y + tile_h, x : x + tile_w] += window
+
+    if batch_size is None:
+        batch_size = auto_batch_size(device, in_channels, out_channels, tile_h, tile_w)
+
+    def forward(batch):
+        logits = model(torch.from_numpy(batch).to(device))
+        probs = torch.sigmoid(logits) if activation == "sigmoid" else torch.softmax(logits, dim=1)
+        return probs.float().cpu()
+
+    model.eval()
+    buffer = np.empty((batch_size, in_channels, height, width), dtype=np.float32)
+    if extra_channel is not None:
+        buffer[:, 3].fill(extra_channel)
+
+    view_start = time.perf_counter()
+    with torch.inference_mode():
+        for start in range(first, last, batch_size):
+            stop = min(start + batch_size, last)
+            batch = buffer[: stop - start]
+            batch[:, :3] = windows[start:stop]
+
+            if len(tiles) == 1:
+                yield start, forward(batch)
+                continue
+
+            # Blend the tiles of the batch into full slices
+            probs = torch.zeros((stop - start, out_channels, height, width))
+            for y, x in tiles:
+                tile = np.ascontiguousarray(batch[:, :, y : y + tile_h, x : x + tile_w])
+                probs[:, :, y : y + tile_h, x : x + tile_w] += forward(tile) * window
+            yield start, probs.div_(norm)
+
+    # Per-view throughput (includes the time the caller spends on each batch)
+    record_view(max(0, last - first), time.perf_counter() - view_start)
+
+
+def infer_slices(voxel, model, device, activation, out_channels, batch_size=None, extra_channel=None, tile_size=TILE_SIZE):
+    """
+    Run 2.5D slice-wise inference over a whole volume and collect the outputs.
+
+    See :func:`iter_slices` for the meaning of the arguments.
+
+    Returns:
+        torch.Tensor: Activated network output of shape (N, out_channels, H, W) on the CPU.
+    """
+    n, height, width = voxel.shape
+    box = torch.empty((n, out_channels, height, width), dtype=torch.float32)
+    for start, probs in iter_slices(voxel, model, device, activation, out_channels, batch_size, extra_channel, tile_size):
+        box[start : start + probs.shape[0]] = probs
+    return box
+
+
+def fuse_slices(
+    acc, permutation, voxel, model, device, activation, batch_size=None, extra_channel=None, scale=None, bounds=None, lock=None
+):
+    """
+    Run slice-wise inference over one view and add its outputs into a running accumulator.
+
+    Instead of materializing the full (N, C, H, W) output of a view, every mini-batch is
+    permuted into the orientation of the accumulator and summed into it in place, so that
+    multi-view fusion only ever needs a single volume of class scores.
+
+    Args:
+        acc (torch.Tensor): Accumulator in output orientation (classes first), updated in place.
+        permutation (tuple[int, ...]): Permutation mapping a (B, C, H, W) batch to the
+            orientation of ``acc`` (the same one applied to the full view output).
+        voxel (numpy.ndarray): Normalized input volume of shape (N, H, W) for this view.
+        model (torch.nn.Module): Network applied to each batch.
+        device (torch.device): Device used for inference (CPU, CUDA, or MPS).
+        activation (str): Output activation, either ``"sigmoid"`` or ``"softmax"``.
+        batch_size (int, optional): Slices per forward pass. Chosen from the available
+            memory when None.
+        extra_channel (float, optional): Value of an additional constant input channel.
+        scale (float, optional): Factor applied to the probabilities before they are
+            rounded and added to an integer accumulator.
+        bounds (tuple[int, int], optional): (first, stop) range of the slices that may contain
+            foreground (see :func:`brain_bounds`). The network only runs on these slices; the
+            others receive a background (class 0) probability of 1.
+        lock (threading.Lock, optional): Lock held while adding into ``acc``, when several views
+            are fused into it concurrently (see :func:`fuse_views`).
+
+    Returns:
+        torch.Tensor: The updated accumulator.
+    """
+    lock = lock or contextlib.nullcontext()
+    axis = permutation.index(0)
+    out_channels = acc.shape[0]
+    for start, probs in iter_slices(voxel, model, device, activation, out_channels, batch_size, extra_channel, bounds=bounds):
+        probs = probs.permute(permutation)
+        if scale is not None:
+            probs = probs.mul(scale).round_()
+        probs = probs.to(acc.dtype)
+        with lock:
+            acc.narrow(axis, start, probs.shape[axis]).add_(probs)
+
+    # Skipped slices: certain background
+    if bounds is not None:
+        first, last = bounds
+        n = acc.shape[axis]
+        background = acc[0]
+        value = 1 if scale is None else scale
+        with lock:
+            background.narrow(axis - 1, 0, first).add_(value)
+            background.narrow(axis - 1, last, n - last).add_(value)
+    return acc
+
+
+def fuse_views(acc, views, shards, activation, batch_size=None, scale=None):
+    """
+    Fuse several views into one accumulator, spreading them over the devices of a pool.
+
+    With a single shard the views run one after another, as before. With several, view ``i``
+    runs on shard ``i % len(shards)``, one thread per shard, and the additions into ``acc``
+    are serialized by a lock. The result is identical to the sequential one: integer sums do
+    not depend on their order, and with a float accumulator the first two views (whose sum is
+    commutative) run concurrently while every later view starts once the views before it are
+    added, so each voxel is summed in view order.
+
+    Args:
+        acc (torch.Tensor): Accumulator in output orientation (classes first), updated in place.
+        views (list[tuple]): ``(permutation, voxel, extra_channel, bounds)`` of every view,
+            as passed to :func:`fuse_slices`.
+        shards (list[tuple]): ``(model, device)`` pairs, one per device of the pool.
+        activation (str): Output activation, either ``"sigmoid"`` or ``"softmax"``.
+        batch_size (int, optional): Slices per forward pass.
+        scale (float, optional): Factor applied to the probabilities of an integer accumulator.
+
+    Returns:
+        torch.Tensor: The updated accumulator.
+    """
+    if len(shards) == 1:
+        model, device = shards[0]
+        for permutation, voxel, extra_channel, bounds in views:
+            fuse_slices(acc, permutation, voxel, model, device, activation, batch_size, extra_channel, scale, bounds)
+            torch.cuda.empty_cache()
+        return acc
+
+    lock = threading.Lock()
+    fused = threading.Condition()
+    done = set()
+    ordered = acc.is_floating_point()
+    record = current_stage()
+
+    def run(shard):
+        model, device = shards[shard]
+        with attach_stage(record):
+            for index in range(shard, len(views), len(shards)):
+                if ordered and index > 1:
+                    with fused:
+                        fused.wait_for(lambda: done.issuperset(range(index)))
+                permutation, voxel, extra_channel, bounds = views[index]
+                try:
+                    fuse_slices(acc, permutation, voxel, model, device, activation, batch_size, extra_channel, scale, bounds, lock)
+                finally:
+                    # Also on failure, so that the other shards do not wait forever
+                    with fused:
+                        done.add(index)
+                        fused.notify_all()
+
+    assignments = range(min(len(shards), len(views)))
+    with ThreadPoolExecutor(max_workers=len(assignments), thread_name_prefix="view") as executor:
+        for future in [executor.submit(run, shard) for shard in assignments]:
+            future.result()
+    torch.cuda.empty_cache()
+    return acc
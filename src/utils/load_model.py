@@ -2,17 +2,73 @@ import os
 
 import torch
 
-from utils.network import UNet
+from utils.backend import load_exported_models
+from utils.network import InferenceModel, UNet, fold_batchnorm
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 
+# Autocast precisions available for inference ("float32" disables autocast)
+PRECISIONS = {"float32": None, "bfloat16": torch.bfloat16, "float16": torch.float16}
+
+# Options applied to the eager networks only, with the value that leaves them unchanged
+EAGER_OPTIONS = {"fold_bn": False, "precision": "float32", "channels_last": False}
+
+
+def check_backend_options(opt):
+    """
+    Reject eager-only options combined with an exported backend, which would ignore them.
+
+    Args:
+        opt (argparse.Namespace): Parsed command-line arguments.
+
+    Raises:
+        ValueError: If ``opt.backend`` is not 'eager' and any of EAGER_OPTIONS is set.
+    """
+    backend = getattr(opt, "backend", "eager")
+    if backend == "eager":
+        return
+    ignored = [name for name, default in EAGER_OPTIONS.items() if getattr(opt, name, default) != default]
+    if ignored:
+        flags = ", ".join("--" + name.replace("_", "-") for name in ignored)
+        raise ValueError(f"{flags} only apply to the eager backend; the {backend} networks run as exported")
+
+
+def optimize_model(model, fold_bn=False, precision="float32", channels_last=False):
+    """
+    Prepare a loaded network for faster inference.
+
+    Args:
+        model (torch.nn.Module): Network in evaluation mode with its weights loaded.
+        fold_bn (bool, optional): Fold BatchNorm layers into the preceding convolutions.
+        precision (str, optional): One of {'float32', 'bfloat16', 'float16'}. Reduced
+            precisions run the network under ``torch.autocast``.
+        channels_last (bool, optional): Use the channels-last (NHWC) memory format.
+
+    Returns:
+        torch.nn.Module: The network itself when no option is enabled, otherwise the
+        folded network wrapped in an :class:`~utils.network.InferenceModel`.
+    """
+    if precision not in PRECISIONS:
+        raise ValueError(f"precision must be one of {set(PRECISIONS)}")
+    if fold_bn:
+        model = fold_batchnorm(model)
+    if PRECISIONS[precision] is not None or channels_last:
+        model = InferenceModel(model, PRECISIONS[precision], channels_last).eval()
+    return model
+
 
 def load_model(opt, device):
     """
     Load and initialize the pretrained neural network models required for the OpenMAP-T1 pipeline.
 
     This function loads four U-Net–based models from the specified pretrained model directory.
-    Each model is moved to the target device (CPU, CUDA, or MPS) and set to evaluation mode.
+    Each model is moved to the target device (CPU, CUDA, or MPS), set to evaluation mode and
+    optionally prepared for faster inference (see :func:`optimize_model`) according to
+    ``opt.fold_bn``, ``opt.precision`` and ``opt.channels_last``.
+
+    When ``opt.backend`` is 'torchscript' or 'onnxruntime', the networks previously
+    exported by ``src/export_models.py`` are loaded instead of the eager PyTorch models;
+    the eager-only options must then be left unset (see :func:`check_backend_options`).
 
     Models loaded:
         1. **CNet (Cropping Network)** — Performs face cropping and brain localization.
@@ -30,6 +86,12 @@ def load_model(opt, device):
             (cnet, ssnet, pnet, hnet).
     """
     model_dir = opt.m  # Base directory where pretrained model weights are stored
+    check_backend_options(opt)
+
+    # Exported (graph-optimized) networks for the TorchScript / ONNX Runtime backends
+    backend = getattr(opt, "backend", "eager")
+    if backend != "eager":
+        return load_exported_models(model_dir, backend, device)
 
     # --------------------------
     # Load CNet (Cropping Network)
@@ -67,5 +129,11 @@ def load_model(opt, device):
     hnet.to(device)
     hnet.eval()
 
+    # --------------------------
+    # Optional inference optimizations
+    # --------------------------
+    options = {name: getattr(opt, name, default) for name, default in EAGER_OPTIONS.items()}
+    cnet, ssnet, pnet, hnet = (optimize_model(model, **options) for model in (cnet, ssnet, pnet, hnet))
+
     # Return all loaded, device-initialized, and evaluation-ready models
     return cnet, ssnet, pnet, hnet
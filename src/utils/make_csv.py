@@ -1,51 +1,117 @@
 import os
 from collections import defaultdict
+from functools import lru_cache
 
 import numpy as np
 import pandas as pd
+from scipy import sparse
 
 # このファイルのあるディレクトリの絶対パスを取得し、そこから level ディレクトリへの絶対パスを作成
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 LEVEL_DIR = os.path.abspath(os.path.join(CURRENT_DIR, "..", "..", "level"))
 
+# Number of Type1_Level5 regions produced by the pipeline
+N_REGIONS = 280
+
+# Levels written by make_csv, in output order
+LEVELS = [
+    "Type1_Level5",
+    "Type1_Level4",
+    "Type1_Level3",
+    "Type1_Level2",
+    "Type1_Level1",
+    "Type2_Level5",
+    "Type2_Level4",
+    "Type2_Level3",
+    "Type2_Level2",
+    "Type2_Level1",
+]
+
+# LEVEL_DIR を基準に CSV / テキストファイルの絶対パスを作成し、インポート時に一度だけ読み込む
+ROI_NUMBER = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_No.csv"))
+ROI_NAME = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_Name.csv"))
+LEVEL5_NAMES = pd.read_table(os.path.join(LEVEL_DIR, "Type1Level5.txt"), names=["number", "region"]).astype("str")["region"].tolist()
+
+
+@lru_cache(maxsize=None)
+def aggregation_matrix(level="Type1_Level1", sulcus=True):
+    """
+    Build the sparse matrix that sums Type1_Level5 volumes into the regions of another level.
+
+    Parameters:
+    level (str): The target level, e.g. "Type1_Level1". Default is "Type1_Level1".
+    sulcus (bool): A flag indicating whether to include sulcus regions. Default is True.
+
+    Returns:
+    tuple: (names, matrix) where names is the list of region names of the target level and
+    matrix is a scipy.sparse.csr_matrix of shape (280, len(names)) with a 1 at
+    (Level5 region index, target region index).
+    """
+    ROI_number = ROI_NUMBER
+    ROI_name = ROI_NAME
+    if sulcus == False:
+        keep = ~ROI_number["Type1_Level2"].isin([18, 19])
+        ROI_number = ROI_number[keep]
+        ROI_name = ROI_name[keep]
+
+    # Group Level5 regions by target label, in order of first appearance
+    column = {name: i for i, name in enumerate(ROI_NUMBER["ROI"])}
+    level_dict = defaultdict(list)
+    for key, value in zip(ROI_number["ROI"], ROI_number[level]):
+        level_dict[str(value)].append(column[key])
+
+    names = list(ROI_name[level].unique()[: len(level_dict)])
+    rows, cols = [], []
+    for i, value in enumerate(level_dict.values()):
+        rows.extend(value)
+        cols.extend([i] * len(value))
+    matrix = sparse.csr_matrix((np.ones(len(rows)), (rows, cols)), shape=(len(ROI_NUMBER), len(names)))
+    return names, matrix
+
 
 def change_level(df, level="Type1_Level1", sulcus=True):
     """
     Change the level of the given DataFrame based on specified ROI levels.
 
     Parameters:
-    df (pd.DataFrame): The input DataFrame to be modified.
+    df (pd.DataFrame): The input DataFrame with one column per Type1_Level5 region.
     level (str): The level to which the DataFrame should be changed. Default is "Type1_Level1".
     sulcus (bool): A flag indicating whether to include sulcus regions. Default is True.
 
     Returns:
     pd.DataFrame: The modified DataFrame with the specified level changes applied.
     """
-    # LEVEL_DIR を基準に CSV ファイルの絶対パスを作成
-    ROI_number = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_No.csv"))
-    ROI_name = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_Name.csv"))
+    names, matrix = aggregation_matrix(level, sulcus)
+    values = df[ROI_NUMBER["ROI"]].to_numpy(dtype=np.float64)
+    return pd.DataFrame((matrix.T @ values.T).T, index=df.index, columns=names)
 
-    if sulcus == False:
-        tmp = ROI_number["Type1_Level2"]
-        ROI_number = ROI_number[tmp != 18]
-        ROI_number = ROI_number[tmp != 19]
-        ROI_name = ROI_name[tmp != 18]
-        ROI_name = ROI_name[tmp != 19]
-    data = dict(zip(ROI_number["ROI"], ROI_number[level]))
-    level_dict = defaultdict(list)
-    for key, value in data.items():
-        level_dict[str(value)].append(key)
 
-    change_df_list = []
-    for i, (key, value) in enumerate(level_dict.items()):
-        name = ROI_name[level].unique()[i]
-        change_df_list.append(df[value].sum(axis=1).rename(name))
+def compute_volumes(parcellation, basename, voxel_volume=1.0):
+    """
+    Compute the regional volumes of a parcellation at every Type1/Type2 level.
 
-    change_df = pd.concat(change_df_list, axis=1)
-    return change_df
+    The Type1_Level5 volumes are obtained with a single bincount pass over the label
+    image; all other levels are derived from them with the precomputed aggregation matrices.
 
+    Parameters:
+    parcellation (numpy.ndarray): The parcellation data array where each unique integer represents a different region.
+    basename (str): The subject name used as the row index of every table.
+    voxel_volume (float, optional): Volume of one voxel in mm³ (1.0 on the default 1 mm grid).
 
-def make_csv(parcellation, output_dir, basename):
+    Returns:
+    dict: Mapping from level name (see LEVELS) to a one-row pandas.DataFrame of volumes in mm³.
+    """
+    counts = np.bincount(parcellation.ravel(), minlength=N_REGIONS + 1)[1 : N_REGIONS + 1] * float(voxel_volume)
+    index = pd.Index([basename], name="subject")
+
+    volumes = {"Type1_Level5": pd.DataFrame(counts[None], index=index, columns=pd.Index(LEVEL5_NAMES, name="region"))}
+    for level in LEVELS[1:]:
+        names, matrix = aggregation_matrix(level)
+        volumes[level] = pd.DataFrame((matrix.T @ counts)[None], index=index, columns=names)
+    return volumes
+
+
+def make_csv(parcellation, output_dir, basename, voxel_volume=1.0):
     """
     Generates multiple CSV files containing volume data for different levels of parcellation.
 
@@ -53,62 +119,15 @@ def make_csv(parcellation, output_dir, basename):
     parcellation (numpy.ndarray): The parcellation data array where each unique integer represents a different region.
     output_dir (str): The directory where the output CSV files will be saved.
     basename (str): The base name for the output CSV files.
+    voxel_volume (float, optional): Volume of one voxel in mm³ (1.0 on the default 1 mm grid).
 
     Returns:
-    pandas.DataFrame: The DataFrame containing volume data for Type1_Level5.
+    dict: Mapping from level name to a one-row pandas.DataFrame of volumes (see compute_volumes).
     """
-    # LEVEL_DIR を基準にテキストファイルの絶対パスを作成
-    csv_path = os.path.join(LEVEL_DIR, "Type1Level5.txt")
-    df_Type1_level5 = (
-        pd.read_table(csv_path, names=["number", "region"]).astype("str").set_index("number")
-    )
-    for i in range(1, 281):
-        volume = np.count_nonzero(parcellation == i)
-        df_Type1_level5.loc[str(i), basename] = volume
-
-    df_Type1_level5 = df_Type1_level5.set_index("region").T.reset_index(drop=True)
-    df_Type1_level4 = change_level(df_Type1_level5, level="Type1_Level4")
-    df_Type1_level3 = change_level(df_Type1_level5, level="Type1_Level3")
-    df_Type1_level2 = change_level(df_Type1_level5, level="Type1_Level2")
-    df_Type1_level1 = change_level(df_Type1_level5, level="Type1_Level1")
-
-    df_Type2_level5 = change_level(df_Type1_level5, level="Type2_Level5")
-    df_Type2_level4 = change_level(df_Type1_level5, level="Type2_Level4")
-    df_Type2_level3 = change_level(df_Type1_level5, level="Type2_Level3")
-    df_Type2_level2 = change_level(df_Type1_level5, level="Type2_Level2")
-    df_Type2_level1 = change_level(df_Type1_level5, level="Type2_Level1")
+    volumes = compute_volumes(parcellation, basename, voxel_volume)
 
     os.makedirs(os.path.join(output_dir, "csv"), exist_ok=True)
-    df_Type1_level5.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type1_Level5.csv"), index=False
-    )
-    df_Type1_level4.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type1_Level4.csv"), index=False
-    )
-    df_Type1_level3.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type1_Level3.csv"), index=False
-    )
-    df_Type1_level2.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type1_Level2.csv"), index=False
-    )
-    df_Type1_level1.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type1_Level1.csv"), index=False
-    )
-
-    df_Type2_level5.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type2_Level5.csv"), index=False
-    )
-    df_Type2_level4.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type2_Level4.csv"), index=False
-    )
-    df_Type2_level3.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type2_Level3.csv"), index=False
-    )
-    df_Type2_level2.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type2_Level2.csv"), index=False
-    )
-    df_Type2_level1.to_csv(
-        os.path.join(output_dir, f"csv/{basename}_Type2_Level1.csv"), index=False
-    )
-
-    return df_Type1_level5
+    for level, df in volumes.items():
+        df.to_csv(os.path.join(output_dir, f"csv/{basename}_{level}.csv"), index=False)
+
+    return volumes
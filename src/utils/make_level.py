@@ -1,75 +1,107 @@
 import os
+from concurrent.futures import ThreadPoolExecutor
 
 import nibabel as nib
 import numpy as np
 import pandas as pd
-from nibabel import processing
+
+from utils.geometry import Geometry
+from utils.writer import write_image
 
 CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 PROJECT_ROOT = os.path.abspath(os.path.join(CURRENT_DIR, "..", ".."))
 LEVEL_DIR = os.path.join(PROJECT_ROOT, "level")
 
+# List of target levels (exclude "Type1_Level5" since it is the input label type)
+ALL_LEVEL = [
+    "Type1_Level1",
+    "Type1_Level2",
+    "Type1_Level3",
+    "Type1_Level4",
+    "Type2_Level1",
+    "Type2_Level2",
+    "Type2_Level3",
+    "Type2_Level4",
+    "Type2_Level5",
+]
+
+
+def load_level_luts():
+    """
+    Build one label lookup table per target level.
+
+    Each table maps every possible uint16 Type1_Level5 label to the label of the target level,
+    so that remapping a whole image is a single gather (``lut[label]``). Labels that do not
+    appear in ../level/Level_ROI_No.csv (including background 0) are kept unchanged.
 
-def create_parcellated_images(output, output_dir, basename, odata, data, output_ext=".nii.gz"):
+    Returns:
+      dict: Mapping from level name to a uint16 numpy.ndarray of length 65536.
+    """
+    # CSVファイルのパスを LEVEL_DIR を基準に作成
+    df_no = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_No.csv"))
+
+    luts = {}
+    for level in ALL_LEVEL:
+        lut = np.arange(np.iinfo(np.uint16).max + 1, dtype=np.uint16)
+        lut[df_no["Type1_Level5"].to_numpy()] = df_no[level].to_numpy()
+        luts[level] = lut
+    return luts
+
+
+# Level lookup tables, built once at import
+LEVEL_LUTS = load_level_luts()
+
+
+def create_parcellated_images(output, output_dir, basename, odata, data, output_ext=".nii.gz", level5=None, max_workers=None, writer=None):
     """
     Creates parcellated segmentation images for each specified level based on a mapping
-    read from CSV files. The mapping is recalculated for each level using the original image labels.
+    read from CSV files.
+
+    The Type1_Level5 image is resampled to the native geometry once (nearest neighbour),
+    and the label lookup table of every level is then applied to the resampled labels.
+    Because nearest-neighbour resampling commutes with a voxel-wise relabelling, this is
+    equivalent to remapping and resampling each level separately. The level images are
+    written concurrently.
 
     Parameters:
       output (numpy.ndarray): The image data array after calling .get_fdata() (contains Type1_Level5 labels).
       output_dir (str): The output directory path.
       basename (str): The base name for the output files.
-      affine (numpy.ndarray, optional): The affine matrix for the image. If None, np.eye(4) is used.
+      odata (nibabel.Nifti1Image): Image defining the native output geometry.
+      data (nibabel.Nifti1Image): Conformed image whose affine applies to ``output``.
+      output_ext (str, optional): Extension of the saved NIfTI files.
+      level5 (nibabel.Nifti1Image, optional): Type1_Level5 labels already resampled to the native
+        geometry. Computed from ``output`` when None.
+      max_workers (int, optional): Number of threads writing level images. Defaults to one per level.
+      writer (utils.writer.WriteSession, optional): Session queuing the saves on the writer threads,
+        used instead of a dedicated thread pool.
 
-    The CSV files are read from:
-      ../level/Level_ROI_No.csv and ../level/Level_ROI_Name.csv
-    The mapping is created from df_no where:
+    The mapping is created from ../level/Level_ROI_No.csv where:
       - Keys: values in the 'Type1_Level5' column (original labels)
       - Values: values in the column corresponding to the current level (e.g., 'Type1_Level1', etc.)
 
     The output NIfTI files are saved as:
       os.path.join(output_dir, f"parcellated/{basename}_{level}{output_ext}")
     """
+    if level5 is None:
+        # Resample the Level-5 labels (cast to uint16) to the native geometry once
+        level5 = Geometry(odata, data).to_native_image(output, np.uint16)
+    label = np.asanyarray(level5.dataobj).astype(np.uint16, copy=False)
 
-    # CSVファイルのパスを LEVEL_DIR を基準に作成
-    df_no = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_No.csv"))
-    df_name = pd.read_csv(os.path.join(LEVEL_DIR, "Level_ROI_Name.csv"))
-
-    # List of target levels (exclude "Type1_Level5" since it is the input label type)
-    all_level = [
-        "Type1_Level1",
-        "Type1_Level2",
-        "Type1_Level3",
-        "Type1_Level4",
-        "Type2_Level1",
-        "Type2_Level2",
-        "Type2_Level3",
-        "Type2_Level4",
-        "Type2_Level5",
-    ]
-
-    # Process each target level
-    for level in all_level:
-        # Create mapping: original labels (from Type1_Level5) to new labels for the current level
-        mapping = dict(zip(df_no["Type1_Level5"], df_no[level]))
-
-        # Create a copy of the original image data to avoid in-place modification
-        label = np.copy(output)
-
-        # Apply mapping to the entire image data
-        for old, new in mapping.items():
-            label[label == old] = new
-
-        # Create a NIfTI image with the new labels (casting to uint16) and save it
-        nii = nib.Nifti1Image(label.astype(np.uint16), affine=data.affine)
-        header = odata.header
-        nii = processing.conform(
-            nii,
-            out_shape=(header["dim"][1], header["dim"][2], header["dim"][3]),
-            voxel_size=(header["pixdim"][1], header["pixdim"][2], header["pixdim"][3]),
-            order=0,
-        )
-
-        # Construct the output file path and ensure the directory exists
-        os.makedirs(os.path.join(output_dir, "parcellated"), exist_ok=True)
-        nib.save(nii, os.path.join(output_dir, f"parcellated/{basename}_{level}{output_ext}"))
+    # Ensure the output directory exists
+    os.makedirs(os.path.join(output_dir, "parcellated"), exist_ok=True)
+
+    def save_level(level):
+        # Apply the level mapping to the resampled labels and save the image
+        nii = nib.Nifti1Image(LEVEL_LUTS[level][label], affine=level5.affine, header=level5.header)
+        write_image(nii, os.path.join(output_dir, f"parcellated/{basename}_{level}{output_ext}"), writer)
+
+    if writer is not None:
+        # The lookups are cheap; compression happens on the writer threads
+        for level in ALL_LEVEL:
+            save_level(level)
+        return
+
+    # Process each target level concurrently
+    with ThreadPoolExecutor(max_workers=max_workers or len(ALL_LEVEL)) as executor:
+        list(executor.map(save_level, ALL_LEVEL))
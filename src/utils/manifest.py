@@ -0,0 +1,143 @@
+import json
+import os
+import threading
+import time
+
+from utils.cache import file_digest
+from utils.workers import locked_append
+
+# File name of the batch manifest, written at the root of the output folder
+MANIFEST_NAME = "manifest.jsonl"
+
+
+class Manifest:
+    """
+    Append-only JSONL record of the subjects processed into an output folder.
+
+    Each line describes one attempt at one subject: its input path and SHA-256 digest,
+    the options that change the outputs, the final status (``done`` or ``failed``), the wall-clock time of the load, infer and
+    write stages, the SHA-256 digest of every file written to the subject folder and, for
+    failures, the error message. The last line of a subject wins, so a rerun with
+    ``--resume`` skips the subjects whose last attempt succeeded on an unchanged input
+    with the same options, and retries the others.
+    """
+
+    def __init__(self, path, options=None):
+        """
+        Args:
+            path (str): Manifest file; previous records are read if it exists.
+            options (dict, optional): JSON-serializable options of the run that change its
+                outputs. They are stored in every record and must match for a subject to be done.
+        """
+        self.path = path
+        # Normalized through JSON (tuples become lists) to compare with the stored records
+        self.options = json.loads(json.dumps(options or {}))
+        self.lock = threading.Lock()
+        self.records = {}
+        # Optional callback called with the absolute input path of every new record
+        self.on_record = None
+        if os.path.exists(path):
+            with open(path) as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        # A line cut short by a crash
+                        continue
+                    self.records[record["input"]] = record
+        else:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+
+    def completed(self, path):
+        """
+        Check whether a subject was already processed successfully from the same input and options.
+
+        Args:
+            path (str): Input NIfTI file.
+
+        Returns:
+            bool: True when the last record of ``path`` is ``done``, was produced with the options of
+            this run and its input digest still matches.
+        """
+        record = self.records.get(os.path.abspath(path))
+        if record is None or record["status"] != "done" or record.get("options") != self.options:
+            return False
+        return record["input_sha256"] == file_digest(path)
+
+    def record(self, path, status, **fields):
+        """
+        Append the outcome of one subject.
+
+        Args:
+            path (str): Input NIfTI file.
+            status (str): ``done`` or ``failed``.
+            **fields: Additional JSON-serializable fields of the record.
+        """
+        record = {"input": os.path.abspath(path), "status": status, "time": time.time(), "options": self.options, **fields}
+        line = json.dumps(record)
+        with self.lock:
+            self.records[record["input"]] = record
+            with locked_append(self.path) as f:
+                f.write(line + "\n")
+                f.flush()
+                os.fsync(f.fileno())
+        if self.on_record is not None:
+            self.on_record(record["input"])
+
+    def fail(self, path, e):
+        """Record a subject whose processing raised ``e``."""
+        self.record(path, "failed", error=str(e))
+
+    def track(self, load, infer, write):
+        """
+        Wrap the three pipeline stages so that every successful subject is recorded.
+
+        The per-subject state produced by ``load`` is a dict; the wrappers keep the input
+        digest and the stage timings in its ``manifest`` entry. The digest is also passed to
+        ``load`` as ``digest=``, so that the input is hashed once. Failures are not seen by
+        the wrappers and must be reported through :meth:`fail`.
+
+        Args:
+            load, infer, write (callable): Stages passed to ``run_pipeline``; ``infer`` may be a
+                list of callables (one per device), which are wrapped one by one.
+
+        Returns:
+            tuple: The wrapped (load, infer, write) stages.
+        """
+
+        def tracked_load(path):
+            start = time.perf_counter()
+            digest = file_digest(path)
+            case = load(path, digest=digest)
+            case["manifest"] = {"input_sha256": digest, "timings": {"load": time.perf_counter() - start}}
+            return case
+
+        def track_infer(infer):
+            def tracked_infer(case):
+                start = time.perf_counter()
+                result = infer(case)
+                case["manifest"]["timings"]["infer"] = time.perf_counter() - start
+                if result is None:
+                    # Early exit (--only-face-cropping / --only-skull-stripping): nothing left to write
+                    self.finish(case)
+                return result
+
+            return tracked_infer
+
+        def tracked_write(case):
+            start = time.perf_counter()
+            write(case)
+            case["manifest"]["timings"]["write"] = time.perf_counter() - start
+            self.finish(case)
+
+        tracked_infer = [track_infer(stage) for stage in infer] if isinstance(infer, (list, tuple)) else track_infer(infer)
+        return tracked_load, tracked_infer, tracked_write
+
+    def finish(self, case):
+        # Hash every file written to the subject folder
+        outputs = {}
+        for directory, _, files in os.walk(case["output_dir"]):
+            for name in sorted(files):
+                path = os.path.join(directory, name)
+                outputs[os.path.relpath(path, case["output_dir"])] = file_digest(path)
+        self.record(case["path"], "done", outputs=outputs, **case["manifest"])
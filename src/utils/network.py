@@ -1,7 +1,8 @@
-from typing import List
+from typing import List, Optional
 
 import torch
 import torch.nn as nn
+from torch.nn.utils.fusion import fuse_conv_bn_eval
 
 
 class ConvBlock(nn.Module):
@@ -96,3 +97,51 @@ class UNet(nn.Module):
         x = self.dconv1(x, skip1)
         x = self.dconv0(x)
         return x
+
+
+def fold_batchnorm(model):
+    """
+    Fold every BatchNorm2d of a UNet into the convolution that precedes it.
+
+    The folded convolutions compute the same function as Conv2d → BatchNorm2d in
+    evaluation mode, with one kernel launch and one intermediate tensor less.
+    The model must not be trained afterwards.
+
+    Args:
+        model (UNet): Model in evaluation mode, with its weights already loaded.
+
+    Returns:
+        UNet: The same model, modified in place.
+    """
+    model.eval()
+    for module in model.modules():
+        if isinstance(module, ConvBlock):
+            module.conv1 = fuse_conv_bn_eval(module.conv1, module.batchnorm1)
+            module.conv2 = fuse_conv_bn_eval(module.conv2, module.batchnorm2)
+            module.batchnorm1 = nn.Identity()
+            module.batchnorm2 = nn.Identity()
+    return model
+
+
+class InferenceModel(nn.Module):
+    """
+    Wrapper running a network with reduced precision and/or channels-last memory format.
+
+    The wrapped network is called under ``torch.autocast`` when a reduced precision is
+    requested, and its output is always returned as float32 so that callers are unaffected.
+    """
+
+    def __init__(self, model: nn.Module, dtype: Optional[torch.dtype] = None, channels_last: bool = False):
+        super(InferenceModel, self).__init__()
+        self.model = model
+        self.dtype = dtype
+        self.channels_last = channels_last
+        if channels_last:
+            self.model.to(memory_format=torch.channels_last)
+
+    def forward(self, x):
+        if self.channels_last:
+            x = x.contiguous(memory_format=torch.channels_last)
+        with torch.autocast(device_type=x.device.type, dtype=self.dtype, enabled=self.dtype is not None):
+            x = self.model(x)
+        return x.float()
@@ -1,8 +1,20 @@
+from typing import Optional
+
 import numpy as np
 import torch
 from tqdm import tqdm
 
 from utils.functions import normalize
+from utils.inference import brain_bounds, fuse_views, infer_slices
+
+# Constant value of the 4th input channel encoding the anatomical plane
+SECTION_VALUES = {"Axial": 1.0, "Coronal": -1.0, "Sagittal": 0.0}
+
+# Accumulator precisions available for multi-view fusion
+FUSION_DTYPES = {"float32": torch.float32, "float16": torch.float16, "uint8": torch.uint8}
+
+# Quantization step of the uint8 accumulator: three views of probabilities in [0, 85] sum to at most 255
+UINT8_FUSION_SCALE = 85
 
 
 def parcellate(
@@ -11,12 +23,13 @@ def parcellate(
     device: torch.device,
     mode: str,
     n_classes: int = 142,
+    batch_size: Optional[int] = None,
 ) -> torch.Tensor:
     """
     Perform 2.5D neural network inference for brain parcellation along a specific anatomical plane.
 
-    The function processes a 3D volume slice by slice using a 3-slice context window (previous,
-    current, next). An additional constant-valued fourth channel encodes the orientation mode
+    The function processes a 3D volume in mini-batches of slices using a 3-slice context window
+    (previous, current, next). An additional constant-valued fourth channel encodes the orientation mode
     (Axial, Coronal, or Sagittal), allowing the network to distinguish the processing plane.
 
     Args:
@@ -25,78 +38,57 @@ def parcellate(
         device (torch.device): Device for inference (CPU, CUDA, or MPS).
         mode (str): The anatomical plane used for inference. Must be one of {'Axial', 'Coronal', 'Sagittal'}.
         n_classes (int, optional): Number of output anatomical labels. Defaults to 142.
+        batch_size (int, optional): Number of slices per forward pass. Chosen from the available
+            memory when None.
 
     Returns:
         torch.Tensor: A tensor of shape (224, n_classes, 224, 224) containing softmax probabilities
         for each class at each voxel position.
     """
-    model.eval()
-    voxel = voxel.astype(np.float32)
-
-    # Set the constant value for the 4th channel to encode plane orientation
-    if mode == "Axial":
-        section_value = 1.0
-    elif mode == "Coronal":
-        section_value = -1.0
-    elif mode == "Sagittal":
-        section_value = 0.0
-    else:
+    # Look up the constant value of the 4th channel that encodes plane orientation
+    if mode not in SECTION_VALUES:
         raise ValueError("mode must be one of {'Axial','Coronal','Sagittal'}")
 
-    # Pad one slice on both ends to safely allow 3-slice context
-    voxel_pad = np.pad(
-        voxel,
-        [(1, 1), (0, 0), (0, 0)],
-        mode="constant",
-        constant_values=float(voxel.min()),
-    )
-
-    # Initialize a container for the network outputs (CPU for accumulation)
-    box = torch.empty((224, n_classes, 224, 224), dtype=torch.float32, device="cpu")
-
-    # Inference loop: iterate over slices and feed triplets to the model
-    with torch.inference_mode():
-        for i in range(1, 225):
-            prev_ = voxel_pad[i - 1]
-            curr_ = voxel_pad[i]
-            next_ = voxel_pad[i + 1]
-
-            # Build 4-channel input (3 context slices + orientation encoding)
-            four_ch = np.empty((4, 224, 224), dtype=np.float32)
-            four_ch[0] = prev_
-            four_ch[1] = curr_
-            four_ch[2] = next_
-            four_ch[3].fill(section_value)
-
-            inp = torch.from_numpy(four_ch).unsqueeze(0).to(device)
-
-            # Model inference with softmax normalization
-            logits = model(inp)
-            probs = torch.softmax(logits, dim=1)
-
-            # Store softmax output for this slice
-            box[i - 1] = probs
-
-    return box
+    # Batched inference over 4-channel inputs (3 context slices + orientation encoding)
+    return infer_slices(voxel, model, device, "softmax", n_classes, batch_size, extra_channel=SECTION_VALUES[mode])
 
 
-def parcellation(voxel, pnet, device):
+def parcellation(voxel, pnet, device, batch_size=None, fusion_dtype="float32", n_classes=142, sparse=False, shards=None):
     """
     Perform full 3D brain parcellation by aggregating predictions across multiple anatomical planes.
 
     The function normalizes the input MRI volume, generates three differently oriented representations
     (coronal, sagittal, axial), and performs 2.5D inference on each using a shared parcellation network.
-    The resulting probability maps are fused by summation and converted into a discrete segmentation map
-    via argmax over anatomical classes.
+    The softmax outputs of every view are streamed, a mini-batch at a time, into a single accumulator in
+    output orientation, which is then converted into a discrete segmentation map via argmax over
+    anatomical classes. Peak memory is therefore bounded by one class-score volume rather than by
+    several full probability volumes.
 
     Args:
         voxel (numpy.ndarray): Input 3D brain volume (float array).
         pnet (torch.nn.Module): Trained parcellation network (U-Net or similar architecture).
         device (torch.device): Device on which inference will be executed (CPU or GPU).
+        batch_size (int, optional): Number of slices per forward pass.
+        fusion_dtype (str, optional): Precision of the fusion accumulator. One of
+            {'float32', 'float16', 'uint8'}. 'float32' reproduces the exact sum of the three views,
+            'float16' halves the accumulator size and 'uint8' stores probabilities quantized to
+            1/85 steps (a quarter of the float32 size). Defaults to 'float32'.
+        n_classes (int, optional): Number of output anatomical labels. Defaults to 142.
+        sparse (bool, optional): Only run the network on the slices of each view that intersect
+            the bounding box of the brain (the non-zero voxels of ``voxel``, plus a small margin);
+            the other slices are background. Defaults to False.
+        shards (list[tuple], optional): ``(pnet, device)`` pair of every device the three views are
+            spread over (see ``utils.inference.fuse_views``). Only ``(pnet, device)`` when None.
 
     Returns:
         numpy.ndarray: Final 3D parcellation map (integer label image) with voxel-wise anatomical labels.
     """
+    if fusion_dtype not in FUSION_DTYPES:
+        raise ValueError(f"fusion_dtype must be one of {set(FUSION_DTYPES)}")
+
+    # Slice ranges of the brain along every axis (every slice when not sparse)
+    bounds = brain_bounds(voxel) if sparse else [None] * 3
+
     # Normalize input intensities for network inference
     voxel = normalize(voxel, "parcellation")
 
@@ -105,33 +97,21 @@ def parcellation(voxel, pnet, device):
     sagittal = voxel
     axial = voxel.transpose(2, 1, 0)
 
-    # ------------------------
-    # Coronal view inference
-    # ------------------------
-    out_c = parcellate(coronal, pnet, device, "Coronal").permute(1, 3, 0, 2)
-    torch.cuda.empty_cache()
+    # Single running accumulator in output orientation (classes first)
+    out_e = torch.zeros((n_classes,) + voxel.shape, dtype=FUSION_DTYPES[fusion_dtype])
+    scale = UINT8_FUSION_SCALE if fusion_dtype == "uint8" else None
 
     # ------------------------
-    # Sagittal view inference
+    # Coronal, sagittal and axial view inference, one after another or on several devices
     # ------------------------
-    out_s = parcellate(sagittal, pnet, device, "Sagittal").permute(1, 0, 2, 3)
-    torch.cuda.empty_cache()
-
-    # Fuse coronal and sagittal predictions
-    out_e = out_c + out_s
-    del out_c, out_s
-
-    # ------------------------
-    # Axial view inference
-    # ------------------------
-    out_a = parcellate(axial, pnet, device, "Axial").permute(1, 3, 2, 0)
-    torch.cuda.empty_cache()
-
-    # Combine outputs from all three anatomical orientations
-    out_e = out_e + out_a
-    del out_a
-
-    # Convert probability maps to final integer labels
+    views = [
+        ((1, 3, 0, 2), coronal, SECTION_VALUES["Coronal"], bounds[1]),
+        ((1, 0, 2, 3), sagittal, SECTION_VALUES["Sagittal"], bounds[0]),
+        ((1, 3, 2, 0), axial, SECTION_VALUES["Axial"], bounds[2]),
+    ]
+    fuse_views(out_e, views, shards or [(pnet, device)], "softmax", batch_size, scale)
+
+    # Convert fused scores to final integer labels
     parcellated = torch.argmax(out_e, 0).numpy()
 
     return parcellated
@@ -11,7 +11,36 @@ CURRENT_DIR = os.path.dirname(os.path.abspath(__file__))
 SPLIT_MAP_PATH = os.path.join(CURRENT_DIR, "split_map.pkl")
 
 
-def postprocessing(parcellated, separated, shift, device):
+def load_split_lut(path=SPLIT_MAP_PATH):
+    """
+    Build a dense (hemisphere_label, region_label) -> final_label lookup table.
+
+    The dictionary stored in ``split_map.pkl`` maps pairs of (hemisphere_label, region_label)
+    to unified segmentation indices. It is expanded once into a dense 2D table so that
+    label fusion becomes a single gather; pairs missing from the dictionary map to 0.
+
+    Args:
+        path (str, optional): Path to the pickled lookup dictionary.
+
+    Returns:
+        torch.Tensor: int16 table of shape (n_hemisphere_labels, n_region_labels).
+    """
+    with open(path, "rb") as tf:
+        dictionary = pickle.load(tf)
+
+    n_hemisphere = max(key[0] for key in dictionary) + 1
+    n_region = max(key[1] for key in dictionary) + 1
+    lut = torch.zeros((n_hemisphere, n_region), dtype=torch.int16)
+    for (hemisphere_label, region_label), value in dictionary.items():
+        lut[hemisphere_label, region_label] = int(value)
+    return lut
+
+
+# Dense label fusion table, built once at import
+SPLIT_LUT = load_split_lut()
+
+
+def postprocessing(parcellated, separated, shift, device, margin=16):
     """
     Perform post-processing to combine parcellation and hemisphere segmentation results.
 
@@ -19,10 +48,10 @@ def postprocessing(parcellated, separated, shift, device):
       - The *parcellation* network, which labels fine-grained anatomical regions.
       - The *hemisphere* network, which distinguishes left and right hemispheres.
 
-    It uses a predefined mapping (`split_map.pkl`) to merge region and hemisphere
-    labels into a unified integer-encoded segmentation map. The output is then
-    spatially restored to the original coordinate system using the recorded shift
-    and padding offsets.
+    It uses a predefined mapping (`split_map.pkl`, expanded into the dense lookup
+    table `SPLIT_LUT`) to merge region and hemisphere labels into a unified
+    integer-encoded segmentation map. The output is then spatially restored to the
+    original coordinate system using the recorded shift and padding offsets.
 
     Args:
         parcellated (numpy.ndarray): 3D integer array from the parcellation network,
@@ -33,61 +62,41 @@ def postprocessing(parcellated, separated, shift, device):
         shift (tuple[int, int, int]): Offsets (xd, yd, zd) used during cropping to
             center the brain; used here to roll the output back to its original location.
         device (torch.device): Device (CPU, CUDA, or MPS) for tensor-based computation.
+        margin (int, optional): Margin removed on each side by the cropping step
+            (16 voxels on the 256³ grid, see ``utils.cropping.crop_layout``).
 
     Returns:
         numpy.ndarray: The final 3D integer segmentation map where each voxel’s value
         encodes both hemisphere and regional identity, aligned to the original space.
     """
     # -----------------------------------------------------------
-    # Step 1: Load the hemisphere–region label correspondence map
-    # -----------------------------------------------------------
-    # The dictionary in split_map.pkl maps pairs of (hemisphere_label, region_label)
-    # to unified segmentation indices.
-    with open(SPLIT_MAP_PATH, "rb") as tf:
-        dictionary = pickle.load(tf)
-
-    # -----------------------------------------------------------
-    # Step 2: Convert input arrays to PyTorch tensors for efficient computation
+    # Step 1: Move the label maps and the fusion table to the target device
     # -----------------------------------------------------------
-    pmap = torch.tensor(parcellated.astype("int16"), requires_grad=False).to(device)
-    hmap = torch.tensor(separated.astype("int16"), requires_grad=False).to(device)
-
-    # Combine flattened hemisphere and parcellation labels into a two-column tensor
-    # Each row represents (hemisphere_label, region_label)
-    combined = torch.stack((torch.flatten(hmap), torch.flatten(pmap)), axis=-1)
-
-    # Initialize an empty flattened output tensor
-    output = torch.zeros_like(hmap).ravel()
+    pmap = torch.as_tensor(parcellated, device=device).long()
+    hmap = torch.as_tensor(separated, device=device).long()
+    lut = SPLIT_LUT.to(device)
 
     # -----------------------------------------------------------
-    # Step 3: Map combined (hemisphere, region) label pairs to final class IDs
+    # Step 2: Map (hemisphere, region) label pairs to final class IDs
     # -----------------------------------------------------------
-    # For each entry in the lookup dictionary:
-    #   - 'key' represents a pair (hemisphere_label, region_label)
-    #   - 'value' is the corresponding unified label in the final segmentation
-    for key, value in dictionary.items():
-        key = torch.tensor(key, requires_grad=False).to(device)
-        mask = torch.all(combined == key, axis=1)
-        output[mask] = value
-
-    # Reshape flattened output back to 3D volume
-    output = output.reshape(hmap.shape)
+    # A single gather in the dense lookup table built from split_map.pkl
+    output = lut[hmap, pmap]
 
     # Move tensor to CPU and convert back to NumPy array
     output = output.cpu().detach().numpy()
 
     # -----------------------------------------------------------
-    # Step 4: Mask irrelevant voxels to clean up final segmentation
+    # Step 3: Mask irrelevant voxels to clean up final segmentation
     # -----------------------------------------------------------
     # Retain only voxels belonging to hemispheres or specific parcellation indices (87, 138),
     # which likely correspond to midline or reference structures.
     output = output * (np.logical_or(np.logical_or(separated > 0, parcellated == 87), parcellated == 138))
 
     # -----------------------------------------------------------
-    # Step 5: Restore original spatial position
+    # Step 4: Restore original spatial position
     # -----------------------------------------------------------
     # Undo the cropping offsets by applying padding and rolling back shifts.
-    output = np.pad(output, [(16, 16), (16, 16), (16, 16)], "constant", constant_values=0)
+    output = np.pad(output, [(margin, margin)] * 3, "constant", constant_values=0)
     output = np.roll(output, (-shift[0], -shift[1], -shift[2]), axis=(0, 1, 2))
 
     # Return the final postprocessed segmentation map
@@ -1,53 +1,197 @@
 import os
 
 import nibabel as nib
+import numpy as np
 import SimpleITK as sitk
 from nibabel import processing
 from nibabel.orientations import aff2axcodes, axcodes2ornt, ornt_transform
 
+# N4 settings presets. "default" reproduces the SimpleITK defaults used so far; "fast" fits
+# the bias field on a coarser grid with fewer fitting levels and iterations.
+N4_PRESETS = {
+    "default": {"shrink_factor": 4, "iterations": [50, 50, 50, 50], "convergence_threshold": 0.001},
+    "fast": {"shrink_factor": 6, "iterations": [25, 25, 25], "convergence_threshold": 0.001},
+}
 
-def N4_Bias_Field_Correction(input_path, output_path):
+
+def n4_options(preset="default", shrink_factor=None, iterations=None, convergence_threshold=None, threads=None):
+    """
+    Resolve the N4 settings from a preset and explicit overrides.
+
+    Args:
+        preset (str): Name of a preset in N4_PRESETS.
+        shrink_factor (int, optional): Overrides the preset shrink factor.
+        iterations (list[int], optional): Overrides the preset iteration schedule
+            (one entry per fitting level).
+        convergence_threshold (float, optional): Overrides the preset convergence threshold.
+        threads (int, optional): Number of threads used by N4 (SimpleITK default when None).
+
+    Returns:
+        dict: Keyword arguments for N4_Bias_Field_Correction.
+    """
+    if preset not in N4_PRESETS:
+        raise ValueError(f"preset must be one of {set(N4_PRESETS)}")
+    options = dict(N4_PRESETS[preset], threads=threads)
+    if shrink_factor is not None:
+        options["shrink_factor"] = shrink_factor
+    if iterations is not None:
+        options["iterations"] = list(iterations)
+    if convergence_threshold is not None:
+        options["convergence_threshold"] = convergence_threshold
+    return options
+
+
+def sitk_to_nibabel(image):
+    """
+    Convert a 3D SimpleITK image to a nibabel NIfTI image without going through disk.
+
+    SimpleITK stores voxels in (z, y, x) order with an LPS world frame, while nibabel
+    uses (x, y, z) order and RAS. The affine is rounded to float32 like the sform stored
+    in a NIfTI header, so that the result matches writing and reading the image back.
+
+    Args:
+        image (SimpleITK.Image): Input image.
+
+    Returns:
+        nibabel.Nifti1Image: Equivalent NIfTI image.
     """
-    Perform N4 Bias Field Correction on an input image and save the corrected image to the specified output path.
+    data = sitk.GetArrayFromImage(image).transpose(2, 1, 0)
+    spacing = np.asarray(image.GetSpacing(), dtype=np.float64)
+    direction = np.asarray(image.GetDirection(), dtype=np.float64).reshape(3, 3)
+
+    affine = np.eye(4)
+    affine[:3, :3] = direction * spacing
+    affine[:3, 3] = image.GetOrigin()
+    affine = np.diag([-1.0, -1.0, 1.0, 1.0]) @ affine
+    affine = affine.astype(np.float32).astype(np.float64)
+    return nib.Nifti1Image(data, affine)
+
+
+def N4_Bias_Field_Correction(input_path, output_path=None, shrink_factor=4, iterations=None, convergence_threshold=None, threads=None):
+    """
+    Perform N4 Bias Field Correction on an input image, optionally saving the corrected image.
 
     Args:
-        input_path (str): Path to the input image file.
-        output_path (str): Path to save the corrected image file.
+        input_path (str or SimpleITK.Image): Path to the input image file, or the already decoded float32 image.
+        output_path (str, optional): Path to save the corrected image file. Nothing is written when None.
+        shrink_factor (int): Downsampling factor of the image used to fit the bias field. Defaults to 4.
+        iterations (list[int], optional): Maximum number of iterations per fitting level
+            (SimpleITK default [50, 50, 50, 50] when None).
+        convergence_threshold (float, optional): Convergence threshold (SimpleITK default 0.001 when None).
+        threads (int, optional): Number of threads used by the filter (SimpleITK default when None).
 
     Returns:
-        None
+        SimpleITK.Image: The bias-corrected image at full resolution.
     """
-    raw_img_sitk = sitk.ReadImage(input_path, sitk.sitkFloat32)
+    raw_img_sitk = input_path if isinstance(input_path, sitk.Image) else sitk.ReadImage(input_path, sitk.sitkFloat32)
     transformed = sitk.RescaleIntensity(raw_img_sitk, 0, 255)
     transformed = sitk.LiThreshold(transformed, 0, 1)
     head_mask = transformed
-    shrinkFactor = 4
+    shrinkFactor = shrink_factor
     inputImage = sitk.Shrink(raw_img_sitk, [shrinkFactor] * raw_img_sitk.GetDimension())
     maskImage = sitk.Shrink(head_mask, [shrinkFactor] * raw_img_sitk.GetDimension())
     bias_corrector = sitk.N4BiasFieldCorrectionImageFilter()
+    if iterations is not None:
+        bias_corrector.SetMaximumNumberOfIterations([int(i) for i in iterations])
+    if convergence_threshold is not None:
+        bias_corrector.SetConvergenceThreshold(convergence_threshold)
+    if threads is not None:
+        bias_corrector.SetNumberOfThreads(threads)
     corrected = bias_corrector.Execute(inputImage, maskImage)
     log_bias_field = bias_corrector.GetLogBiasFieldAsImage(raw_img_sitk)
     corrected_image_full_resolution = raw_img_sitk / sitk.Exp(log_bias_field)
-    sitk.WriteImage(corrected_image_full_resolution, output_path)
-    return
+    if output_path is not None:
+        sitk.WriteImage(corrected_image_full_resolution, output_path)
+    return corrected_image_full_resolution
+
+
+def grid_shape(resolution=1.0):
+    """
+    Return the shape of the conformed grid for a voxel size.
+
+    The grid always covers a 256 mm field of view: 256³ voxels at 1 mm, more at finer resolutions.
+
+    Args:
+        resolution (float, optional): Isotropic voxel size in millimetres. Defaults to 1.0.
+
+    Returns:
+        tuple[int, int, int]: Grid shape.
+    """
+    size = int(round(256 / resolution))
+    return (size, size, size)
 
 
-def preprocessing(ipath, output_dir, basename, output_ext=".nii.gz"):
+def conform_image(odata, resolution=1.0):
+    """
+    Resample an image onto the isotropic grid used by the networks (256³ with 1 mm voxels by default).
+
+    Args:
+        odata (nibabel.Nifti1Image): N4-corrected image in canonical orientation.
+        resolution (float, optional): Voxel size in millimetres of the grid. Defaults to 1.0.
+
+    Returns:
+        nibabel.Nifti1Image: The conformed image.
+    """
+    return processing.conform(odata, out_shape=grid_shape(resolution), voxel_size=(resolution,) * 3, order=1)
+
+
+def preprocessing(ipath, output_dir, basename, output_ext=".nii.gz", n4=None, resolution=1.0, writer=None, save=True, volume=None):
     """
     Preprocesses a medical image by performing N4 bias field correction and conforming the image to a specified shape and voxel size.
 
+    The corrected image is saved to ``original/{basename}_N4`` for reference and converted to
+    nibabel in memory, without reading it back from disk.
+
     Args:
         ipath (str): The input file path of the medical image to be processed.
         output_dir (str): The directory where the processed image will be saved.
         basename (str): The base name for the output file.
+        output_ext (str): Extension of the saved NIfTI file.
+        n4 (dict, optional): N4 settings (see n4_options). The "default" preset when None.
+        resolution (float, optional): Voxel size in millimetres of the conformed grid. Defaults to 1.0.
+        writer (utils.writer.WriteSession, optional): Session queuing the save of the corrected
+            image on the writer threads. SimpleITK writes it synchronously when None.
+        save (bool, optional): Save the corrected image. Defaults to True.
+        volume (utils.volume.InputVolume, optional): Input already decoded by the caller. N4 runs
+            on it instead of reading ``ipath`` again.
 
     Returns:
         tuple: A tuple containing:
             - odata (nibabel.Nifti1Image): The N4 bias field corrected image.
             - data (nibabel.Nifti1Image): The conformed image with specified shape and voxel size.
     """
+    nii = correct_bias(ipath, output_dir, basename, output_ext, n4, writer, save, volume)
+    return conform_corrected(nii, resolution)
+
+
+def correct_bias(ipath, output_dir, basename, output_ext=".nii.gz", n4=None, writer=None, save=True, volume=None):
+    """
+    Run N4 bias field correction and save the corrected image to ``original/{basename}_N4``.
+
+    See :func:`preprocessing` for the arguments.
+
+    Returns:
+        nibabel.Nifti1Image: The corrected image, in the orientation of the input file.
+    """
     opath = os.path.join(output_dir, f"original/{basename}_N4{output_ext}")
-    N4_Bias_Field_Correction(ipath, opath)
-    odata = nib.squeeze_image(nib.as_closest_canonical(nib.load(opath)))
-    data = processing.conform(odata, out_shape=(256, 256, 256), voxel_size=(1.0, 1.0, 1.0), order=1)
-    return odata, data
+    source = ipath if volume is None else volume.to_sitk()
+    corrected = N4_Bias_Field_Correction(source, opath if save and writer is None else None, **(n4 or n4_options()))
+    nii = sitk_to_nibabel(corrected)
+    if save and writer is not None:
+        writer.save(nii, opath)
+    return nii
+
+
+def conform_corrected(nii, resolution=1.0):
+    """
+    Reorient an N4-corrected image to canonical (RAS+) and conform it for the networks.
+
+    Args:
+        nii (nibabel.Nifti1Image): Corrected image returned by :func:`correct_bias`.
+        resolution (float, optional): Voxel size in millimetres of the conformed grid. Defaults to 1.0.
+
+    Returns:
+        tuple: (odata, data) as returned by :func:`preprocessing`.
+    """
+    odata = nib.squeeze_image(nib.as_closest_canonical(nii))
+    return odata, conform_image(odata, resolution)
@@ -0,0 +1,271 @@
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+
+import torch
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Stage record of the calling thread, to which network views are attributed
+_local = threading.local()
+
+
+def peak_rss():
+    """
+    Return the peak resident set size of the process.
+
+    Returns:
+        int or None: Peak RSS in bytes, or None where it cannot be queried.
+    """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is reported in bytes on macOS and in kilobytes elsewhere
+    return peak if sys.platform == "darwin" else peak * 1024
+
+
+def current_rss():
+    """
+    Return the current resident set size of the process.
+
+    Returns:
+        int or None: RSS in bytes, or None where it cannot be queried (it is read from /proc).
+    """
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def growth(start, end):
+    # Difference of two optional measurements
+    return None if start is None or end is None else end - start
+
+
+def record_view(slices, seconds):
+    """
+    Attribute one network view (a pass over all slices of a volume) to the current stage.
+
+    Does nothing when the calling thread is not inside :meth:`Profile.stage`.
+
+    Args:
+        slices (int): Number of slices processed.
+        seconds (float): Wall time of the view.
+    """
+    record = getattr(_local, "stage", None)
+    if record is not None:
+        record["views"].append({"slices": slices, "wall_seconds": seconds, "slices_per_second": slices / seconds if seconds else None})
+
+
+def current_stage():
+    """
+    Return the stage record of the calling thread, to hand it to worker threads (see :func:`attach_stage`).
+
+    Returns:
+        dict or None: The record, or None outside of :meth:`Profile.stage`.
+    """
+    return getattr(_local, "stage", None)
+
+
+@contextmanager
+def attach_stage(record):
+    """
+    Attribute the network views run on the calling thread to a stage opened on another thread.
+
+    Args:
+        record (dict or None): Stage record returned by :func:`current_stage`.
+    """
+    previous = getattr(_local, "stage", None)
+    _local.stage = record
+    try:
+        yield
+    finally:
+        _local.stage = previous
+
+
+class Profile:
+    """
+    Per-stage wall time, CPU time and peak memory of one subject.
+
+    Memory is measured as two differences over each stage, since the peak RSS reported by the
+    system is the high-water mark of the whole process lifetime: ``rss_growth_bytes``, the change
+    of the resident set size (memory the stage kept, negative when it released some), and
+    ``peak_rss_growth_bytes``, how much the stage raised the process peak (0 unless it set a new
+    one). CPU time and memory are process-wide: when subjects overlap in the pipeline
+    (``--workers`` > 1 or ``--io-workers`` > 0) they include the work of the concurrent stages.
+    The peak CUDA memory is only measured for stages given their device, i.e. those of the
+    inference thread that owns it, since resetting the peak statistics from the loader or
+    writer threads would disturb the measurement of the running network stage.
+    """
+
+    def __init__(self, name):
+        """
+        Args:
+            name (str): Subject name (the input base name).
+        """
+        self.name = name
+        self.stages = []
+        self.lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, device=None):
+        """
+        Measure the enclosed block as one stage of the subject.
+
+        Args:
+            name (str): Stage name.
+            device (torch.device, optional): Inference device of the stage. For CUDA devices,
+                the peak memory allocated on it during the stage is recorded.
+
+        Yields:
+            dict: The stage record, completed when the block exits.
+        """
+        record = {"name": name, "thread": threading.current_thread().name, "start": time.time(), "views": []}
+        previous = getattr(_local, "stage", None)
+        _local.stage = record
+        wall, cpu = time.perf_counter(), time.process_time()
+        rss, peak = current_rss(), peak_rss()
+        cuda = device is not None and device.type == "cuda"
+        if cuda:
+            torch.cuda.reset_peak_memory_stats(device)
+        try:
+            yield record
+        finally:
+            record["wall_seconds"] = time.perf_counter() - wall
+            record["cpu_seconds"] = time.process_time() - cpu
+            record["rss_growth_bytes"] = growth(rss, current_rss())
+            record["peak_rss_growth_bytes"] = growth(peak, peak_rss())
+            if cuda:
+                record["peak_cuda_bytes"] = torch.cuda.max_memory_allocated(device)
+            _local.stage = previous
+            with self.lock:
+                self.stages.append(record)
+
+    def to_dict(self):
+        with self.lock:
+            return {"subject": self.name, "wall_seconds": sum(stage["wall_seconds"] for stage in self.stages), "stages": list(self.stages)}
+
+
+class Profiler:
+    """
+    Collect the profiles of the subjects of a run and export them.
+
+    Each finished subject can be written to its own JSON file; the whole run can also be
+    exported as a Prometheus text file (per-stage totals) and as a Chrome trace
+    (``chrome://tracing`` or Perfetto), where every stage is a slice on the thread that ran it.
+    """
+
+    def __init__(self, subject_json=False, metrics_path=None, trace_path=None):
+        """
+        Args:
+            subject_json (bool, optional): Write ``profile/{basename}_profile.json`` in each subject folder.
+            metrics_path (str, optional): Prometheus text file written by :meth:`close`.
+            trace_path (str, optional): Chrome trace JSON file written by :meth:`close`.
+        """
+        self.subject_json = subject_json
+        self.metrics_path = metrics_path
+        self.trace_path = trace_path
+        self.profiles = []
+        self.lock = threading.Lock()
+
+    def finish(self, profile, output_dir):
+        """
+        Record a finished subject and write its JSON profile if requested.
+
+        Args:
+            profile (Profile): Profile of the subject.
+            output_dir (str): Output folder of the subject.
+        """
+        if self.subject_json:
+            os.makedirs(os.path.join(output_dir, "profile"), exist_ok=True)
+            with open(os.path.join(output_dir, f"profile/{profile.name}_profile.json"), "w") as f:
+                json.dump(profile.to_dict(), f, indent=2)
+        if self.metrics_path or self.trace_path:
+            with self.lock:
+                self.profiles.append(profile)
+
+    def close(self):
+        """Write the run-level metrics and trace files."""
+        with self.lock:
+            profiles = [profile.to_dict() for profile in self.profiles]
+        if self.metrics_path:
+            write_metrics(profiles, self.metrics_path)
+        if self.trace_path:
+            write_trace(profiles, self.trace_path)
+
+
+def write_metrics(profiles, path):
+    """
+    Write per-stage totals in the Prometheus text exposition format.
+
+    Args:
+        profiles (list[dict]): Subject profiles (see :meth:`Profile.to_dict`).
+        path (str): Destination file.
+    """
+    wall, cpu, count, slices, view_seconds = {}, {}, {}, {}, {}
+    for profile in profiles:
+        for stage in profile["stages"]:
+            name = stage["name"]
+            wall[name] = wall.get(name, 0.0) + stage["wall_seconds"]
+            cpu[name] = cpu.get(name, 0.0) + stage["cpu_seconds"]
+            count[name] = count.get(name, 0) + 1
+            for view in stage["views"]:
+                slices[name] = slices.get(name, 0) + view["slices"]
+                view_seconds[name] = view_seconds.get(name, 0.0) + view["wall_seconds"]
+
+    lines = []
+    metrics = [
+        ("openmap_stage_wall_seconds_total", "counter", "Wall time spent in each stage.", wall),
+        ("openmap_stage_cpu_seconds_total", "counter", "Process CPU time spent in each stage.", cpu),
+        ("openmap_stage_runs_total", "counter", "Number of times each stage ran.", count),
+        ("openmap_stage_slices_total", "counter", "Number of slices pushed through the networks in each stage.", slices),
+        ("openmap_stage_inference_seconds_total", "counter", "Wall time of the network views of each stage.", view_seconds),
+    ]
+    for metric, kind, help_text, values in metrics:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} {kind}"]
+        lines += [f'{metric}{{stage="{name}"}} {value}' for name, value in sorted(values.items())]
+    lines += ["# HELP openmap_subjects_total Number of profiled subjects.", "# TYPE openmap_subjects_total counter", f"openmap_subjects_total {len(profiles)}"]
+    lines += ["# HELP openmap_peak_rss_bytes Peak resident set size of the process.", "# TYPE openmap_peak_rss_bytes gauge", f"openmap_peak_rss_bytes {peak_rss() or 0}"]
+
+    with open(path, "w") as f:
+        f.write("\n".join(lines) + "\n")
+
+
+def write_trace(profiles, path):
+    """
+    Write the stages of every subject as a Chrome trace (JSON array format).
+
+    Threads are numbered in order of appearance and named by ``thread_name`` metadata events.
+
+    Args:
+        profiles (list[dict]): Subject profiles (see :meth:`Profile.to_dict`).
+        path (str): Destination file.
+    """
+    events, tids = [], {}
+    for profile in profiles:
+        for stage in profile["stages"]:
+            if stage["thread"] not in tids:
+                tids[stage["thread"]] = len(tids) + 1
+                events.append({"name": "thread_name", "ph": "M", "pid": os.getpid(), "tid": tids[stage["thread"]], "args": {"name": stage["thread"]}})
+            args = {key: stage[key] for key in ("cpu_seconds", "rss_growth_bytes", "peak_rss_growth_bytes", "views")}
+            events.append(
+                {
+                    "name": stage["name"],
+                    "cat": profile["subject"],
+                    "ph": "X",
+                    "ts": stage["start"] * 1e6,
+                    "dur": stage["wall_seconds"] * 1e6,
+                    "pid": os.getpid(),
+                    "tid": tids[stage["thread"]],
+                    "args": args,
+                }
+            )
+    with open(path, "w") as f:
+        json.dump(events, f)
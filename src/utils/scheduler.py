@@ -0,0 +1,135 @@
+import queue
+import threading
+
+# Marker placed on a queue by a producer thread once it has no more items
+_DONE = object()
+
+# Marker telling the other inference threads that every loader has finished
+_STOP = object()
+
+
+def run_pipeline(items, load, infer, write, workers=1, io_workers=1, on_error=None, progress=None):
+    """
+    Process a sequence of items through a three-stage load → infer → write pipeline.
+
+    Loading runs on ``workers`` background threads, inference runs on the calling
+    thread (so that a single device is driven by a single thread), or on one thread per
+    callable when ``infer`` is a list (one per device of a pool), and writing runs
+    on ``io_workers`` background threads. Stages are connected by bounded queues, so
+    that at most ``workers`` loaded items wait for inference and at most
+    ``io_workers`` inferred items wait to be written, which caps memory usage while
+    loading of item k+1, inference of item k and writing of item k-1 overlap.
+
+    Errors are isolated per item: an exception in any stage drops that item, is
+    reported through ``on_error`` and the pipeline continues with the next item.
+
+    Args:
+        items (list): Items to process (e.g., input file paths).
+        load (callable): ``load(item) -> state``; run on the loader threads.
+        infer (callable or list[callable]): ``infer(state) -> state or None``; run on the
+            calling thread. Returning None ends processing of the item without writing.
+            With a list, every callable runs on its own thread and takes the next loaded item.
+        write (callable): ``write(state) -> None``; run on the writer threads, or on the
+            calling thread when ``io_workers`` is 0.
+        workers (int, optional): Number of loader threads. Defaults to 1.
+        io_workers (int, optional): Number of writer threads. Defaults to 1.
+        on_error (callable, optional): ``on_error(item, exception)`` called on failure.
+        progress (tqdm.tqdm, optional): Progress bar advanced once per finished item.
+    """
+    workers = max(1, workers)
+    infers = list(infer) if isinstance(infer, (list, tuple)) else [infer]
+    items_queue = queue.Queue()
+    for item in items:
+        items_queue.put(item)
+
+    loaded = queue.Queue(maxsize=max(workers, len(infers)))
+    inferred = queue.Queue(maxsize=max(1, io_workers))
+
+    def finish(item, error=None):
+        if error is not None and on_error is not None:
+            on_error(item, error)
+        if progress is not None:
+            progress.update(1)
+
+    def load_worker():
+        while True:
+            try:
+                item = items_queue.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                loaded.put((item, load(item)))
+            except Exception as e:
+                finish(item, e)
+        loaded.put(_DONE)
+
+    def write_worker():
+        while True:
+            entry = inferred.get()
+            if entry is _DONE:
+                break
+            item, state = entry
+            try:
+                write(state)
+                finish(item)
+            except Exception as e:
+                finish(item, e)
+
+    loaders = [threading.Thread(target=load_worker, daemon=True) for _ in range(workers)]
+    writers = [threading.Thread(target=write_worker, daemon=True) for _ in range(io_workers)]
+    for thread in loaders + writers:
+        thread.start()
+
+    # Inference stage: consume loaded items until every loader has finished
+    remaining = [workers]
+    remaining_lock = threading.Lock()
+
+    def infer_worker(infer):
+        while True:
+            entry = loaded.get()
+            if entry is _STOP:
+                break
+            if entry is _DONE:
+                with remaining_lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    # Wake up the other inference threads
+                    for _ in range(len(infers) - 1):
+                        loaded.put(_STOP)
+                    break
+                continue
+
+            item, state = entry
+            try:
+                state = infer(state)
+            except Exception as e:
+                finish(item, e)
+                continue
+            del entry
+
+            if state is None:
+                finish(item)
+            elif writers:
+                inferred.put((item, state))
+            else:
+                try:
+                    write(state)
+                    finish(item)
+                except Exception as e:
+                    finish(item, e)
+            del state
+
+    if len(infers) == 1:
+        infer_worker(infers[0])
+    else:
+        inferers = [threading.Thread(target=infer_worker, args=(infer,), daemon=True) for infer in infers]
+        for thread in inferers:
+            thread.start()
+        for thread in inferers:
+            thread.join()
+
+    for _ in writers:
+        inferred.put(_DONE)
+    for thread in loaders + writers:
+        thread.join()
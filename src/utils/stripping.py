@@ -1,48 +1,66 @@
 import numpy as np
-import torch
 from scipy import ndimage
 
 from utils.functions import normalize, reimburse_conform
+from utils.inference import infer_slices
 
 
-def strip(voxel, model, device):
+def strip(voxel, model, device, batch_size=None):
     """
     Perform slice-wise inference using the brain stripping model.
 
-    This function processes the input 3D volume slice by slice (along the first axis),
-    using a three-slice context window for each prediction. The output is a 3D mask
-    representing the brain region.
+    This function processes the input 3D volume in mini-batches of slices (along the
+    first axis), using a three-slice context window for each prediction. The output is
+    a 3D mask representing the brain region.
 
     Args:
-        voxel (numpy.ndarray): Input voxel data of shape (N, 224, 224), typically
-            a single anatomical orientation (e.g., coronal or sagittal view).
+        voxel (numpy.ndarray): Input voxel data of shape (N, 224, 224) (larger on grids
+            finer than 1 mm), typically a single anatomical orientation (e.g., coronal or sagittal view).
         model (torch.nn.Module): The trained PyTorch brain stripping model.
         device (torch.device): Device used for inference (CPU, CUDA, or MPS).
+        batch_size (int, optional): Number of slices per forward pass. Chosen from the
+            available memory when None.
 
     Returns:
-        torch.Tensor: A tensor of shape (224, 224, 224) representing the predicted
+        torch.Tensor: A tensor with the shape of ``voxel`` representing the predicted
         binary brain mask.
     """
-    model.eval()
+    box = infer_slices(voxel, model, device, "sigmoid", 1, batch_size)
+    return box.reshape(voxel.shape)
 
-    # Pad one slice on both ends to ensure valid 3-slice context at the boundaries
-    voxel = np.pad(voxel, [(1, 1), (0, 0), (0, 0)], "constant", constant_values=voxel.min())
 
-    with torch.inference_mode():
-        box = torch.zeros(224, 224, 224)
+def predict_brain_mask(voxel, ssnet, device, batch_size=None):
+    """
+    Predict the brain mask of a cropped volume.
+
+    Args:
+        voxel (numpy.ndarray): Cropped 3D voxel data of shape (224, 224, 224), or larger on grids finer than 1 mm.
+        ssnet (torch.nn.Module): Trained brain stripping network.
+        device (torch.device): Device used for inference (CPU, CUDA, or MPS).
+        batch_size (int, optional): Number of slices per forward pass.
 
-        # Perform model inference for each slice using a 3-slice context
-        for i in range(1, 225):
-            image = np.stack([voxel[i - 1], voxel[i], voxel[i + 1]])
-            image = torch.tensor(image.reshape(1, 3, 224, 224)).to(device)
-            x_out = torch.sigmoid(model(image)).detach().cpu()
-            box[i - 1] = x_out
+    Returns:
+        numpy.ndarray: Boolean mask with the shape of ``voxel``.
+    """
+    # Normalize the voxel intensities for model input
+    voxel = normalize(voxel, "stripping")
 
-        # Return as a 3D mask tensor
-        return box.reshape(224, 224, 224)
+    # Prepare data in three anatomical orientations
+    coronal = voxel.transpose(1, 2, 0)
+    sagittal = voxel
+    axial = voxel.transpose(2, 1, 0)
 
+    # Apply the model along each anatomical plane
+    out_c = strip(coronal, ssnet, device, batch_size).permute(2, 0, 1)  # coronal → native orientation
+    out_s = strip(sagittal, ssnet, device, batch_size)  # sagittal
+    out_a = strip(axial, ssnet, device, batch_size).permute(2, 1, 0)  # axial → native orientation
 
-def stripping(output_dir, basename, voxel, odata, data, ssnet, shift, device, output_ext=".nii.gz"):
+    # Fuse predictions by averaging across the three planes and apply threshold
+    out_e = ((out_c + out_s + out_a) / 3) > 0.5
+    return out_e.cpu().numpy()
+
+
+def stripping(output_dir, basename, voxel, odata, data, ssnet, shift, device, output_ext=".nii.gz", batch_size=None, geometry=None, mask=None, writer=None, save=True):
     """
     Perform full 3D brain stripping using a deep learning model.
 
@@ -61,39 +79,31 @@ def stripping(output_dir, basename, voxel, odata, data, ssnet, shift, device, ou
         ssnet (torch.nn.Module): Trained brain stripping network.
         shift (tuple[int, int, int]): The (x, y, z) offsets applied previously during cropping.
         device (torch.device): Device used for inference (CPU, CUDA, or MPS).
+        output_ext (str): Extension of the saved NIfTI files.
+        batch_size (int, optional): Number of slices per forward pass.
+        geometry (utils.geometry.Geometry, optional): Precomputed mapping to the native grid.
+        mask (numpy.ndarray, optional): Previously predicted brain mask (see predict_brain_mask),
+            e.g. read from the stage cache. The network is not run when given.
+        writer (utils.writer.WriteSession, optional): Session queuing the saves on the writer threads.
+        save (bool, optional): Save the brain mask and the stripped image. Defaults to True.
 
     Returns:
         numpy.ndarray: The skull-stripped 3D brain volume.
     """
-    # Preserve original intensity data for later restoration
-    original = voxel.copy()
-
-    # Normalize the voxel intensities for model input
-    voxel = normalize(voxel, "stripping")
-
-    # Prepare data in three anatomical orientations
-    coronal = voxel.transpose(1, 2, 0)
-    sagittal = voxel
-    axial = voxel.transpose(2, 1, 0)
-
-    # Apply the model along each anatomical plane
-    out_c = strip(coronal, ssnet, device).permute(2, 0, 1)  # coronal → native orientation
-    out_s = strip(sagittal, ssnet, device)  # sagittal
-    out_a = strip(axial, ssnet, device).permute(2, 1, 0)  # axial → native orientation
-
-    # Fuse predictions by averaging across the three planes and apply threshold
-    out_e = ((out_c + out_s + out_a) / 3) > 0.5
-    out_e = out_e.cpu().numpy()
+    # Predict the brain mask unless it is already known
+    out_e = predict_brain_mask(voxel, ssnet, device, batch_size) if mask is None else mask
 
     # Apply the binary mask to extract the brain region
-    stripped = original * out_e
+    stripped = voxel * out_e
 
-    # Restore the mask to the original conformed geometry
-    # Pad to original full size and reverse the previously applied shift
-    out_e = np.pad(out_e, [(16, 16), (16, 16), (16, 16)], "constant", constant_values=0)
-    out_e = np.roll(out_e, (-shift[0], -shift[1], -shift[2]), axis=(0, 1, 2))
+    if save:
+        # Restore the mask to the original conformed geometry
+        # Pad to original full size and reverse the previously applied shift
+        margin = (data.shape[0] - out_e.shape[0]) // 2
+        out_e = np.pad(out_e, [(margin, margin)] * 3, "constant", constant_values=0)
+        out_e = np.roll(out_e, (-shift[0], -shift[1], -shift[2]), axis=(0, 1, 2))
 
-    # Save the binary brain mask in conformed space for reference
-    reimburse_conform(output_dir, basename, "stripped", odata, data, out_e, output_ext)
+        # Save the binary brain mask in conformed space for reference
+        reimburse_conform(output_dir, basename, "stripped", odata, data, out_e, output_ext, geometry, writer)
 
     return stripped
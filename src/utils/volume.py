@@ -0,0 +1,114 @@
+from functools import cached_property
+
+import nibabel as nib
+import numpy as np
+import SimpleITK as sitk
+
+
+def float32_data(image):
+    """
+    Return the voxels of an image as float32 without copying in-memory float32 data.
+
+    Unlike ``get_fdata()``, which builds a float64 array, images already held in memory
+    as float32 (the decoded input, the N4-corrected and conformed images) are returned
+    as is. The result may be shared with the image and must not be modified in place.
+
+    Args:
+        image (nibabel.Nifti1Image): Input image.
+
+    Returns:
+        numpy.ndarray: float32 voxel array.
+    """
+    return np.asarray(image.dataobj, dtype=np.float32)
+
+
+def nibabel_to_sitk(image):
+    """
+    Convert a 3D nibabel image to a SimpleITK image without going through disk.
+
+    This is the inverse of ``utils.preprocessing.sitk_to_nibabel``: voxels are reordered to
+    (z, y, x) and the RAS affine is split into the LPS origin, spacing and direction.
+
+    Args:
+        image (nibabel.Nifti1Image): Input image.
+
+    Returns:
+        SimpleITK.Image: Equivalent float32 image.
+
+    Raises:
+        ValueError: If the affine has a shear, which a SimpleITK direction cannot represent.
+    """
+    affine = np.diag([-1.0, -1.0, 1.0, 1.0]) @ image.affine
+    spacing = np.linalg.norm(affine[:3, :3], axis=0)
+    direction = affine[:3, :3] / spacing
+    if not np.allclose(direction.T @ direction, np.eye(3), atol=1e-4):
+        raise ValueError("The affine of the image is not a rotation and scaling")
+
+    result = sitk.GetImageFromArray(float32_data(image).transpose(2, 1, 0))
+    result.SetSpacing(spacing.tolist())
+    result.SetDirection(direction.ravel().tolist())
+    result.SetOrigin(affine[:3, 3].tolist())
+    return result
+
+
+def unambiguous_geometry(header):
+    """
+    Check whether the qform and sform of a NIfTI header describe the same geometry.
+
+    nibabel and SimpleITK choose between the two transforms with different rules, so an
+    image rebuilt from ``nibabel``'s affine only matches ``SimpleITK.ReadImage`` on the same
+    file when both transforms are set with the same code and agree.
+
+    Args:
+        header (nibabel.Nifti1Header): Header of the file.
+
+    Returns:
+        bool: True when the qform and sform codes are equal and non-zero and their matrices agree.
+    """
+    qform_code, sform_code = int(header["qform_code"]), int(header["sform_code"])
+    if qform_code != sform_code or qform_code == 0:
+        return False
+    return np.allclose(header.get_qform(), header.get_sform(), atol=1e-4)
+
+
+class InputVolume:
+    """
+    Input image of one subject, decoded once into float32 and shared by the loading stages.
+
+    The canonical copy saved for provenance and the image bias-corrected by N4 are built
+    from the same decoded array instead of reading and decompressing the file once per
+    consumer (nibabel, then SimpleITK) and going through float64 arrays.
+    """
+
+    def __init__(self, path):
+        """
+        Args:
+            path (str): Path to the input NIfTI file.
+        """
+        self.path = path
+        nii = nib.load(path)
+        self.header = nii.header
+        self.image = nib.squeeze_image(nib.Nifti1Image(nii.get_fdata(dtype=np.float32), nii.affine))
+
+    @cached_property
+    def canonical(self):
+        # RAS+ canonical orientation; flips and axis swaps are views of the decoded array
+        return nib.as_closest_canonical(self.image)
+
+    def to_sitk(self):
+        """
+        Return the input as a SimpleITK float32 image, in the orientation of the file.
+
+        Falls back to reading the file with SimpleITK when the geometry of the header is
+        ambiguous (see :func:`unambiguous_geometry`) or the affine cannot be converted, so that
+        N4 always sees the geometry that ``SimpleITK.ReadImage`` gives.
+
+        Returns:
+            SimpleITK.Image: The input image.
+        """
+        if not unambiguous_geometry(self.header):
+            return sitk.ReadImage(self.path, sitk.sitkFloat32)
+        try:
+            return nibabel_to_sitk(self.image)
+        except ValueError:
+            return sitk.ReadImage(self.path, sitk.sitkFloat32)
@@ -0,0 +1,146 @@
+import multiprocessing
+import os
+import queue
+from contextlib import contextmanager
+
+import torch
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+
+
+def available_cores():
+    """
+    Return the CPU cores the process may run on.
+
+    Returns:
+        list[int]: Sorted core indices (every core when the affinity cannot be queried).
+    """
+    if hasattr(os, "sched_getaffinity"):
+        return sorted(os.sched_getaffinity(0))
+    return list(range(os.cpu_count() or 1))
+
+
+def configure_threads(threads=None, interop_threads=None):
+    """
+    Set the number of threads used by torch in the calling process.
+
+    Args:
+        threads (int, optional): Intra-op threads (one forward pass). torch default when None.
+        interop_threads (int, optional): Inter-op threads. Only effective before torch runs
+            any parallel work, so it is set at startup. torch default when None.
+    """
+    if threads is not None:
+        torch.set_num_threads(threads)
+    if interop_threads is not None:
+        try:
+            torch.set_num_interop_threads(interop_threads)
+        except RuntimeError:
+            # Already started; keep the current inter-op pool
+            pass
+
+
+def worker_cores(index, threads, cores=None):
+    """
+    Return the cores assigned to one worker when pinning workers to disjoint core sets.
+
+    Args:
+        index (int): Index of the worker.
+        threads (int): Number of threads (and cores) per worker.
+        cores (list[int], optional): Cores to share out. Defaults to :func:`available_cores`.
+
+    Returns:
+        list[int]: Cores of the worker, wrapping around when there are more threads than cores.
+    """
+    cores = cores or available_cores()
+    return [cores[(index * threads + offset) % len(cores)] for offset in range(threads)]
+
+
+def pin_cores(cores):
+    """
+    Restrict the calling process to a set of cores (Linux only, ignored elsewhere).
+
+    Args:
+        cores (list[int]): Core indices.
+    """
+    if hasattr(os, "sched_setaffinity"):
+        os.sched_setaffinity(0, set(cores))
+
+
+def share_models(models):
+    """
+    Move the weights of CPU networks to shared memory before forking workers.
+
+    Forked workers then map the same weight pages instead of keeping copies of them.
+
+    Args:
+        models (iterable): Networks; those without ``share_memory`` (e.g. ONNX Runtime sessions) are skipped.
+    """
+    for model in models:
+        if hasattr(model, "share_memory"):
+            model.share_memory()
+
+
+@contextmanager
+def locked_append(path):
+    """
+    Open a file for appending, holding an exclusive lock so that processes do not interleave lines.
+
+    Args:
+        path (str): File to append to.
+
+    Yields:
+        file: The open file, positioned at its end.
+    """
+    with open(path, "a", newline="") as f:
+        if fcntl is not None:
+            fcntl.flock(f, fcntl.LOCK_EX)
+        try:
+            f.seek(0, os.SEEK_END)
+            yield f
+            f.flush()
+        finally:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+
+def run_workers(count, target, on_message=None):
+    """
+    Run a function in forked worker processes and relay their messages to the parent.
+
+    The workers are forked, so they share the memory of the parent (the loaded networks in
+    particular) without pickling it. Only the calling thread exists in a worker: thread pools
+    (e.g. the output writer) must be created inside ``target``.
+
+    Args:
+        count (int): Number of workers.
+        target (callable): ``target(index, send)`` run in worker ``index``; ``send(message)``
+            passes a picklable message to ``on_message`` in the parent.
+        on_message (callable, optional): Called in the parent with every message.
+
+    Returns:
+        list[int]: Exit code of every worker.
+    """
+    context = multiprocessing.get_context("fork")
+    messages = context.Queue()
+
+    def run(index):
+        target(index, messages.put)
+
+    processes = [context.Process(target=run, args=(index,), daemon=True) for index in range(count)]
+    for process in processes:
+        process.start()
+
+    while any(process.is_alive() for process in processes) or not messages.empty():
+        try:
+            message = messages.get(timeout=0.2)
+        except queue.Empty:
+            continue
+        if on_message is not None:
+            on_message(message)
+
+    for process in processes:
+        process.join()
+    return [process.exitcode for process in processes]
@@ -0,0 +1,148 @@
+import gzip
+import os
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import nibabel as nib
+
+# Streams available to compress .nii.gz files
+GZIP_ENGINES = ("zlib", "isal")
+
+
+def gzip_open(engine):
+    """
+    Return the ``open`` function of a gzip stream implementation.
+
+    Args:
+        engine (str): 'zlib' (standard library) or 'isal' (python-isal igzip, levels 0-3, several times faster).
+
+    Returns:
+        callable: ``open(path, mode, compresslevel)``.
+    """
+    if engine == "zlib":
+        return gzip.open
+    if engine == "isal":
+        try:
+            from isal import igzip
+        except ImportError as e:
+            raise ImportError("The isal gzip engine requires the 'isal' package (pip install isal).") from e
+        return igzip.open
+    raise ValueError(f"engine must be one of {set(GZIP_ENGINES)}")
+
+
+def save_image(image, path, compresslevel=1, engine="zlib"):
+    """
+    Save a NIfTI image, compressing ``.nii.gz`` files with the given level and engine.
+
+    The image is written with the data type of its header, so integer label maps are not upcast.
+
+    Args:
+        image (nibabel.Nifti1Image): Image to save.
+        path (str): Destination ``.nii`` or ``.nii.gz`` file.
+        compresslevel (int, optional): gzip compression level. Defaults to 1 (as nibabel).
+        engine (str, optional): gzip stream implementation (see GZIP_ENGINES). Defaults to 'zlib'.
+    """
+    if not path.endswith(".gz"):
+        nib.save(image, path)
+        return
+    with gzip_open(engine)(path, "wb", compresslevel=compresslevel) as f:
+        f.write(image.to_bytes())
+
+
+def write_image(image, path, writer=None):
+    """
+    Save an image through a write session, or synchronously with ``nibabel.save`` when there is none.
+
+    Args:
+        image (nibabel.Nifti1Image): Image to save.
+        path (str): Destination file.
+        writer (WriteSession, optional): Session queuing the save on the writer threads.
+    """
+    if writer is None:
+        nib.save(image, path)
+    else:
+        writer.save(image, path)
+
+
+class OutputWriter:
+    """
+    Background thread pool saving the NIfTI outputs of the pipeline.
+
+    Saves are queued with :meth:`WriteSession.save` and compressed on the writer threads,
+    so that the stage producing an image (e.g. inference) does not wait for gzip. Each
+    subject uses its own :class:`WriteSession` to wait for its files before it is reported
+    as done.
+    """
+
+    def __init__(self, threads=4, compresslevel=1, engine="zlib"):
+        """
+        Args:
+            threads (int, optional): Number of writer threads; 0 saves on the calling thread.
+            compresslevel (int, optional): gzip compression level of ``.nii.gz`` files.
+            engine (str, optional): gzip stream implementation (see GZIP_ENGINES).
+        """
+        gzip_open(engine)  # Fail early when the engine is not available
+        self.compresslevel = compresslevel
+        self.engine = engine
+        self.executor = ThreadPoolExecutor(max_workers=threads, thread_name_prefix="writer") if threads > 0 else None
+
+    def submit(self, image, path):
+        if self.executor is not None:
+            return self.executor.submit(save_image, image, path, self.compresslevel, self.engine)
+        future = Future()
+        try:
+            save_image(image, path, self.compresslevel, self.engine)
+            future.set_result(None)
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+    def session(self):
+        """
+        Start collecting the saves of one subject.
+
+        Returns:
+            WriteSession: The new session.
+        """
+        return WriteSession(self)
+
+    def close(self):
+        """Wait for the queued saves and stop the writer threads."""
+        if self.executor is not None:
+            self.executor.shutdown(wait=True)
+
+
+class WriteSession:
+    """Saves of one subject, queued on an :class:`OutputWriter`."""
+
+    def __init__(self, writer):
+        self.writer = writer
+        self.futures = []
+        self.lock = threading.Lock()
+
+    def save(self, image, path):
+        """
+        Queue the save of an image.
+
+        Args:
+            image (nibabel.Nifti1Image): Image to save. It must not be modified afterwards.
+            path (str): Destination file; its folder is created now.
+        """
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        future = self.writer.submit(image, path)
+        with self.lock:
+            self.futures.append(future)
+
+    def wait(self):
+        """
+        Wait until every queued save of the session is written.
+
+        Raises:
+            Exception: The first error raised by a save, once all saves have finished.
+        """
+        with self.lock:
+            futures, self.futures = self.futures, []
+        errors = [future.exception() for future in futures]
+        errors = [e for e in errors if e is not None]
+        if errors:
+            raise errors[0]
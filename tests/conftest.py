@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The pipeline modules are imported as in src/parcellation.py (``from utils... import ...``)
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "src"))
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+
+from utils.morphology import cross_dilation, cube_closing
+
+SHAPE = (24, 20, 28)
+
+
+def random_mask(seed, density=0.05, border=False):
+    rng = np.random.default_rng(seed)
+    mask = np.zeros(SHAPE, dtype=bool)
+    mask[4:-4, 5:-5, 3:-3] = rng.random((SHAPE[0] - 8, SHAPE[1] - 10, SHAPE[2] - 6)) < density * 8
+    mask |= rng.random(SHAPE) < density
+    if border:
+        # Touch the first and last slice of every axis
+        mask[0, 3:9, 4:12] = True
+        mask[-2:, :, -1] = True
+        mask[5:10, -1, 0] = True
+    return mask
+
+
+MASKS = {
+    "empty": np.zeros(SHAPE, dtype=bool),
+    "full": np.ones(SHAPE, dtype=bool),
+    "single": np.pad(np.ones((1, 1, 1), dtype=bool), ((10, 13), (7, 12), (20, 7))),
+    "sparse": random_mask(0),
+    "dense": random_mask(1, density=0.2),
+    "border": random_mask(2, border=True),
+    "border_dense": random_mask(3, density=0.3, border=True),
+}
+
+
+@pytest.mark.parametrize("iterations", [1, 3, 5])
+@pytest.mark.parametrize("name", list(MASKS))
+def test_cube_closing_matches_scipy(name, iterations):
+    mask = MASKS[name]
+    expected = ndimage.binary_closing(mask, structure=np.ones((3, 3, 3), dtype=bool), iterations=iterations)
+    result = cube_closing(mask, iterations=iterations)
+    assert result.dtype == bool and result.shape == mask.shape
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("iterations", [1, 3, 5])
+@pytest.mark.parametrize("name", list(MASKS))
+def test_cross_dilation_matches_scipy(name, iterations):
+    mask = MASKS[name]
+    expected = ndimage.binary_dilation(mask, iterations=iterations)
+    result = cross_dilation(mask, iterations=iterations)
+    assert result.dtype == bool and result.shape == mask.shape
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_inputs_are_not_modified():
+    mask = MASKS["border"].copy()
+    cube_closing(mask, iterations=3)
+    cross_dilation(mask, iterations=5)
+    np.testing.assert_array_equal(mask, MASKS["border"])
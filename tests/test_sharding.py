@@ -0,0 +1,57 @@
+import numpy as np
+import pytest
+
+torch = pytest.importorskip("torch")
+
+from utils.devices import DevicePool
+from utils.hemisphere import hemisphere
+from utils.parcellation import parcellation
+
+SHAPE = (20, 24, 28)
+
+
+def random_volume(seed):
+    rng = np.random.default_rng(seed)
+    volume = np.zeros(SHAPE, dtype=np.float32)
+    volume[3:-3, 4:-4, 5:-5] = rng.gamma(2.0, 50.0, size=(SHAPE[0] - 6, SHAPE[1] - 8, SHAPE[2] - 10))
+    return volume
+
+
+def random_network(in_channels, out_channels, seed):
+    # Small stand-in for the UNets: only the fusion of the views is under test
+    torch.manual_seed(seed)
+    return torch.nn.Sequential(
+        torch.nn.Conv2d(in_channels, 16, 3, padding=1),
+        torch.nn.ReLU(),
+        torch.nn.Conv2d(16, out_channels, 3, padding=1),
+    ).eval()
+
+
+def cpu_shards(network, members):
+    # Several shards on the CPU, which a DevicePool does not allow: threads of one process
+    # are enough to exercise the concurrent fusion of the views
+    return [(network, torch.device("cpu"))] * members
+
+
+@pytest.mark.parametrize("members", [2, 3])
+@pytest.mark.parametrize("fusion_dtype", ["float32", "float16", "uint8"])
+def test_parcellation_shards_match_sequential(fusion_dtype, members):
+    voxel, pnet = random_volume(0), random_network(4, 12, 0)
+    device = torch.device("cpu")
+    expected = parcellation(voxel, pnet, device, 4, fusion_dtype, n_classes=12)
+    result = parcellation(voxel, pnet, device, 4, fusion_dtype, n_classes=12, shards=cpu_shards(pnet, members))
+    np.testing.assert_array_equal(result, expected)
+
+
+@pytest.mark.parametrize("members", [2, 3])
+def test_hemisphere_shards_match_sequential(members):
+    voxel, hnet = random_volume(1), random_network(3, 3, 1)
+    device = torch.device("cpu")
+    expected = hemisphere(voxel, hnet, device, 4)
+    result = hemisphere(voxel, hnet, device, 4, shards=cpu_shards(hnet, members))
+    np.testing.assert_array_equal(result, expected)
+
+
+def test_pool_rejects_several_cpu_members():
+    with pytest.raises(ValueError):
+        DevicePool([torch.device("cpu"), torch.device("cpu")])
@@ -0,0 +1,51 @@
+import numpy as np
+import pytest
+
+nib = pytest.importorskip("nibabel")
+sitk = pytest.importorskip("SimpleITK")
+
+from utils.volume import InputVolume, unambiguous_geometry
+
+QFORM = np.array([[-1.0, 0.0, 0.0, 90.0], [0.0, 1.0, 0.0, -126.0], [0.0, 0.0, 1.2, -72.0], [0.0, 0.0, 0.0, 1.0]])
+# Same voxel size, rotated by 10 degrees about z and shifted
+ANGLE = np.deg2rad(10.0)
+ROTATION = np.array([[np.cos(ANGLE), -np.sin(ANGLE), 0.0, 0.0], [np.sin(ANGLE), np.cos(ANGLE), 0.0, 0.0], [0.0, 0.0, 1.0, 0.0], [0.0, 0.0, 0.0, 1.0]])
+SFORM = ROTATION @ QFORM + np.array([[0, 0, 0, 4.0], [0, 0, 0, -3.0], [0, 0, 0, 2.0], [0, 0, 0, 0]])
+
+
+def write_image(path, qform, qform_code, sform, sform_code):
+    rng = np.random.default_rng(0)
+    image = nib.Nifti1Image(rng.random((10, 12, 8), dtype=np.float32) * 100, None)
+    image.set_qform(qform, code=qform_code)
+    image.set_sform(sform, code=sform_code)
+    nib.save(image, str(path))
+    return str(path)
+
+
+def assert_same_image(result, expected):
+    np.testing.assert_allclose(result.GetOrigin(), expected.GetOrigin(), atol=1e-4)
+    np.testing.assert_allclose(result.GetSpacing(), expected.GetSpacing(), atol=1e-4)
+    np.testing.assert_allclose(result.GetDirection(), expected.GetDirection(), atol=1e-4)
+    np.testing.assert_allclose(sitk.GetArrayFromImage(result), sitk.GetArrayFromImage(expected), rtol=1e-6)
+
+
+@pytest.mark.parametrize(
+    "qform, qform_code, sform, sform_code",
+    [
+        (QFORM, 1, QFORM, 1),
+        (QFORM, 1, SFORM, 2),
+        (QFORM, 1, SFORM, 1),
+        (QFORM, 1, SFORM, 0),
+        (QFORM, 0, SFORM, 2),
+    ],
+    ids=["consistent", "different_codes", "different_matrices", "qform_only", "sform_only"],
+)
+def test_to_sitk_matches_sitk_reader(tmp_path, qform, qform_code, sform, sform_code):
+    path = write_image(tmp_path / "input.nii.gz", qform, qform_code, sform, sform_code)
+    assert_same_image(InputVolume(path).to_sitk(), sitk.ReadImage(path, sitk.sitkFloat32))
+
+
+def test_unambiguous_geometry(tmp_path):
+    assert unambiguous_geometry(nib.load(write_image(tmp_path / "a.nii", QFORM, 1, QFORM, 1)).header)
+    assert not unambiguous_geometry(nib.load(write_image(tmp_path / "b.nii", QFORM, 1, SFORM, 2)).header)
+    assert not unambiguous_geometry(nib.load(write_image(tmp_path / "c.nii", QFORM, 1, SFORM, 1)).header)